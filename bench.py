@@ -0,0 +1,295 @@
+"""Benchmark del pipeline de OCR, etapa por etapa.
+
+Corpus:
+- imágenes reales (archivos o carpetas que se pasen; por defecto ticket.jpg).
+  Si junto a `foto.jpg` hay un `foto.json` con {"store", "date", "total"},
+  se usa como verdad para medir la precisión.
+- tickets sintéticos dibujados aquí mismo, con varios tamaños de letra y
+  rotaciones, cuya verdad se conoce.
+
+Por imagen se mide por separado: decode, preprocess_for_ocr, ocr_image,
+extract_fields y save_ticket (contra una BD temporal), además de la ruta que
+usa el bot (extract_fields_report con la estrategia elegida). Se reporta
+p50/p95, throughput y precisión por campo, para que una optimización no
+empeore la extracción sin que se note. Con --mem, una pasada aparte (con
+tracemalloc, que frena mucho las etapas en Python) mide la memoria pico.
+
+    python bench.py                      # ticket.jpg + 12 sintéticos
+    python bench.py fotos/ --synthetic 30 --strategy sequential --json bench.json --mem
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+import pillow_heif
+
+from ocr import STRATEGIES, extract_fields, extract_fields_report, ocr_image, preprocess_for_ocr
+from db_utils import TicketWriter, _insert_ticket
+from ocr_worker import decode
+
+pillow_heif.register_heif_opener()
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".heic", ".heif")
+STAGES = ("decode", "preprocess", "ocr", "extract", "save")
+FIELDS = ("store", "date", "total")
+
+# Tamaños de letra (px) y rotaciones (grados) de los tickets sintéticos
+SYNTH_CHAR_HEIGHTS = (14, 22, 34)
+SYNTH_ROTATIONS = (0, 2.5, -6, 11)
+SYNTH_STORES = ("OXXO", "Walmart", "Soriana", "Chedraui", "Costco", "Starbucks")
+FONT_PATHS = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+    "/usr/share/fonts/TTF/DejaVuSansMono.ttf",
+    "/Library/Fonts/Courier New.ttf",
+)
+
+
+class Sample:
+    def __init__(self, name: str, data: bytes, truth: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.data = data
+        self.truth = truth
+
+
+# ===== Corpus =====
+
+def _font(size: int):
+    for path in FONT_PATHS:
+        if os.path.exists(path):
+            return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size=size)
+
+
+def render_receipt(rng: random.Random, char_height: int, rotation: float):
+    """Dibuja un ticket con datos aleatorios; devuelve (PNG en bytes, verdad)."""
+    store = rng.choice(SYNTH_STORES)
+    date = f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2019, 2025)}"
+    items = [(f"ARTICULO {i + 1:02d}", rng.randint(500, 25000) / 100) for i in range(rng.randint(3, 12))]
+    total = f"{sum(p for _, p in items):.2f}"
+    lines = [store, "AV CONSTITUCION 100 COL CENTRO", f"FECHA {date} {rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}", ""]
+    lines += [f"{name:<16}{price:>10.2f}" for name, price in items]
+    lines += ["", f"{'TOTAL $':<16}{total:>10}", "GRACIAS POR SU COMPRA"]
+
+    font = _font(int(char_height * 1.35))  # el alto de la mayúscula es ~0.73 del tamaño de la fuente
+    line_h = int(char_height * 2)
+    margin = char_height * 2
+    width = int(max(font.getlength(ln) for ln in lines)) + 2 * margin
+    height = line_h * len(lines) + 2 * margin
+    paper = Image.new("L", (width, height), 250)
+    draw = ImageDraw.Draw(paper)
+    for i, ln in enumerate(lines):
+        draw.text((margin, margin + i * line_h), ln, fill=20, font=font)
+
+    # Foto: ticket sobre fondo oscuro, girado y un poco borroso
+    canvas = Image.new("L", (int(width * 1.3), int(height * 1.15)), 70)
+    canvas.paste(paper, ((canvas.width - width) // 2, (canvas.height - height) // 2))
+    canvas = canvas.rotate(rotation, resample=Image.BICUBIC, expand=True, fillcolor=70)
+    canvas = canvas.filter(ImageFilter.GaussianBlur(0.6)).convert("RGB")
+    buf = io.BytesIO()
+    canvas.save(buf, "PNG")
+    return buf.getvalue(), {"store": store, "date": date, "total": total}
+
+
+def synthetic_corpus(n: int, seed: int = 0) -> List[Sample]:
+    rng = random.Random(seed)
+    combos = [(h, r) for h in SYNTH_CHAR_HEIGHTS for r in SYNTH_ROTATIONS]
+    samples = []
+    for i in range(n):
+        h, r = combos[i % len(combos)]
+        data, truth = render_receipt(rng, h, r)
+        samples.append(Sample(f"synth-{i:03d}-h{h}-r{r:g}", data, truth))
+    return samples
+
+
+def real_corpus(paths: List[str]) -> List[Sample]:
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            for dirpath, _, names in os.walk(p):
+                files += [os.path.join(dirpath, n) for n in sorted(names) if n.lower().endswith(IMAGE_EXTS)]
+        elif os.path.exists(p):
+            files.append(p)
+    samples = []
+    for f in files:
+        truth = None
+        sidecar = os.path.splitext(f)[0] + ".json"
+        if os.path.exists(sidecar):
+            with open(sidecar, encoding="utf-8") as fh:
+                truth = json.load(fh)
+        with open(f, "rb") as fh:
+            samples.append(Sample(f, fh.read(), truth))
+    return samples
+
+
+# ===== Medición =====
+
+def _same(field: str, got, want) -> bool:
+    if want is None:
+        return got is None
+    if got is None:
+        return False
+    if field == "total":
+        return abs(float(got) - float(want)) < 0.005
+    if field == "store":
+        return got.strip().lower() == want.strip().lower()
+    return got == want
+
+
+class Recorder:
+    """Acumula segundos y memoria pico por etapa, y aciertos por campo.
+
+    Tiempos y memoria se miden en pasadas distintas: con `tracing` (tracemalloc
+    encendido) solo se anota el pico, porque el rastreo multiplica el tiempo de
+    las etapas en Python y no el de las nativas. El pico cuenta Python y numpy,
+    pero no los búferes nativos de PIL ni de Tesseract; para esos está el RSS
+    máximo del proceso.
+    """
+
+    def __init__(self):
+        self.times: Dict[str, List[float]] = {}
+        self.peaks: Dict[str, int] = {}
+        self.hits: Dict[str, Dict[str, int]] = {}
+        self.graded: Dict[str, int] = {}
+        self.tracing = False
+
+    def measure(self, stage: str, fn, *args):
+        if not self.tracing:
+            t0 = time.perf_counter()
+            out = fn(*args)
+            self.times.setdefault(stage, []).append(time.perf_counter() - t0)
+            return out
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        out = fn(*args)
+        peak = tracemalloc.get_traced_memory()[1] - base
+        self.peaks[stage] = max(self.peaks.get(stage, 0), peak)
+        return out
+
+    def grade(self, path: str, fields, truth):
+        if truth is None or self.tracing:
+            return
+        self.graded[path] = self.graded.get(path, 0) + 1
+        hits = self.hits.setdefault(path, dict.fromkeys(FIELDS, 0))
+        for name, got in zip(FIELDS, fields):
+            hits[name] += _same(name, got, truth.get(name))
+
+
+def _pass(rec: Recorder, samples: List[Sample], strategy: str, writer: TicketWriter):
+    for s in samples:
+        img = rec.measure("decode", decode, s.data)
+        pre = rec.measure("preprocess", preprocess_for_ocr, img)
+        text = rec.measure("ocr", ocr_image, pre)
+        fields = rec.measure("extract", extract_fields, text)
+        rec.measure("save", lambda f: writer.submit(_insert_ticket(*f, "MXN", text)).result(), fields)
+        rec.grade("stages", fields, s.truth)
+        # La ruta del bot: geometría compartida + estrategia (relecturas, segunda pasada...)
+        result = rec.measure(f"report[{strategy}]", extract_fields_report, img, strategy)
+        rec.grade(f"report[{strategy}]", (result.store, result.date, result.total), s.truth)
+
+
+def run(samples: List[Sample], strategy: str, repeat: int = 1, mem: bool = False) -> Recorder:
+    """`repeat` pasadas cronometradas y, con `mem`, una más con tracemalloc para la memoria pico."""
+    rec = Recorder()
+    tmp = tempfile.TemporaryDirectory()
+    writer = TicketWriter(os.path.join(tmp.name, "bench.db"))
+    try:
+        for _ in range(repeat):
+            _pass(rec, samples, strategy, writer)
+        if mem:
+            rec.tracing = True
+            tracemalloc.start()
+            try:
+                _pass(rec, samples, strategy, writer)
+            finally:
+                tracemalloc.stop()
+                rec.tracing = False
+    finally:
+        writer.close()
+        tmp.cleanup()
+    return rec
+
+
+def _pct(values: List[float], q: float) -> float:
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def summarize(rec: Recorder, n_images: int, wall: float) -> dict:
+    stages = {}
+    for stage, values in rec.times.items():
+        stages[stage] = {
+            "n": len(values),
+            "p50_ms": _pct(values, 50) * 1000,
+            "p95_ms": _pct(values, 95) * 1000,
+            "mean_ms": statistics.fmean(values) * 1000,
+            "peak_mb": rec.peaks[stage] / 2**20 if stage in rec.peaks else None,
+        }
+    pipeline = sum(sum(rec.times[s]) for s in STAGES if s in rec.times)
+    accuracy = {
+        path: {f: rec.hits[path][f] / n for f in FIELDS} | {"all": sum(rec.hits[path].values()) / (3 * n)}
+        for path, n in rec.graded.items()
+    }
+    # ru_maxrss está en KiB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / 2**20 if sys.platform == "darwin" else rss / 1024
+    return {
+        "images": n_images,
+        "wall_s": wall,
+        "stages_img_per_s": n_images / pipeline if pipeline else 0.0,
+        "stages": stages,
+        "accuracy": accuracy,
+        "max_rss_mb": rss_mb,
+    }
+
+
+def print_report(summary: dict):
+    print(f"\n📊 {summary['images']} imágenes en {summary['wall_s']:.1f}s | "
+          f"decode→save: {summary['stages_img_per_s']:.2f} img/s | RSS máx: {summary['max_rss_mb']:.0f} MB\n")
+    print(f"{'etapa':<24}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'media ms':>10}{'pico MB':>10}")
+    for stage, st in summary["stages"].items():
+        peak = "—" if st["peak_mb"] is None else f"{st['peak_mb']:.1f}"
+        print(f"{stage:<24}{st['n']:>5}{st['p50_ms']:>10.1f}{st['p95_ms']:>10.1f}{st['mean_ms']:>10.1f}{peak:>10}")
+    if summary["accuracy"]:
+        print(f"\n{'precisión':<24}" + "".join(f"{f:>10}" for f in FIELDS + ("all",)))
+        for path, acc in summary["accuracy"].items():
+            print(f"{path:<24}" + "".join(f"{acc[f]:>10.0%}" for f in FIELDS + ("all",)))
+    else:
+        print("\n(sin verdad: agrega .json junto a las fotos o usa --synthetic)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de OCR por etapas.")
+    parser.add_argument("paths", nargs="*", default=["ticket.jpg"], help="imágenes reales o carpetas")
+    parser.add_argument("--synthetic", type=int, default=12, help="tickets sintéticos a generar")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="veces que se recorre el corpus")
+    parser.add_argument("--strategy", default="layout", choices=STRATEGIES, help="estrategia para la ruta del bot")
+    parser.add_argument("--json", help="además guarda el resumen en este archivo")
+    parser.add_argument("--mem", action="store_true", help="pasada extra con tracemalloc para la memoria pico por etapa")
+    args = parser.parse_args()
+
+    samples = real_corpus(args.paths) + synthetic_corpus(args.synthetic, args.seed)
+    if not samples:
+        parser.error("corpus vacío")
+    t0 = time.perf_counter()
+    rec = run(samples, args.strategy, args.repeat, args.mem)
+    summary = summarize(rec, len(samples) * args.repeat, time.perf_counter() - t0)
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(summary, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
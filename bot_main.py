@@ -1,9 +1,13 @@
+import time
+
+_T0 = time.perf_counter()  # para reportar cuánto tarda el bot en importar (ver IMPORT_SECONDS)
+import asyncio
+import datetime
 import io
 import logging
-from dataclasses import dataclass
-from typing import Optional, Tuple
+import sqlite3
+import tempfile
 
-from PIL import Image
 from dotenv import load_dotenv
 import os
 
@@ -12,26 +16,30 @@ from telegram import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
-    ConversationHandler,
     ContextTypes,
     filters,
 )
 
 # --- Tu código local ---
-from ocr import extract_fields_safely  # usamos tu OCR ya creado
-from db_utils import save_ticket       # función para guardar en SQLite
-print("✅ Módulos importados correctamente.")
+# OCR en un pool de procesos; numpy, cv2 y Tesseract solo se importan dentro de los workers
+from ocr_pool import OCRCancelled, OCRExecutor, OCRQueueFull, OCRRateLimited, UnsupportedImage
+from db_utils import save_ticket_async, save_tickets_async, cache_get, cache_put, cache_touch, close_writer, get_writer, month_summary, search_tickets, find_duplicate  # SQLite: tickets y caché de OCR
+from db_init import to_iso_date, to_cents, from_cents, from_iso_date
+import metrics  # histogramas por etapa y endpoint /metrics (Prometheus)
+from export import FORMATS as EXPORT_FORMATS, HAS_PARQUET, export_tickets  # /exportar (CSV o Parquet)
+from drafts import MAX_ALBUM, AlbumState, DraftStore, TicketDraft  # borradores compartidos entre procesos
+from extractor import variant_used_pre  # misma regla para lo que sale de la caché
+IMPORT_SECONDS = time.perf_counter() - _T0
 
 # ===== Config & logging =====
 load_dotenv()
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-if not BOT_TOKEN:
-    raise RuntimeError("Falta TELEGRAM_BOT_TOKEN en .env")
+BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")  # se revisa en main(): importar el módulo no lo exige
 
 logging.basicConfig(
     format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
@@ -39,52 +47,211 @@ logging.basicConfig(
 )
 logger = logging.getLogger("bot-ocr-tickets")
 
-# ===== Conversación =====
-CHOOSING, EDITING = range(2)
+# Pool de OCR: por defecto un worker por núcleo y una fila de 4 trabajos por worker
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0")) or None
+OCR_QUEUE_MAX = int(os.getenv("OCR_QUEUE_MAX", "0")) or None
+# Reparto justo: cada usuario tiene su fila y los workers se turnan entre usuarios.
+# Trabajos de un usuario corriendo a la vez (por defecto todos los workers menos uno)
+OCR_USER_CONCURRENCY = int(os.getenv("OCR_USER_CONCURRENCY", "0")) or None
+# Límite por usuario: tickets por minuto (0 = sin límite) y ráfaga máxima (un álbum trae hasta 10)
+OCR_USER_RATE = float(os.getenv("OCR_USER_RATE", "30"))
+OCR_USER_BURST = int(os.getenv("OCR_USER_BURST", "10"))
+# Estrategia de OCR (ver ocr.STRATEGIES); por defecto layout: relee solo las regiones dudosas
+OCR_STRATEGY = os.getenv("OCR_STRATEGY", "layout")
+# Cada worker se calienta al arrancar con una lectura diminuta (OCR_WARMUP=0 lo apaga)
+OCR_WARMUP = os.getenv("OCR_WARMUP", "1") not in ("", "0", "false", "no")
+ocr_executor = OCRExecutor(
+    workers=OCR_WORKERS, max_queue=OCR_QUEUE_MAX, user_concurrency=OCR_USER_CONCURRENCY,
+    user_rate=OCR_USER_RATE, user_burst=OCR_USER_BURST, warm_strategy=OCR_STRATEGY if OCR_WARMUP else None,
+)
+
+# /metrics corre en otro hilo: lee la copia de snapshot(), nunca las filas del pool
+metrics.gauge("ocr_jobs_pending", "Trabajos de OCR en el pool (corriendo + en fila)",
+              lambda: ocr_executor.snapshot().pending)
+metrics.gauge("ocr_queue_depth", "Trabajos de OCR esperando un worker libre", lambda: ocr_executor.snapshot().waiting)
+metrics.gauge("ocr_users_waiting", "Usuarios con trabajos de OCR en espera",
+              lambda: ocr_executor.snapshot().users_waiting)
+metrics.gauge("bot_import_seconds", "Segundos que tardó el bot en importar sus módulos", lambda: IMPORT_SECONDS)
+
+# Modo de servicio: polling (por defecto) o webhook, con servidor HTTP embebido que
+# recibe cada actualización en cuanto Telegram la envía (requiere python-telegram-bot[webhooks])
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # URL pública que registra Telegram, p. ej. https://tickets.example.com/telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Telegram lo manda en cada POST; se rechaza lo que no lo traiga
+# Actualizaciones que se procesan a la vez (las fotos además no bloquean: ver block=False)
+CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "32"))
+# Otra Bot API (servidor propio o fake_telegram.py para pruebas), p. ej. http://127.0.0.1:8081
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Resolución: de las versiones de una foto se descarga la más chica cuyo alto (lado mayor)
+# llegue a PHOTO_TARGET_HEIGHT; solo si la lectura sale incompleta o con confianza media
+# menor a PHOTO_ESCALATE_CONF se descarga y se lee la más grande
+PHOTO_TARGET_HEIGHT = int(os.getenv("PHOTO_TARGET_HEIGHT", "1200"))
+PHOTO_ESCALATE_CONF = float(os.getenv("PHOTO_ESCALATE_CONF", os.getenv("OCR_LOW_CONF", "60")))
+# Imágenes enviadas como archivo (sin versiones reducidas): se decodifican a este lado mayor
+DOC_MAX_SIDE = int(os.getenv("DOC_MAX_SIDE", "2560"))
+# Resultados que muestra /buscar
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "10"))
+# /exportar: Telegram no deja que un bot envíe archivos de más de 50 MB
+EXPORT_MAX_MB = float(os.getenv("EXPORT_MAX_MB", "50"))
+# Álbumes: se espera este tiempo (s) sin fotos nuevas del mismo media_group_id antes de leerlas
+ALBUM_WAIT = float(os.getenv("ALBUM_WAIT", "1.0"))
+# Solo pedimos lo que manejamos: mensajes y botones
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
 
-@dataclass
-class TicketDraft:
-    store: Optional[str] = None
-    date: Optional[str] = None
-    total: Optional[str] = None
-    currency: str = "MXN"
-    raw_text: Optional[str] = None
-    used_pre: bool = True
+# ===== Conversación =====
+# El estado vive en el borrador (drafts.py), no en la memoria del proceso: cualquier
+# worker del bot puede atender los botones o el texto de cualquier usuario.
+drafts = DraftStore()
 
 def summary_md(td: TicketDraft) -> str:
     return (
         "**Vista previa del ticket**\n\n"
-        f"🏬 *Tienda:* {td.store or '—'}\n"
+        f"🏬 *Tienda:* {escape_markdown(td.store or '—')}\n"
         f"📅 *Fecha:* {td.date or '—'}\n"
         f"💵 *Total:* {td.total or '—'} {td.currency}\n"
     )
 
-def confirm_keyboard() -> InlineKeyboardMarkup:
+def busy_text(position: int) -> str:
+    return (
+        f"🚦 Estoy muy ocupado, serías el #{position} en la fila. "
+        "Intenta de nuevo en un momento."
+    )
+
+def slow_down_text(retry_after: float) -> str:
+    return (
+        f"🐢 Vas muy rápido: leo hasta {OCR_USER_RATE:g} tickets por minuto por persona. "
+        f"Intenta de nuevo en {max(1, round(retry_after))} s."
+    )
+
+async def _reject(message, e: Exception, n: int = 1):
+    """Respuesta inmediata cuando el pool no acepta la foto (fila llena o límite del usuario)."""
+    if isinstance(e, OCRRateLimited):
+        metrics.RATE_LIMITED.inc(amount=n)
+        await message.reply_text(slow_down_text(e.retry_after))
+    else:
+        metrics.QUEUE_REJECTED.inc(amount=n)
+        await message.reply_text(busy_text(e.position))
+
+def duplicate_md(dup) -> str:
+    _, date, store, cents, kind = dup
+    how = "con la misma tienda, fecha y total" if kind == "exact" else "con un texto casi idéntico"
+    return (
+        f"\n⚠️ *Parece repetido:* ya guardaste un ticket {how} "
+        f"({escape_markdown(store or '—')}, {from_iso_date(date) or '—'}, {from_cents(cents) or '—'})."
+    )
+
+def confirm_keyboard(duplicate: bool = False) -> InlineKeyboardMarkup:
     kb = [
         [
-            InlineKeyboardButton("✅ Confirmar", callback_data="confirm"),
+            InlineKeyboardButton("⚠️ Guardar de todos modos" if duplicate else "✅ Confirmar", callback_data="confirm"),
             InlineKeyboardButton("✏️ Editar", callback_data="edit"),
         ],
         [InlineKeyboardButton("❌ Cancelar", callback_data="cancel")],
     ]
     return InlineKeyboardMarkup(kb)
 
-def edit_field_keyboard() -> InlineKeyboardMarkup:
+def edit_field_keyboard(slot: int = None) -> InlineKeyboardMarkup:
+    # Sin slot: foto suelta; con slot: un ticket de un álbum (callbacks "a:<slot>:<campo>")
+    if slot is None:
+        data = {"store": "edit_store", "date": "edit_date", "total": "edit_total", "back": "back_to_confirm"}
+    else:
+        data = {f: f"a:{slot}:{f}" for f in ("store", "date", "total")} | {"back": "a:back"}
     kb = [
         [
-            InlineKeyboardButton("Tienda", callback_data="edit_store"),
-            InlineKeyboardButton("Fecha", callback_data="edit_date"),
-            InlineKeyboardButton("Total", callback_data="edit_total"),
+            InlineKeyboardButton("Tienda", callback_data=data["store"]),
+            InlineKeyboardButton("Fecha", callback_data=data["date"]),
+            InlineKeyboardButton("Total", callback_data=data["total"]),
         ],
-        [InlineKeyboardButton("⬅️ Volver", callback_data="back_to_confirm")],
+        [InlineKeyboardButton("⬅️ Volver", callback_data=data["back"])],
+    ]
+    return InlineKeyboardMarkup(kb)
+
+FIELD_PROMPTS = {
+    "store": "Escribe el *nombre de la tienda*:",
+    "date": "Escribe la *fecha* con formato **DD/MM/AAAA**:",
+    "total": "Escribe el *total* (solo número, ej. `101.00`):",
+}
+
+EXPIRED_SLOT = "ya expiró (vuelve a enviar la foto)"
+
+def album_md(tds, album: AlbumState) -> str:
+    lines = [f"**Vista previa: {album.n} tickets**\n"]
+    for i, td in enumerate(tds):
+        mark = "✅" if album.is_included(i) else "⬜"
+        if td is None:  # el borrador de este ticket caducó (DRAFT_TTL)
+            lines.append(f"{mark} *{i + 1}.* {EXPIRED_SLOT}")
+            continue
+        lines.append(
+            f"{mark} *{i + 1}.* {escape_markdown(td.store or '—')} | {td.date or '—'} | {td.total or '—'} {td.currency}"
+        )
+    lines.append("\nMarca los que quieres guardar, edita los que haga falta y guarda todos juntos.")
+    return "\n".join(lines)
+
+def album_keyboard(album: AlbumState) -> InlineKeyboardMarkup:
+    kb = [
+        [
+            InlineKeyboardButton(f"{'✅' if album.is_included(i) else '⬜'} {i + 1}", callback_data=f"a:{i}:toggle"),
+            InlineKeyboardButton(f"✏️ {i + 1}", callback_data=f"a:{i}:edit"),
+        ]
+        for i in range(album.n)
     ]
+    kb.append([
+        InlineKeyboardButton(f"💾 Guardar ({len(album.slots())})", callback_data="a:save"),
+        InlineKeyboardButton("❌ Cancelar", callback_data="a:cancel"),
+    ])
     return InlineKeyboardMarkup(kb)
 
+async def _find_duplicate(user_id: int, td: TicketDraft, raw_text: str):
+    # Igual que la caché: si la BD falla, se muestra la vista previa sin el aviso
+    try:
+        return await asyncio.to_thread(find_duplicate, user_id, td.store, td.date, td.total, raw_text)
+    except sqlite3.Error as e:
+        logger.warning("No pude buscar repetidos: %s", e)
+        return None
+
+async def confirm_view(user_id: int, td: TicketDraft, raw_text: str = None) -> dict:
+    """Resumen + teclado de confirmación; si el ticket parece repetido, con aviso."""
+    if raw_text is None:
+        raw_text = await drafts.raw_text(user_id)
+    dup = await _find_duplicate(user_id, td, raw_text)
+    return dict(
+        text=summary_md(td) + (duplicate_md(dup) if dup else ""),
+        reply_markup=confirm_keyboard(duplicate=dup is not None),
+        parse_mode="Markdown",
+    )
+
+async def _cache_get(**key):
+    # La caché es una optimización: si la BD falla, seguimos con OCR normal. Va en un hilo:
+    # con el escritor ocupado la lectura puede esperar hasta el timeout de SQLite
+    try:
+        hit = await asyncio.to_thread(cache_get, **key)
+        if hit:
+            cache_touch(hit[-1])  # sin esperar: el LRU se actualiza en el siguiente lote del escritor
+        return hit
+    except sqlite3.Error as e:
+        logger.warning("Caché de OCR no disponible: %s", e)
+        return None
+
+def _cache_put(result, file_unique_id: str):
+    # No esperamos: el escritor compartido lo guarda en el siguiente lote
+    try:
+        cache_put(
+            result.image_hash, result.store, result.date, result.total,
+            result.text, result.variant, file_unique_id=file_unique_id,
+        )
+    except sqlite3.Error as e:
+        logger.warning("No pude guardar en la caché de OCR: %s", e)
+
 # ===== Handlers =====
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "¡Hola! 👋 Envíame una *foto del ticket*.\n\n"
-        "Yo haré OCR y te mostraré los datos para confirmar o editar antes de guardar.",
+        "Yo haré OCR y te mostraré los datos para confirmar o editar antes de guardar.\n"
+        "Con /resumen ves cuánto llevas gastado este mes, con /buscar encuentras un ticket por su texto "
+        "y con /exportar te mando todos tus tickets en un archivo.",
         parse_mode="Markdown",
     )
 
@@ -95,26 +262,145 @@ async def responder_hola(update, context):
     elif "gracias" in text or "thank you" in text:
         await update.message.reply_text("¡De nada! 😊 Si necesitas algo más, solo envíame otra foto.")
 
+async def _lookup_cache(photo, stages: dict):
+    # Caché: si ya vimos este archivo, no lo descargamos ni lo volvemos a leer
+    t0 = time.perf_counter()
+    hit = await _cache_get(file_unique_id=photo.file_unique_id)
+    stages["cache_lookup"] = time.perf_counter() - t0
+    metrics.CACHE_LOOKUPS.inc("file_id", "hit" if hit else "miss")
+    if hit:
+        logger.info("OCR desde caché (file_unique_id=%s)", photo.file_unique_id)
+    return hit
+
+def pick_photo_size(sizes):
+    """La versión más chica que llega a PHOTO_TARGET_HEIGHT (o la más grande si ninguna)."""
+    ordered = sorted(sizes, key=lambda s: s.width * s.height)
+    for size in ordered:
+        if max(size.width, size.height) >= PHOTO_TARGET_HEIGHT:
+            return size
+    return ordered[-1]
+
+def _weak(result) -> bool:
+    return result.score < 3 or (result.confidence is not None and result.confidence < PHOTO_ESCALATE_CONF)
+
+async def _download(photo, stages: dict, stage: str = "download") -> bytes:
+    t0 = time.perf_counter()
+    file = await photo.get_file()
+    bio = io.BytesIO()
+    await file.download_to_memory(out=bio)
+    stages[stage] = time.perf_counter() - t0
+    return bio.getvalue()
+
+async def _escalate(sizes, photo, result, stages: dict, user_id: int):
+    """Si la versión reducida se leyó mal, repite con la más grande y se queda con la mejor.
+
+    Devuelve el resultado elegido; si cambió, también queda en caché bajo `photo`
+    para que el mismo archivo no vuelva a escalar.
+    """
+    largest = max(sizes, key=lambda s: s.width * s.height) if sizes else None
+    if largest is None or largest.file_unique_id == photo.file_unique_id or not _weak(result):
+        return result
+    data = await _download(largest, stages, "download_full")
+    t0 = time.perf_counter()
+    try:
+        # Relectura de una foto ya cobrada: no gasta fichas del límite del usuario
+        full = await ocr_executor.extract(data, OCR_STRATEGY, user=user_id, cost=0)
+    except OCRQueueFull:
+        return result  # sin lugar en el pool: nos quedamos con la primera lectura
+    stages["ocr_full"] = time.perf_counter() - t0
+    _cache_put(full, largest.file_unique_id)
+    better = (full.score, full.confidence or 0.0) >= (result.score, result.confidence or 0.0)
+    metrics.PHOTO_ESCALATIONS.inc("better" if better else "same")
+    logger.info(
+        "Escalé a %dx%d: %d/3 → %d/3 campos, confianza %.0f → %.0f", largest.width, largest.height,
+        result.score, full.score, result.confidence or 0.0, full.confidence or 0.0,
+    )
+    if not better:
+        return result
+    _cache_put(full, photo.file_unique_id)
+    return full
+
+def _ocr_done(result, photo, stages: dict, t_submit: float):
+    """Métricas, log y caché de un OCR terminado."""
+    # Lo que no pasó dentro del worker fue fila del pool + envío de bytes entre procesos
+    stages["ocr_queue"] = max(0.0, time.perf_counter() - t_submit - result.timings.get("worker", 0.0))
+    metrics.CACHE_LOOKUPS.inc("pixels", "hit" if result.cached else "miss")
+    if not result.cached:
+        metrics.OCR_VARIANT.inc(result.variant)
+    logger.info(
+        "OCR listo: %s '%s' (%d/3 campos) | %s",
+        "caché por hash," if result.cached else "ganó",
+        result.variant, result.score,
+        " ".join(f"{v}={dt * 1000:.0f}ms" for v, dt in result.timings.items()),
+    )
+    _cache_put(result, photo.file_unique_id)
+
+def _observe(user_id, photo, hit, result, fields, stages: dict):
+    if result is not None:
+        stages.update(result.timings)
+    metrics.observe_stages(stages)
+    if metrics.TRACE:
+        logger.info(
+            "trace ticket user=%s file=%s cache=%s variant=%s score=%d/3 %s",
+            user_id, photo.file_unique_id,
+            "file_id" if hit else ("pixels" if result.cached else "miss"),
+            result.variant if result else "-", sum(x is not None for x in fields[:3]),
+            " ".join(f"{k}={v * 1000:.0f}ms" for k, v in stages.items()),
+        )
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Recibe la foto, hace OCR y prepara el borrador."""
+    """Recibe la foto (o la imagen enviada como archivo), hace OCR y prepara el borrador."""
     try:
-        if not update.message or not update.message.photo:
+        if not update.message or not (update.message.photo or update.message.document):
+            return
+        if update.message.photo and update.message.media_group_id:
+            _collect_album(update, context)
             return
 
-        # 1) Descargar la versión de mayor resolución
-        photo = update.message.photo[-1]
-        file = await photo.get_file()
-        bio = io.BytesIO()
-        await file.download_to_memory(out=bio)
-        bio.seek(0)
-
-        # 2) Abrir con PIL
-        img = Image.open(bio).convert("RGB")
-
-        # 3) OCR con tu helper de 'intento doble'
-        store, date, total, text, used_pre = extract_fields_safely(img)
-
-        # 4) Guardar draft en user_data
+        if update.message.photo:
+            sizes = update.message.photo
+            photo, max_side = pick_photo_size(sizes), None
+        else:
+            sizes = ()
+            photo, max_side = update.message.document, DOC_MAX_SIDE
+        user_id = update.effective_user.id
+        t_start = time.perf_counter()
+        stages = {}  # etapas medidas en este proceso (las del worker vienen en result.timings)
+
+        # 0) Caché por file_unique_id
+        hit = await _lookup_cache(photo, stages)
+        result = None
+        if hit:
+            store, date, total, text, variant, _ = hit
+            used_pre = variant_used_pre(variant)
+        else:
+            # 1) Backpressure: si la fila está llena o el usuario rebasó su límite, contestamos de inmediato
+            try:
+                ocr_executor.check(user_id)
+            except (OCRQueueFull, OCRRateLimited) as e:
+                await _reject(update.message, e)
+                return
+            position = ocr_executor.queue_position(user_id)
+            if position:
+                await update.message.reply_text(f"⏳ Estoy procesando otros tickets, eres el #{position} en la fila.")
+
+            # 2) Descargar la versión más chica que alcanza para leer el ticket
+            data = await _download(photo, stages)
+
+            # 3) OCR con tu helper de 'intento doble' en el pool (no bloquea el loop).
+            #    El worker también busca en caché por hash de píxeles.
+            t0 = time.perf_counter()
+            try:
+                result = await ocr_executor.extract(data, OCR_STRATEGY, max_side, user=user_id)
+            except (OCRQueueFull, OCRRateLimited) as e:
+                await _reject(update.message, e)
+                return
+            _ocr_done(result, photo, stages, t0)
+            # Lectura floja: se repite con la versión más grande
+            result = await _escalate(sizes, photo, result, stages, user_id)
+            store, date, total, text, used_pre = result.as_tuple()
+
+        # 4) Guardar el borrador (el texto del OCR va aparte y solo se lee al confirmar)
         td = TicketDraft(
             store=store,
             date=date,
@@ -122,21 +408,211 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             raw_text=text,
             used_pre=used_pre,
         )
-        context.user_data["draft"] = td
-
-        # 5) Mostrar resumen + botones
+        await drafts.put(user_id, td)
+
+        # 5) Mostrar resumen + botones (con aviso si ya guardó este ticket)
+        await update.message.reply_text(**await confirm_view(user_id, td, text))
+        stages["total"] = time.perf_counter() - t_start
+        _observe(user_id, photo, hit, result, (store, date, total), stages)
+    except OCRCancelled:
+        logger.info("OCR cancelado por el usuario %s", update.effective_user.id)  # /cancel ya le contestó
+    except UnsupportedImage as e:
+        logger.warning("Imagen sin soporte: %s", e)
         await update.message.reply_text(
-            summary_md(td),
-            reply_markup=confirm_keyboard(),
-            parse_mode="Markdown",
+            "📷 No puedo leer imágenes HEIC/HEIF en este servidor. "
+            "Envíala como foto (no como archivo) o conviértela a JPG/PNG."
         )
-        return CHOOSING
     except Exception as e:
         logger.exception("Error procesando foto: %s", e)
         await update.message.reply_text(
             "😬 Hubo un error procesando la imagen. Intenta con otra foto o envíala como archivo."
         )
 
+# ===== Álbumes =====
+# Telegram manda cada foto de un álbum como un update aparte con el mismo media_group_id.
+# Se juntan en memoria hasta ALBUM_WAIT sin fotos nuevas y se leen como un lote.
+# (Con varios procesos del bot, las fotos de un álbum deben llegar al mismo proceso.)
+_albums = {}  # (user_id, media_group_id) -> {"messages": [...], "dropped": n, "deadline": monotonic}
+
+def _collect_album(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    key = (update.effective_user.id, update.message.media_group_id)
+    buf = _albums.get(key)
+    if buf is None:
+        buf = _albums[key] = {"messages": [], "dropped": 0, "deadline": 0.0}
+        context.application.create_task(_album_after_wait(key, buf))  # un solo temporizador por álbum
+    if len(buf["messages"]) < MAX_ALBUM:
+        buf["messages"].append(update.message)
+    else:
+        buf["dropped"] += 1  # no caben en el registro del álbum (ver drafts.AlbumState)
+    buf["deadline"] = time.monotonic() + ALBUM_WAIT  # llegó otra foto: se recorre la espera
+
+async def _album_after_wait(key, buf):
+    while (wait := buf["deadline"] - time.monotonic()) > 0:
+        await asyncio.sleep(wait)
+    if _albums.get(key) is not buf:
+        return  # /cancel lo descartó mientras esperaba
+    del _albums[key]  # desde aquí ya no se cancela: otra foto abriría un álbum nuevo
+    messages = sorted(buf["messages"], key=lambda m: m.message_id)
+    try:
+        if buf["dropped"]:
+            await messages[0].reply_text(
+                f"⚠️ Solo leo {MAX_ALBUM} fotos por álbum; {buf['dropped']} se quedaron fuera. "
+                "Envíalas en otro mensaje."
+            )
+        await _process_album(key[0], messages)
+    except Exception as e:
+        logger.exception("Error procesando álbum: %s", e)
+        await messages[0].reply_text("😬 Hubo un error procesando el álbum. Intenta de nuevo.")
+
+async def _process_album(user_id: int, messages):
+    """Caché, descargas y OCR en paralelo de todas las fotos; una sola vista previa."""
+    t_start = time.perf_counter()
+    photos = [pick_photo_size(m.photo) for m in messages]
+    stages = [{} for _ in photos]
+    hits = await asyncio.gather(*(_lookup_cache(p, st) for p, st in zip(photos, stages)))
+    fields, results = [None] * len(photos), [None] * len(photos)
+    for i, hit in enumerate(hits):
+        if hit:
+            store, date, total, text, variant, _ = hit
+            fields[i] = (store, date, total, text, variant_used_pre(variant))
+
+    missing = [i for i, hit in enumerate(hits) if not hit]
+    if missing:
+        try:
+            ocr_executor.check(user_id, len(missing))
+        except (OCRQueueFull, OCRRateLimited) as e:
+            await _reject(messages[0], e, len(missing))
+            return
+        position = ocr_executor.queue_position(user_id)
+        await messages[0].reply_text(
+            f"⏳ Leyendo {len(photos)} tickets..." + (f" (eres el #{position} en la fila)" if position else "")
+        )
+        datas = await asyncio.gather(*(_download(photos[i], stages[i]) for i in missing))
+        t0 = time.perf_counter()
+        try:
+            ocr_results = await ocr_executor.extract_many(datas, OCR_STRATEGY, user=user_id)
+        except (OCRQueueFull, OCRRateLimited) as e:
+            await _reject(messages[0], e, len(missing))
+            return
+        if any(isinstance(res, OCRCancelled) for res in ocr_results):
+            logger.info("Álbum cancelado por el usuario %s", user_id)
+            return
+        for i, res in zip(missing, ocr_results):
+            if isinstance(res, Exception):
+                logger.warning("OCR falló en la foto %d del álbum: %s", i + 1, res)
+                fields[i] = (None, None, None, None, True)
+            else:
+                results[i] = res
+                _ocr_done(res, photos[i], stages[i], t0)
+        # Las lecturas flojas se repiten (en paralelo) con la versión más grande de su foto
+        ok = [i for i in missing if results[i] is not None]
+        escalated = await asyncio.gather(
+            *(_escalate(messages[i].photo, photos[i], results[i], stages[i], user_id) for i in ok)
+        )
+        for i, res in zip(ok, escalated):
+            results[i] = res
+            fields[i] = res.as_tuple()
+
+    tds = [TicketDraft(store=f[0], date=f[1], total=f[2], raw_text=f[3], used_pre=f[4]) for f in fields]
+    dups = await asyncio.gather(*(_find_duplicate(user_id, td, td.raw_text) for td in tds))
+    # Los que no se pudieron leer o parecen repetidos quedan desmarcados (se pueden marcar a mano)
+    album = AlbumState(len(tds), included=sum(
+        1 << i for i, (f, dup) in enumerate(zip(fields, dups)) if f[3] is not None and dup is None
+    ))
+    await drafts.delete_album(user_id)  # un álbum pendiente a la vez: el nuevo reemplaza al anterior
+    await drafts.put_album(user_id, album, tds)
+    repeated = [str(i + 1) for i, dup in enumerate(dups) if dup]
+    note = f"\n\n⚠️ Parecen repetidos (ya los guardaste): {', '.join(repeated)}." if repeated else ""
+    await messages[0].reply_text(
+        album_md(tds, album) + note, reply_markup=album_keyboard(album), parse_mode="Markdown",
+    )
+
+    total_s = time.perf_counter() - t_start
+    for photo, hit, res, f, st in zip(photos, hits, results, fields, stages):
+        st["total"] = total_s
+        _observe(user_id, photo, hit, res, f, st)
+
+async def _album_drafts(user_id: int, album: AlbumState):
+    return await asyncio.gather(*(drafts.get(user_id, slot=i) for i in range(album.n)))
+
+async def _show_album(q, user_id: int, album: AlbumState, tds=None):
+    tds = tds or await _album_drafts(user_id, album)
+    await q.edit_message_text(album_md(tds, album), reply_markup=album_keyboard(album), parse_mode="Markdown")
+
+async def on_album(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Botones de la vista previa de un álbum: marcar, editar, guardar todos o cancelar."""
+    q = update.callback_query
+    await q.answer()
+    user_id = update.effective_user.id
+    album = await drafts.get_album(user_id)
+    if not album:
+        await q.edit_message_text("No tengo un álbum pendiente. Envíame las fotos otra vez.")
+        return
+
+    parts = q.data.split(":")
+    action = parts[-1]
+    if action == "save":
+        slots = album.slots()
+        if not slots:
+            await q.message.reply_text("No hay tickets marcados. Marca al menos uno o cancela el álbum.")
+            return
+        tds = await _album_drafts(user_id, album)
+        expired = [i for i in slots if tds[i] is None]
+        slots = [i for i in slots if tds[i] is not None]
+        if not slots:
+            await q.message.reply_text("Los tickets marcados ya expiraron. Vuelve a enviar las fotos.")
+            return
+        texts = await asyncio.gather(*(drafts.raw_text(user_id, slot=i) for i in slots))
+        t0 = time.perf_counter()
+        await save_tickets_async([
+            dict(store=tds[i].store, date=tds[i].date, total=tds[i].total, currency=tds[i].currency,
+                 raw_text=text, user_id=user_id)
+            for i, text in zip(slots, texts)
+        ])
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - t0, "save")
+        metrics.TICKETS_SAVED.inc(amount=len(slots))
+        await drafts.delete_album(user_id)
+        await q.edit_message_text(
+            album_md(tds, album) + f"\n\n✅ *{len(slots)} tickets guardados en la base de datos.*"
+            + (f"\n⚠️ Sin guardar porque expiraron: {', '.join(str(i + 1) for i in expired)}." if expired else ""),
+            parse_mode="Markdown",
+        )
+        return
+    if action == "cancel":
+        await drafts.delete_album(user_id)
+        await q.edit_message_text("Álbum cancelado. Puedes enviarme otros tickets cuando quieras.")
+        return
+    if action == "back":
+        album.editing = None
+        await drafts.put_album(user_id, album)
+        await _show_album(q, user_id, album)
+        return
+
+    slot = int(parts[1])
+    if not 0 <= slot < album.n:
+        return
+    if action == "toggle":
+        album.toggle(slot)
+        await drafts.put_album(user_id, album)
+        await _show_album(q, user_id, album)
+        return
+    td = await drafts.get(user_id, slot=slot)
+    if td is None:
+        await q.message.reply_text(f"El ticket {slot + 1} {EXPIRED_SLOT}.")
+        return
+    if action == "edit":
+        await q.edit_message_text(
+            f"*Ticket {slot + 1}*\n\n" + summary_md(td) + "\n\n¿Qué campo quieres editar?",
+            reply_markup=edit_field_keyboard(slot),
+            parse_mode="Markdown",
+        )
+    elif action in FIELD_PROMPTS:
+        td.edit_field = action
+        album.editing = slot  # el siguiente texto del usuario es para este ticket
+        await drafts.put(user_id, td, slot=slot)
+        await drafts.put_album(user_id, album)
+        await q.edit_message_text(FIELD_PROMPTS[action], parse_mode="Markdown")
+
 async def on_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja las acciones del teclado principal."""
     if not update.callback_query:
@@ -144,19 +620,25 @@ async def on_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    td: TicketDraft = context.user_data.get("draft")
+    user_id = update.effective_user.id
+    td = await drafts.get(user_id)
     if not td:
         await q.edit_message_text("No tengo un ticket en edición. Envíame una foto de ticket.")
-        return ConversationHandler.END
+        return
 
     if q.data == "confirm":
         # Guardar y terminar
-        save_ticket(td.store, td.date, td.total, td.currency, td.raw_text)
+        t0 = time.perf_counter()
+        raw_text = await drafts.raw_text(user_id)
+        await save_ticket_async(td.store, td.date, td.total, td.currency, raw_text, user_id=user_id)
+        await drafts.delete(user_id)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - t0, "save")
+        metrics.TICKETS_SAVED.inc()
         await q.edit_message_text(
             summary_md(td) + "\n\n✅ *Guardado en la base de datos.*",
             parse_mode="Markdown",
         )
-        return ConversationHandler.END
+        return
 
     if q.data == "edit":
         await q.edit_message_text(
@@ -164,12 +646,11 @@ async def on_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=edit_field_keyboard(),
             parse_mode="Markdown",
         )
-        return EDITING
+        return
 
     if q.data == "cancel":
+        await drafts.delete(user_id)
         await q.edit_message_text("Operación cancelada. Puedes enviarme otro ticket cuando quieras.")
-        context.user_data.pop("draft", None)
-        return ConversationHandler.END
 
 async def on_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el menú de edición: elegir campo o volver."""
@@ -178,104 +659,266 @@ async def on_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
-    td: TicketDraft = context.user_data.get("draft")
+    user_id = update.effective_user.id
+    td = await drafts.get(user_id)
     if not td:
         await q.edit_message_text("No tengo un ticket en edición. Envíame una foto de ticket.")
-        return ConversationHandler.END
+        return
 
     if q.data == "back_to_confirm":
-        await q.edit_message_text(
-            summary_md(td),
-            reply_markup=confirm_keyboard(),
-            parse_mode="Markdown",
-        )
-        return CHOOSING
+        if td.edit_field:
+            td.edit_field = None
+            await drafts.put(user_id, td)
+        await q.edit_message_text(**await confirm_view(user_id, td))
+        return
 
     # Guardamos qué campo se va a editar
-    field = None
-    if q.data == "edit_store":
-        field = "store"
-        prompt = "Escribe el *nombre de la tienda*:"
-    elif q.data == "edit_date":
-        field = "date"
-        prompt = "Escribe la *fecha* con formato **DD/MM/AAAA**:"
-    elif q.data == "edit_total":
-        field = "total"
-        prompt = "Escribe el *total* (solo número, ej. `101.00`):"
-    else:
+    field = q.data.removeprefix("edit_")
+    if field not in FIELD_PROMPTS:
         await q.edit_message_text("Opción no válida. Volvamos a empezar con /start.")
-        return ConversationHandler.END
+        return
 
-    context.user_data["edit_field"] = field
-    await q.edit_message_text(prompt, parse_mode="Markdown")
-    return EDITING  # seguimos esperando texto del usuario
+    td.edit_field = field  # el siguiente texto del usuario es el valor de este campo
+    await drafts.put(user_id, td)
+    await q.edit_message_text(FIELD_PROMPTS[field], parse_mode="Markdown")
 
 async def on_text_during_edit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """El usuario envía el valor del campo a editar."""
-    td: TicketDraft = context.user_data.get("draft")
-    field = context.user_data.get("edit_field")
-    if not td or not field:
-        await update.message.reply_text("No hay edición activa. Envíame una foto de ticket.")
-        return ConversationHandler.END
+    user_id = update.effective_user.id
+    # Primero un ticket de álbum en edición, si no la foto suelta
+    album = await drafts.get_album(user_id)
+    slot = album.editing if album else None
+    td = await drafts.get(user_id, slot=slot)
+    if not td or not td.edit_field:
+        return  # no estamos esperando ningún valor: el texto no es para nosotros
+    field = td.edit_field
 
     value = (update.message.text or "").strip()
     if not value:
         await update.message.reply_text("No recibí texto. Intenta otra vez.")
-        return EDITING
+        return
 
     # Validación simple
     if field == "total":
         value = value.replace(",", ".")
         try:
-            float(value)
-        except:
+            cents = to_cents(value)  # la misma conversión que al guardar: rechaza nan, inf, 1e400...
+        except ValueError:
+            cents = None
+        if cents is None or cents < 0:
             await update.message.reply_text("Formato inválido. Ejemplo válido: 101.00")
-            return EDITING
+            return
+    elif field == "date":
+        if not to_iso_date(value):
+            await update.message.reply_text("Fecha inválida. Ejemplo válido: 31/12/2024")
+            return
 
     setattr(td, field, value)
-    context.user_data["draft"] = td
-    context.user_data.pop("edit_field", None)
+    td.edit_field = None
+    await drafts.put(user_id, td, slot=slot)
+
+    if slot is not None:
+        # Volver a la vista previa del álbum (en un mensaje nuevo, debajo de la respuesta)
+        album.editing = None
+        await drafts.put_album(user_id, album)
+        tds = await _album_drafts(user_id, album)
+        await update.message.reply_text(
+            album_md(tds, album), reply_markup=album_keyboard(album), parse_mode="Markdown",
+        )
+        return
 
-    # Volver a la pantalla de confirmación
-    await update.message.reply_text(
-        summary_md(td),
-        reply_markup=confirm_keyboard(),
-        parse_mode="Markdown",
-    )
-    return CHOOSING
+    # Volver a la pantalla de confirmación (los datos cambiaron: se revisa otra vez si es repetido)
+    await update.message.reply_text(**await confirm_view(user_id, td))
+
+async def resumen_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Gasto del mes en curso por tienda (sale de la tabla de resumen, no recorre los tickets)."""
+    month = datetime.date.today().strftime("%Y-%m")
+    try:
+        rows = await asyncio.to_thread(month_summary, update.effective_user.id, month)
+    except sqlite3.Error as e:
+        logger.warning("No pude leer el resumen: %s", e)
+        rows = []
+    if not rows:
+        await update.message.reply_text("Aún no tienes tickets guardados este mes.")
+        return
+    lines = [f"**Resumen {month}**\n"]
+    for store, n, cents in rows:
+        lines.append(f"🏬 {escape_markdown(store or '—')}: {from_cents(cents)} ({n} ticket{'s' if n != 1 else ''})")
+    total = sum(cents for _, _, cents in rows)
+    n_total = sum(n for _, n, _ in rows)
+    lines.append(f"\n💵 *Total:* {from_cents(total)} en {n_total} ticket{'s' if n_total != 1 else ''}")
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+async def buscar_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/buscar <palabras>: tickets del usuario cuyo texto las contiene, los más relevantes primero."""
+    query = " ".join(context.args or [])
+    if not query.strip():
+        await update.message.reply_text("Uso: /buscar cartucho impresora")
+        return
+    try:
+        rows = await asyncio.to_thread(search_tickets, update.effective_user.id, query, SEARCH_LIMIT)
+    except sqlite3.Error as e:
+        logger.warning("No pude buscar: %s", e)
+        rows = []
+    if not rows:
+        await update.message.reply_text(f"No encontré tickets con “{query}”.")
+        return
+    lines = [f"**Resultados para “{escape_markdown(query)}”**\n"]
+    for _, date, store, cents, snippet in rows:
+        lines.append(
+            f"🧾 {from_iso_date(date) or '—'} | {escape_markdown(store or '—')} | {from_cents(cents) or '—'}"
+            + (f"\n      ↳ {escape_markdown(snippet)}" if snippet else "")
+        )
+    await update.message.reply_text("\n".join(lines), parse_mode="Markdown")
+
+EXPORT_USAGE = (
+    "Uso: /exportar [csv|parquet] [desde] [hasta] [tienda]\n"
+    "Ejemplos: /exportar · /exportar 01/01/2024 31/03/2024 · /exportar parquet Oxxo"
+)
+
+def parse_export_args(args):
+    """[csv|parquet] [desde [hasta]] [tienda...] -> (formato, desde, hasta, tienda)."""
+    args = list(args)
+    fmt = args.pop(0).lower() if args and args[0].lower() in EXPORT_FORMATS else "csv"
+    dates = []
+    while args and len(dates) < 2 and to_iso_date(args[0]):
+        dates.append(args.pop(0))
+    since, until = (dates + [None, None])[:2]
+    return fmt, since, until, " ".join(args) or None
+
+async def exportar_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/exportar: los tickets del usuario como archivo, escritos por bloques a un temporal (memoria constante)."""
+    fmt, since, until, store = parse_export_args(context.args or [])
+    if fmt == "parquet" and not HAS_PARQUET:
+        await update.message.reply_text("Parquet no está disponible en este servidor; prueba con /exportar csv.")
+        return
+    fd, path = tempfile.mkstemp(prefix="tickets-", suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        n = await asyncio.to_thread(
+            export_tickets, path, fmt, user_id=update.effective_user.id, since=since, until=until, store=store,
+        )
+        size_mb = os.path.getsize(path) / 1e6
+        if not n:
+            await update.message.reply_text("No encontré tickets con esos filtros.\n\n" + EXPORT_USAGE)
+        elif size_mb > EXPORT_MAX_MB:
+            await update.message.reply_text(
+                f"El archivo pesa {size_mb:.0f} MB y Telegram solo me deja enviar {EXPORT_MAX_MB:g} MB. "
+                "Acótalo por fechas o tienda, o pídelo en parquet (pesa mucho menos).\n\n" + EXPORT_USAGE
+            )
+        else:
+            with open(path, "rb") as fh:
+                await update.message.reply_document(
+                    fh, filename=f"tickets.{fmt}", caption=f"🧾 {n} ticket{'s' if n != 1 else ''}",
+                )
+    except sqlite3.Error as e:
+        logger.warning("No pude exportar: %s", e)
+        await update.message.reply_text("😬 No pude leer tus tickets. Intenta de nuevo en un momento.")
+    finally:
+        os.unlink(path)
 
 async def cancel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.pop("draft", None)
+    user_id = update.effective_user.id
+    await drafts.delete(user_id)
+    # Fotos que aún se están leyendo: álbumes esperando más fotos y trabajos en el pool
+    for key in [k for k in _albums if k[0] == user_id]:
+        del _albums[key]  # su temporizador lo nota al despertar y no lee nada
+    cancelled = ocr_executor.cancel(user_id)
+    if cancelled:
+        metrics.OCR_CANCELLED.inc(amount=cancelled)
+        what = "tu foto" if cancelled == 1 else f"tus {cancelled} fotos"
+        await update.message.reply_text(f"Cancelado: dejé de leer {what}. Envía otra cuando quieras.")
+        return
     await update.message.reply_text("Cancelado. Envía una foto cuando quieras.")
-    return ConversationHandler.END
 
-def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+_warm_task = None  # referencia para que el calentamiento en segundo plano no se recolecte
 
-    conv = ConversationHandler(
-        entry_points=[
-            CommandHandler("start", start),
-            MessageHandler(filters.PHOTO, handle_photo),
-        ],
-        states={
-            CHOOSING: [
-                CallbackQueryHandler(on_choice, pattern="^(confirm|edit|cancel)$"),
-            ],
-            EDITING: [
-                CallbackQueryHandler(on_edit, pattern="^(edit_store|edit_date|edit_total|back_to_confirm)$"),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, on_text_during_edit),
-            ],
-        },
-        fallbacks=[CommandHandler("cancel", cancel_cmd)],
-        allow_reentry=True,
+async def _warm_up_pool():
+    """Arranca y calienta los workers de OCR mientras el bot ya atiende; reporta sus tiempos."""
+    t0 = time.perf_counter()
+    try:
+        infos = await ocr_executor.warm_up()
+    except Exception as e:
+        logger.warning("No pude calentar el pool de OCR: %s", e)
+        return
+    for info in infos:
+        metrics.STAGE_SECONDS.observe(info["import_seconds"], "worker_import")
+        if info.get("warmup_seconds") is not None:
+            metrics.STAGE_SECONDS.observe(info["warmup_seconds"], "worker_warmup")
+    logger.info(
+        "Pool de OCR caliente en %.2fs: %s", time.perf_counter() - t0,
+        " | ".join(
+            f"pid {info['pid']}: import {info['import_seconds'] * 1000:.0f}ms"
+            + (f", calentamiento {info['warmup_seconds'] * 1000:.0f}ms" if info.get("warmup_seconds") is not None else "")
+            for info in infos
+        ),
     )
 
-    app.add_handler(conv)
+async def post_init(app: Application):
+    global _warm_task
+    # Crea/migra la BD antes de la primera foto: las lecturas (caché, repetidos) son de solo lectura
+    await asyncio.to_thread(get_writer().start)
+    ocr_executor.start()
+    metrics.start_server()
+    logger.info(
+        "Pool de OCR listo: %d workers, fila máx. %d, hasta %d por usuario a la vez si otros esperan, %g tickets/min por usuario",
+        ocr_executor.workers, ocr_executor.max_queue, ocr_executor.user_concurrency, ocr_executor.user_rate,
+    )
+    # En segundo plano: el polling/webhook arranca ya; una foto que llegue antes espera a su worker
+    _warm_task = asyncio.get_running_loop().create_task(_warm_up_pool())
+
+async def post_shutdown(app: Application):
+    ocr_executor.shutdown()
+    metrics.stop_server()
+    close_writer()  # confirma lo que quede en la cola de escrituras
+
+def main():
+    if not BOT_TOKEN:
+        raise RuntimeError("Falta TELEGRAM_BOT_TOKEN en .env")
+    logger.info("Módulos del bot importados en %.2fs (el OCR se importa en los workers)", IMPORT_SECONDS)
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        api = TELEGRAM_API_URL.rstrip("/")
+        builder = builder.base_url(f"{api}/bot").base_file_url(f"{api}/file/bot")
+    app = builder.build()
+
+    # Sin ConversationHandler: el paso de la conversación sale del borrador guardado
+    # block=False: mientras una foto espera al pool, los botones de otros usuarios siguen respondiendo
+    app.add_handler(MessageHandler(filters.PHOTO | filters.Document.IMAGE, handle_photo, block=False))
+    app.add_handler(CallbackQueryHandler(on_choice, pattern="^(confirm|edit|cancel)$"))
+    app.add_handler(CallbackQueryHandler(on_edit, pattern="^(edit_store|edit_date|edit_total|back_to_confirm)$"))
+    app.add_handler(CallbackQueryHandler(on_album, pattern="^a:"))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, on_text_during_edit))
     app.add_handler(CommandHandler("cancel", cancel_cmd))
     app.add_handler(CommandHandler("start", start))
-
-    logger.info("Bot arrancando...")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    app.add_handler(CommandHandler("resumen", resumen_cmd))
+    app.add_handler(CommandHandler("buscar", buscar_cmd))
+    app.add_handler(CommandHandler("exportar", exportar_cmd, block=False))  # puede tardar: no frena al resto
+
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise RuntimeError("BOT_MODE=webhook necesita WEBHOOK_URL")
+        logger.info("Bot arrancando (webhook en %s:%d/%s)...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=CONCURRENT_UPDATES,
+        )
+    elif BOT_MODE == "polling":
+        logger.info("Bot arrancando (polling)...")
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
+    else:
+        raise RuntimeError(f"BOT_MODE desconocido: {BOT_MODE!r} (usa polling o webhook)")
 
 if __name__ == "__main__":
     main()
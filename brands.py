@@ -0,0 +1,269 @@
+"""Reconocimiento de tiendas/marcas en las líneas del ticket.
+
+Los alias (p. ej. "wal mart", "walmart express" -> "Walmart") se compilan una
+sola vez en un autómata Aho-Corasick: una línea se recorre una vez sin
+importar cuántos alias haya. Si no hay coincidencia exacta se busca con
+distancia de edición acotada usando un índice de borrados precalculado.
+
+Los alias salen de DEFAULT_BRANDS, de la tabla `brands` de la BD y,
+opcionalmente, de un archivo CSV `alias,tienda` indicado en BRANDS_FILE.
+"""
+import csv
+import logging
+import os
+import sqlite3
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import db_init
+
+logger = logging.getLogger("bot-ocr-tickets.brands")
+
+DEFAULT_BRANDS = {
+    "starbucks": "Starbucks",
+    "oxxo": "OXXO",
+    "walmart": "Walmart",
+    "soriana": "Soriana",
+    "heb": "HEB",
+    "7-eleven": "7-Eleven",
+    "seven": "7-Eleven",
+    "chedraui": "Chedraui",
+    "farmacia": "Farmacia",
+    "the home depot": "The Home Depot",
+    "costco": "Costco",
+    "sam s": "Sam's Club",
+    "sams": "Sam's Club",
+}
+
+# Confusiones típicas del OCR: se "pliegan" igual en alias y en texto (0XXO -> oxxo, wa1mart -> walmart)
+_OCR_FOLD = str.maketrans({"0": "o", "1": "l", "5": "s", "|": "l"})
+
+MAX_EDITS = 1       # errores permitidos en la búsqueda difusa
+# Alias y tramos de texto más cortos solo se aceptan exactos: con una letra de diferencia,
+# las palabras cortas comunes se vuelven marcas ("hey" -> heb, "costo" -> costco, "steven" -> seven)
+FUZZY_MIN_LEN = 6
+
+
+_unidecode = None
+
+
+def to_ascii(s: str) -> str:
+    """unidecode(s); unidecode se importa con el primer texto y no al arrancar el bot."""
+    global _unidecode
+    if _unidecode is None:
+        from unidecode import unidecode as _unidecode
+    return _unidecode(s)
+
+
+def fold(s: str) -> str:
+    """Normaliza un alias o una línea para comparar: minúsculas, sin acentos, confusiones OCR."""
+    s = to_ascii(s).lower().translate(_OCR_FOLD)
+    return " ".join(s.split())
+
+
+def _is_boundary(s: str, i: int) -> bool:
+    """True si la posición i es borde de palabra (inicio/fin o separador)."""
+    return i <= 0 or i >= len(s) or not s[i - 1].isalnum() or not s[i].isalnum()
+
+
+def _deletes(s: str, k: int) -> set:
+    """La cadena y todas sus variantes con hasta k letras borradas."""
+    out = {s}
+    frontier = {s}
+    for _ in range(k):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        out |= frontier
+    return out
+
+
+def _bounded_distance(a: str, b: str, k: int) -> Optional[int]:
+    """Distancia de Levenshtein entre a y b si es <= k; None si la supera."""
+    if abs(len(a) - len(b)) > k:
+        return None
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        row = [i]
+        for j, cb in enumerate(b, 1):
+            row.append(min(row[j - 1] + 1, prev[j] + 1, prev[j - 1] + (ca != cb)))
+        if min(row) > k:
+            return None
+        prev = row
+    return prev[-1] if prev[-1] <= k else None
+
+
+class BrandMatcher:
+    """Autómata Aho-Corasick para coincidencias exactas + índice de borrados para las difusas."""
+
+    def __init__(self, aliases: Dict[str, str], max_edits: int = MAX_EDITS, fuzzy_min_len: int = FUZZY_MIN_LEN):
+        self.max_edits = max_edits
+        self.fuzzy_min_len = fuzzy_min_len
+        self._names: List[str] = []      # canónico por alias
+        self._aliases: List[str] = []    # alias ya plegado
+        self._lens: List[int] = []       # largo por alias
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._term: List[int] = [-1]     # alias que termina en el nodo (-1 = ninguno)
+        self._out: List[Tuple[int, ...]] = [()]
+        for alias, canonical in aliases.items():
+            self._add(fold(alias), canonical)
+        self._build_fail_links()
+        self.max_len = max(self._lens, default=0)
+        self._fuzzy_index: Dict[str, List[int]] = {}
+        if max_edits:
+            for idx, alias in enumerate(self._aliases):
+                if len(alias) >= fuzzy_min_len:
+                    for variant in _deletes(alias, max_edits):
+                        self._fuzzy_index.setdefault(variant, []).append(idx)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _add(self, alias: str, canonical: str):
+        if not alias:
+            return
+        node = 0
+        for ch in alias:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._term.append(-1)
+                self._out.append(())
+            node = nxt
+        if self._term[node] == -1:
+            self._term[node] = len(self._names)
+            self._names.append(canonical)
+            self._aliases.append(alias)
+            self._lens.append(len(alias))
+        else:
+            self._names[self._term[node]] = canonical  # el último alias repetido gana
+
+    def _build_fail_links(self):
+        queue = deque()
+        for child in self._goto[0].values():
+            queue.append(child)
+        for node in range(len(self._goto)):
+            if self._term[node] != -1:
+                self._out[node] = (self._term[node],)
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[child] = self._goto[f].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def _exact(self, s: str) -> Optional[int]:
+        """Mejor coincidencia exacta en palabras completas: la más larga y, si empatan, la primera."""
+        best = None
+        node = 0
+        for i, ch in enumerate(s):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for idx in self._out[node]:
+                start = i - self._lens[idx] + 1
+                if _is_boundary(s, start) and _is_boundary(s, i + 1):
+                    key = (-self._lens[idx], start)
+                    if best is None or key < best[0]:
+                        best = (key, idx)
+        return best[1] if best else None
+
+    def _fuzzy(self, s: str) -> Optional[int]:
+        """Alias más parecido a un tramo de palabras completas, con a lo más max_edits errores.
+
+        Índice de borrados simétricos: dos cadenas a distancia <= k comparten
+        alguna variante con hasta k letras borradas. Cada tramo del texto
+        genera sus variantes y las busca en el diccionario, así que el costo
+        no depende de cuántos alias haya.
+        """
+        k = self.max_edits
+        bounds = [i for i in range(len(s) + 1) if _is_boundary(s, i)]
+        best = None  # (distancia, -largo, alias)
+        for a, start in enumerate(bounds):
+            if start >= len(s) or not s[start].isalnum():
+                continue
+            for end in bounds[a + 1:]:
+                span = end - start
+                if span > self.max_len + k:
+                    break
+                if span < self.fuzzy_min_len:
+                    continue
+                sub = s[start:end]
+                for variant in _deletes(sub, k):
+                    for idx in self._fuzzy_index.get(variant, ()):
+                        dist = _bounded_distance(sub, self._aliases[idx], k)
+                        if dist is None:
+                            continue
+                        cand = (dist, -self._lens[idx], idx)
+                        if best is None or cand < best:
+                            best = cand
+        return best[2] if best else None
+
+    def match(self, line: str) -> Optional[str]:
+        """Nombre canónico de la tienda que aparece en la línea, o None."""
+        s = fold(line)
+        if not s:
+            return None
+        idx = self._exact(s)
+        if idx is not None:
+            return self._names[idx]
+        if self.max_edits:
+            idx = self._fuzzy(s)
+            if idx is not None:
+                return self._names[idx]
+        return None
+
+
+def _load_file(path: str) -> Dict[str, str]:
+    aliases = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) >= 2 and row[0].strip() and not row[0].lstrip().startswith("#"):
+                aliases[row[0].strip()] = row[1].strip()
+    return aliases
+
+
+def _load_db(db_path: str) -> Dict[str, str]:
+    # Solo lectura: si la BD aún no existe falla aquí en lugar de crear un archivo vacío
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute("SELECT alias, canonical FROM brands"))
+    finally:
+        conn.close()
+
+
+def load_brands(path: str = None, db_path: str = None) -> Dict[str, str]:
+    """Junta los alias por defecto, los de la BD y los del archivo (en ese orden de prioridad creciente)."""
+    aliases = dict(DEFAULT_BRANDS)
+    try:
+        aliases.update(_load_db(db_path or db_init.DB_PATH))
+    except sqlite3.Error as e:
+        logger.debug("Sin tabla de marcas en la BD (%s); uso las de por defecto.", e)
+    path = path or os.getenv("BRANDS_FILE")
+    if path:
+        aliases.update(_load_file(path))
+    return aliases
+
+
+_matcher = None
+
+
+def get_matcher() -> BrandMatcher:
+    """Matcher del proceso actual (se compila la primera vez que se usa)."""
+    global _matcher
+    if _matcher is None:
+        _matcher = BrandMatcher(load_brands())
+        logger.info("Marcas compiladas: %d alias", len(_matcher))
+    return _matcher
+
+
+def reload_matcher() -> BrandMatcher:
+    """Vuelve a leer los alias (p. ej. después de agregar marcas a la BD)."""
+    global _matcher
+    _matcher = None
+    return get_matcher()
@@ -1,13 +1,17 @@
-import os, sqlite3
+import datetime, math, os, re, sqlite3, zlib
 
-os.makedirs("data", exist_ok=True)
-conn = sqlite3.connect("data/tickets.db")
-c = conn.cursor()
+DB_PATH = "data/tickets.db"
 
-c.execute("PRAGMA journal_mode=WAL;")
-c.execute("PRAGMA synchronous=NORMAL;")
+# Se aplican a toda conexión que escriba (ver db_utils.TicketWriter)
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA busy_timeout=5000;",
+)
 
-c.execute("""
+# Esquema base (versión 0); los cambios posteriores van en MIGRATIONS
+SCHEMA = (
+    """
 CREATE TABLE IF NOT EXISTS tickets (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   store TEXT,
@@ -19,8 +23,372 @@ CREATE TABLE IF NOT EXISTS tickets (
   raw_text TEXT,
   created_at TEXT DEFAULT (datetime('now','localtime'))
 )
-""")
+""",
+    # Caché de OCR: un resultado por imagen (hash de píxeles) y varios file_unique_id de
+    # Telegram apuntando a él. last_used sirve para desalojar lo menos usado (LRU).
+    """
+CREATE TABLE IF NOT EXISTS ocr_cache (
+  image_hash TEXT PRIMARY KEY,
+  store TEXT,
+  date TEXT,
+  total TEXT,
+  raw_text TEXT,
+  variant TEXT,
+  last_used REAL
+)
+""",
+    "CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache(last_used)",
+    """
+CREATE TABLE IF NOT EXISTS ocr_cache_files (
+  file_unique_id TEXT PRIMARY KEY,
+  image_hash TEXT NOT NULL
+)
+""",
+    "CREATE INDEX IF NOT EXISTS idx_ocr_cache_files_hash ON ocr_cache_files(image_hash)",
+    # Alias de tiendas para brands.py (p. ej. "wal mart" -> "Walmart"); se suman a los de por defecto
+    """
+CREATE TABLE IF NOT EXISTS brands (
+  alias TEXT PRIMARY KEY,
+  canonical TEXT NOT NULL
+)
+""",
+)
+
+
+# ===== Formatos de almacenamiento =====
+# Fechas en ISO (YYYY-MM-DD) para que ordenen y filtren por índice; montos en centavos enteros.
+
+_RE_DMY = re.compile(r"^\s*(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{2,4})\s*$")
+_RE_ISO = re.compile(r"^\s*(\d{4})-(\d{2})-(\d{2})\s*$")
+
+
+def to_iso_date(value):
+    """'12/05/2024' (DD/MM/AAAA) o '2024-05-12' -> '2024-05-12'; None si no es fecha válida."""
+    if not value:
+        return None
+    m = _RE_ISO.match(value)
+    if m:
+        y, mo, d = (int(x) for x in m.groups())
+    else:
+        m = _RE_DMY.match(value)
+        if not m:
+            return None
+        d, mo, y = (int(x) for x in m.groups())
+        if y < 100:
+            y += 2000
+    try:
+        return datetime.date(y, mo, d).isoformat()
+    except ValueError:
+        return None
+
+
+def from_iso_date(value):
+    """'2024-05-12' -> '12/05/2024' (como se muestra al usuario)."""
+    if not value:
+        return None
+    y, mo, d = value.split("-")
+    return f"{d}/{mo}/{y}"
+
+
+# Tope de un monto en centavos (cabe de sobra en el INTEGER de 64 bits de SQLite)
+MAX_CENTS = 10 ** 15
+
+
+def to_cents(value):
+    """'101.00' / 101.0 -> 10100; None si no hay monto.
+
+    ValueError si no es un monto: texto, nan/inf o fuera de ±MAX_CENTS.
+    """
+    if value is None or value == "":
+        return None
+    amount = float(value)
+    if not math.isfinite(amount) or abs(amount) * 100 >= MAX_CENTS:
+        raise ValueError(f"monto fuera de rango: {value!r}")
+    return int(round(amount * 100))
+
+
+def from_cents(cents):
+    return None if cents is None else f"{cents / 100:.2f}"
+
+
+# El texto del OCR se guarda comprimido (ticket_texts.raw_zlib): en tickets típicos ~2-3x más chico
+TEXT_ZLIB_LEVEL = 6
+
+
+def compress_text(text):
+    return zlib.compress(text.encode("utf-8"), TEXT_ZLIB_LEVEL)
+
+
+def decompress_text(blob):
+    return None if blob is None else zlib.decompress(blob).decode("utf-8")
+
+
+# ===== Migraciones (PRAGMA user_version) =====
+
+def _migrate_1_iso_dates_cents(conn):
+    """tickets: fecha ISO + total en centavos + user_id, índices y resumen por mes/tienda."""
+    c = conn.cursor()
+    c.execute("""
+    CREATE TABLE tickets_v1 (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id INTEGER,
+      store TEXT,
+      date TEXT,            -- ISO YYYY-MM-DD
+      total_cents INTEGER,
+      currency TEXT,
+      category TEXT,
+      payment_method TEXT,
+      raw_text TEXT,
+      created_at TEXT DEFAULT (datetime('now','localtime'))
+    )
+    """)
+    # Fechas y totales viejos que no se pueden convertir se guardan aquí tal cual (en tickets quedan NULL)
+    c.execute("""
+    CREATE TABLE tickets_legacy_values (
+      ticket_id INTEGER NOT NULL,
+      field TEXT NOT NULL,  -- 'date' o 'total'
+      value TEXT NOT NULL,
+      PRIMARY KEY (ticket_id, field)
+    )
+    """)
+    rows = c.execute("""
+        SELECT id, store, date, total, currency, category, payment_method, raw_text, created_at
+        FROM tickets
+    """).fetchall()
+    converted, unparsed = [], []
+    for tid, store, date, total, currency, category, pm, raw, created in rows:
+        iso = to_iso_date(str(date)) if date is not None else None
+        if iso is None and date not in (None, ""):
+            unparsed.append((tid, "date", str(date)))
+        try:
+            cents = to_cents(total)
+        except (TypeError, ValueError):
+            cents = None
+            unparsed.append((tid, "total", str(total)))
+        converted.append((tid, store, iso, cents, currency, category, pm, raw, created))
+    c.executemany("""
+        INSERT INTO tickets_v1 (id, store, date, total_cents, currency, category, payment_method, raw_text, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, converted)
+    c.executemany("INSERT INTO tickets_legacy_values (ticket_id, field, value) VALUES (?, ?, ?)", unparsed)
+    if unparsed:
+        print(f"⚠️ {len(unparsed)} fechas/totales sin convertir (quedan en tickets_legacy_values): "
+              + ", ".join(f"#{tid} {field}={value!r}" for tid, field, value in unparsed[:20])
+              + (" ..." if len(unparsed) > 20 else ""))
+    c.execute("DROP TABLE tickets")
+    c.execute("ALTER TABLE tickets_v1 RENAME TO tickets")
+    c.execute("CREATE INDEX idx_tickets_date ON tickets(date)")
+    c.execute("CREATE INDEX idx_tickets_store_date ON tickets(store, date)")
+    c.execute("CREATE INDEX idx_tickets_user_date ON tickets(user_id, date)")
+
+    # Resumen incremental: una fila por (usuario, mes, tienda), mantenida por triggers
+    c.execute("""
+    CREATE TABLE spending_summary (
+      user_id INTEGER NOT NULL,
+      month TEXT NOT NULL,   -- YYYY-MM ('' si el ticket no tiene fecha)
+      store TEXT NOT NULL,   -- '' si no tiene tienda
+      n_tickets INTEGER NOT NULL,
+      total_cents INTEGER NOT NULL,
+      PRIMARY KEY (user_id, month, store)
+    ) WITHOUT ROWID
+    """)
+    c.execute("""
+    CREATE TRIGGER tickets_summary_ins AFTER INSERT ON tickets BEGIN
+      INSERT INTO spending_summary (user_id, month, store, n_tickets, total_cents)
+      VALUES (COALESCE(NEW.user_id, 0), COALESCE(substr(NEW.date, 1, 7), ''), COALESCE(NEW.store, ''),
+              1, COALESCE(NEW.total_cents, 0))
+      ON CONFLICT (user_id, month, store) DO UPDATE SET
+        n_tickets = n_tickets + 1,
+        total_cents = total_cents + excluded.total_cents;
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER tickets_summary_del AFTER DELETE ON tickets BEGIN
+      UPDATE spending_summary SET
+        n_tickets = n_tickets - 1,
+        total_cents = total_cents - COALESCE(OLD.total_cents, 0)
+      WHERE user_id = COALESCE(OLD.user_id, 0)
+        AND month = COALESCE(substr(OLD.date, 1, 7), '')
+        AND store = COALESCE(OLD.store, '');
+      DELETE FROM spending_summary
+      WHERE user_id = COALESCE(OLD.user_id, 0)
+        AND month = COALESCE(substr(OLD.date, 1, 7), '')
+        AND store = COALESCE(OLD.store, '')
+        AND n_tickets <= 0;
+    END
+    """)
+    c.execute("""
+    CREATE TRIGGER tickets_summary_upd AFTER UPDATE OF user_id, date, store, total_cents ON tickets BEGIN
+      UPDATE spending_summary SET
+        n_tickets = n_tickets - 1,
+        total_cents = total_cents - COALESCE(OLD.total_cents, 0)
+      WHERE user_id = COALESCE(OLD.user_id, 0)
+        AND month = COALESCE(substr(OLD.date, 1, 7), '')
+        AND store = COALESCE(OLD.store, '');
+      INSERT INTO spending_summary (user_id, month, store, n_tickets, total_cents)
+      VALUES (COALESCE(NEW.user_id, 0), COALESCE(substr(NEW.date, 1, 7), ''), COALESCE(NEW.store, ''),
+              1, COALESCE(NEW.total_cents, 0))
+      ON CONFLICT (user_id, month, store) DO UPDATE SET
+        n_tickets = n_tickets + 1,
+        total_cents = total_cents + excluded.total_cents;
+    END
+    """)
+    c.execute("""
+        INSERT INTO spending_summary (user_id, month, store, n_tickets, total_cents)
+        SELECT COALESCE(user_id, 0), COALESCE(substr(date, 1, 7), ''), COALESCE(store, ''),
+               COUNT(*), COALESCE(SUM(total_cents), 0)
+        FROM tickets GROUP BY 1, 2, 3
+    """)
+
+
+def _migrate_2_ingested_files(conn):
+    """ingested_files: manifiesto de la importación masiva (main.py) para poder reanudarla."""
+    conn.execute("""
+    CREATE TABLE ingested_files (
+      path TEXT PRIMARY KEY,  -- ruta absoluta
+      size INTEGER,
+      mtime_ns INTEGER,
+      ticket_id INTEGER,      -- NULL si falló
+      error TEXT,
+      ingested_at TEXT DEFAULT (datetime('now','localtime'))
+    )
+    """)
+
+
+def _migrate_3_kv_store(conn):
+    """kv_store: almacén clave-valor con caducidad (borradores del bot, ver drafts.py)."""
+    conn.execute("""
+    CREATE TABLE kv_store (
+      key TEXT PRIMARY KEY,
+      value BLOB NOT NULL,
+      expires_at REAL NOT NULL  -- epoch en segundos
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX idx_kv_store_expires ON kv_store(expires_at)")
+
+
+def _migrate_4_text_search(conn):
+    """tickets: raw_text comprimido en ticket_texts + índice FTS5 (tickets_fts) del texto normalizado."""
+    # Import local: extractor -> brands -> db_init; arriba sería un import circular
+    from extractor import _normalize
+
+    c = conn.cursor()
+    # El texto del OCR (varios KB) sale de la fila de tickets: las consultas de resumen,
+    # fechas y totales leen páginas con muchas más filas
+    c.execute("""
+    CREATE TABLE ticket_texts (
+      ticket_id INTEGER PRIMARY KEY,  -- = tickets.id
+      raw_zlib BLOB NOT NULL          -- raw_text en UTF-8 comprimido con zlib
+    )
+    """)
+    # Sin contenido (content=''): solo el índice invertido; el texto se lee de ticket_texts
+    c.execute("CREATE VIRTUAL TABLE tickets_fts USING fts5(body, content='', tokenize='unicode61')")
+    rows = c.execute("SELECT id, raw_text FROM tickets WHERE raw_text IS NOT NULL AND raw_text != ''").fetchall()
+    c.executemany("INSERT INTO ticket_texts (ticket_id, raw_zlib) VALUES (?, ?)",
+                  [(tid, compress_text(raw)) for tid, raw in rows])
+    c.executemany("INSERT INTO tickets_fts (rowid, body) VALUES (?, ?)",
+                  [(tid, _normalize(raw)) for tid, raw in rows])
+    c.execute("ALTER TABLE tickets DROP COLUMN raw_text")
+
+
+def _migrate_5_dedupe(conn):
+    """tickets: llave exacta (tienda, fecha, total) y SimHash del texto para detectar repetidos."""
+    from dedupe import bands, dedupe_key, simhash  # import local, igual que en la migración 4
+
+    c = conn.cursor()
+    c.execute("ALTER TABLE tickets ADD COLUMN dedupe_key TEXT")  # ver dedupe.dedupe_key
+    c.execute("ALTER TABLE tickets ADD COLUMN simhash INTEGER")
+    c.execute("CREATE INDEX idx_tickets_user_dedupe ON tickets(user_id, dedupe_key)")
+    # Una fila por banda de la huella: los candidatos a repetido salen por igualdad de banda
+    c.execute("""
+    CREATE TABLE ticket_simhash_bands (
+      user_id INTEGER NOT NULL,  -- COALESCE(tickets.user_id, 0)
+      band INTEGER NOT NULL,
+      value INTEGER NOT NULL,
+      ticket_id INTEGER NOT NULL,
+      PRIMARY KEY (user_id, band, value, ticket_id)
+    ) WITHOUT ROWID
+    """)
+    rows = c.execute("""
+        SELECT t.id, t.user_id, t.store, t.date, t.total_cents, x.raw_zlib
+        FROM tickets t LEFT JOIN ticket_texts x ON x.ticket_id = t.id
+    """).fetchall()
+    for tid, user_id, store, date, cents, blob in rows:
+        h = simhash(decompress_text(blob))
+        c.execute("UPDATE tickets SET dedupe_key = ?, simhash = ? WHERE id = ?",
+                  (dedupe_key(store, date, from_cents(cents)), h, tid))
+        if h is not None:
+            c.executemany("INSERT INTO ticket_simhash_bands (user_id, band, value, ticket_id) VALUES (?, ?, ?, ?)",
+                          [(user_id or 0, band, value, tid) for band, value in enumerate(bands(h))])
+
+
+def _migrate_6_simhash_bands_16(conn):
+    """ticket_simhash_bands: 4 bandas de 16 bits (antes 9 de ~7 bits, que traían miles de candidatos por búsqueda)."""
+    from dedupe import bands
+
+    c = conn.cursor()
+    c.execute("DELETE FROM ticket_simhash_bands")
+    rows = c.execute("SELECT id, user_id, simhash FROM tickets WHERE simhash IS NOT NULL").fetchall()
+    c.executemany("INSERT INTO ticket_simhash_bands (user_id, band, value, ticket_id) VALUES (?, ?, ?, ?)",
+                  [(user_id or 0, band, value, tid) for tid, user_id, h in rows for band, value in enumerate(bands(h))])
+
+
+MIGRATIONS = (
+    _migrate_1_iso_dates_cents,
+    _migrate_2_ingested_files,
+    _migrate_3_kv_store,
+    _migrate_4_text_search,
+    _migrate_5_dedupe,
+    _migrate_6_simhash_bands_16,
+)
+
+
+def migrate(conn):
+    """Aplica en orden las migraciones pendientes según PRAGMA user_version.
+
+    Cada migración lee la versión dentro de su propia transacción `BEGIN IMMEDIATE`:
+    si el bot y main.py arrancan a la vez, el segundo espera el candado de escritura
+    y ve la versión ya subida en lugar de repetir la migración.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.execute("COMMIT")
+                return
+            migration = MIGRATIONS[version]
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        print(f"🛠️ Migración {version + 1} aplicada: {migration.__doc__.strip()}")
+
+
+def apply_pragmas(conn):
+    c = conn.cursor()
+    for pragma in PRAGMAS:
+        c.execute(pragma)
+
+
+def create_schema(conn):
+    c = conn.cursor()
+    for stmt in SCHEMA:
+        c.execute(stmt)
+    conn.commit()
+    migrate(conn)
+
+
+def init_db(path=DB_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(conn)
+    create_schema(conn)
+    conn.close()
+
 
-conn.commit()
-conn.close()
-print("✅ Base de datos lista en data/tickets.db")
+if __name__ == "__main__":
+    init_db()
+    print(f"✅ Base de datos lista en {DB_PATH}")
@@ -1,13 +1,497 @@
+import asyncio
+import logging
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+from concurrent.futures import Future
 
-def save_ticket(store, date, total, currency, raw_text, category=None, payment_method=None):
-    conn = sqlite3.connect("data/tickets.db")
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO tickets (store, date, total, currency, category, payment_method, raw_text)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (store, date, float(total) if total else None, currency or "MXN",
-          category, payment_method, raw_text))
-    conn.commit()
-    conn.close()
+from db_init import DB_PATH, apply_pragmas, compress_text, create_schema, decompress_text, to_cents, to_iso_date
+from extractor import _normalize
+from dedupe import SIMHASH_BAND_BITS, SIMHASH_BANDS, SIMHASH_MAX_DISTANCE, bands, dedupe_key, hamming, probes, simhash
+
+logger = logging.getLogger("bot-ocr-tickets.db")
+
+# Máximo de imágenes en la caché de OCR antes de desalojar las menos usadas
+OCR_CACHE_MAX = int(os.getenv("OCR_CACHE_MAX", "5000"))
+
+# ===== Escritor único =====
+
+class TicketWriter:
+    """Un hilo dueño de una sola conexión WAL que ejecuta todas las escrituras.
+
+    Cada escritura es una función `fn(cursor)` que se encola junto con un Future.
+    El hilo junta lo que haya en la cola (hasta `max_batch`; con `max_delay` > 0
+    además espera ese tiempo a que lleguen más) y lo confirma en una sola
+    transacción: mientras un COMMIT está en curso se acumula el siguiente lote.
+    Cada trabajo corre en su propio SAVEPOINT, así que si uno falla los demás se
+    guardan igual.
+    """
+
+    def __init__(self, path: str = DB_PATH, max_batch: int = 256, max_delay: float = 0.0):
+        self.path = path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                ready = Future()
+                self._thread = threading.Thread(target=self._run, args=(ready,), name="db-writer", daemon=True)
+                self._thread.start()
+                ready.result()  # propaga errores al abrir la BD
+
+    def close(self):
+        """Vacía la cola y cierra la conexión."""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None
+
+    def submit(self, fn) -> Future:
+        """Encola `fn(cursor)`; el Future se resuelve con su resultado tras el COMMIT."""
+        self.start()
+        fut = Future()
+        self._queue.put((fn, fut))
+        return fut
+
+    async def run(self, fn):
+        """Versión awaitable de submit para el bot."""
+        return await asyncio.wrap_future(self.submit(fn))
+
+    def _run(self, ready: Future):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            apply_pragmas(conn)
+            create_schema(conn)
+        except Exception as e:
+            ready.set_exception(e)
+            return
+        ready.set_result(None)
+        try:
+            while True:
+                item = self._queue.get()
+                batch = [item]
+                deadline = time.monotonic() + self.max_delay
+                while item is not None and len(batch) < self.max_batch:
+                    try:
+                        wait = deadline - time.monotonic()
+                        item = self._queue.get(timeout=wait) if wait > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    batch.append(item)
+                jobs = [b for b in batch if b is not None]
+                if jobs:
+                    self._commit(conn, jobs)
+                if len(jobs) != len(batch):
+                    # Llegó la señal de cierre: terminamos lo que quede encolado y salimos
+                    rest = []
+                    while True:
+                        try:
+                            nxt = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if nxt is not None:
+                            rest.append(nxt)
+                    if rest:
+                        self._commit(conn, rest)
+                    return
+        finally:
+            conn.close()
+
+    def _commit(self, conn, jobs):
+        c = conn.cursor()
+        results = []
+        try:
+            c.execute("BEGIN")
+            for fn, fut in jobs:
+                c.execute("SAVEPOINT job")
+                try:
+                    results.append((fut, fn(c), None))
+                    c.execute("RELEASE job")
+                except Exception as e:
+                    c.execute("ROLLBACK TO job")
+                    c.execute("RELEASE job")
+                    results.append((fut, None, e))
+            c.execute("COMMIT")
+        except Exception as e:
+            # Falló el COMMIT (disco lleno, BD bloqueada...): nada de este lote quedó guardado
+            logger.exception("No pude confirmar un lote de %d escrituras", len(jobs))
+            if conn.in_transaction:
+                conn.rollback()
+            for _, fut in jobs:
+                fut.set_exception(e)
+            return
+        for fut, res, err in results:
+            if err is not None:
+                logger.warning("Escritura fallida en SQLite: %s", err)
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer() -> TicketWriter:
+    """Escritor compartido del proceso (se arranca la primera vez que se usa)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = TicketWriter()
+        return _writer
+
+def close_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+
+# ===== Tickets =====
+
+def _insert_ticket(store, date, total, currency, raw_text, category=None, payment_method=None, user_id=None):
+    # La fecha llega como DD/MM/AAAA (o ISO) y el total como texto; se guardan como ISO y centavos
+    # Compresión, normalización y huellas fuera del hilo escritor: dentro de la transacción solo quedan los INSERT
+    h = simhash(raw_text)
+    row = (user_id, store, to_iso_date(date), to_cents(total), currency or "MXN", category, payment_method,
+           dedupe_key(store, date, total), h)
+    text = (compress_text(raw_text), _normalize(raw_text)) if raw_text else None
+
+    def job(c):
+        c.execute("""
+            INSERT INTO tickets (user_id, store, date, total_cents, currency, category, payment_method,
+                                 dedupe_key, simhash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, row)
+        ticket_id = c.lastrowid
+        if text:
+            c.execute("INSERT INTO ticket_texts (ticket_id, raw_zlib) VALUES (?, ?)", (ticket_id, text[0]))
+            c.execute("INSERT INTO tickets_fts (rowid, body) VALUES (?, ?)", (ticket_id, text[1]))
+        if h is not None:
+            c.executemany("INSERT INTO ticket_simhash_bands (user_id, band, value, ticket_id) VALUES (?, ?, ?, ?)",
+                          [(user_id or 0, band, value, ticket_id) for band, value in enumerate(bands(h))])
+        return ticket_id
+    return job
+
+def save_ticket(store, date, total, currency, raw_text, category=None, payment_method=None, user_id=None):
+    ticket_id = get_writer().submit(
+        _insert_ticket(store, date, total, currency, raw_text, category, payment_method, user_id)
+    ).result()
     print(f"💾 Ticket guardado: {store or '—'} | {date or '—'} | {total or '—'} {currency or 'MXN'}")
+    return ticket_id
+
+async def save_ticket_async(store, date, total, currency, raw_text, category=None, payment_method=None,
+                            user_id=None):
+    """Como save_ticket pero sin bloquear el loop: el insert se agrupa con los demás."""
+    # Huella, compresión y normalización son CPU: se preparan en un hilo, no en el loop
+    job = await asyncio.to_thread(
+        _insert_ticket, store, date, total, currency, raw_text, category, payment_method, user_id
+    )
+    ticket_id = await get_writer().run(job)
+    logger.info("Ticket %s guardado: %s | %s | %s %s", ticket_id, store or "—", date or "—",
+                total or "—", currency or "MXN")
+    return ticket_id
+
+def _insert_tickets(tickets):
+    jobs = [_insert_ticket(**t) for t in tickets]
+
+    def job(c):
+        return [j(c) for j in jobs]
+    return job
+
+def save_tickets(tickets):
+    """Guarda muchos tickets en una sola transacción (importaciones masivas).
+
+    `tickets` es un iterable de dicts con las llaves de save_ticket; devuelve los ids.
+    """
+    return get_writer().submit(_insert_tickets(tickets)).result()
+
+async def save_tickets_async(tickets):
+    """save_tickets para el bot (álbumes): todos o ninguno, sin bloquear el loop."""
+    ids = await get_writer().run(await asyncio.to_thread(_insert_tickets, tickets))
+    logger.info("%d tickets guardados en una transacción: %s", len(ids), ids)
+    return ids
+
+def record_ingest(entries) -> Future:
+    """Guarda un lote de la importación masiva: tickets + manifiesto en la misma transacción.
+
+    `entries` son tuplas (path, size, mtime_ns, ticket, error) donde `ticket` es un
+    dict con las llaves de save_ticket (o None si la imagen falló). Como el
+    manifiesto se confirma junto con los tickets, reanudar nunca duplica ni pierde
+    uno. Devuelve el Future del escritor sin esperar.
+    """
+    rows = [(path, size, mtime_ns, _insert_ticket(**ticket) if ticket else None, error)
+            for path, size, mtime_ns, ticket, error in entries]
+
+    def job(c):
+        for path, size, mtime_ns, insert, error in rows:
+            ticket_id = insert(c) if insert else None
+            c.execute("""
+                INSERT OR REPLACE INTO ingested_files (path, size, mtime_ns, ticket_id, error)
+                VALUES (?, ?, ?, ?, ?)
+            """, (path, size, mtime_ns, ticket_id, error))
+        return len(rows)
+    return get_writer().submit(job)
+
+# ===== Lecturas =====
+
+def _read_conn():
+    # Conexión corta de solo lectura; en WAL no bloquea ni es bloqueada por el escritor
+    return sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True, timeout=5)
+
+def ingested_files():
+    """{ruta: (size, mtime_ns)} de los archivos ya importados con éxito."""
+    conn = _read_conn()
+    try:
+        rows = conn.execute(
+            "SELECT path, size, mtime_ns FROM ingested_files WHERE ticket_id IS NOT NULL"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+def month_summary(user_id, month):
+    """Gasto del usuario en un mes ('YYYY-MM') por tienda, de mayor a menor.
+
+    Lee la tabla spending_summary (mantenida por triggers), así que el costo no
+    depende de cuántos tickets tenga el usuario. Devuelve [(store, n, total_cents)].
+    """
+    conn = _read_conn()
+    try:
+        return conn.execute("""
+            SELECT store, n_tickets, total_cents FROM spending_summary
+            WHERE user_id = ? AND month = ? AND n_tickets > 0
+            ORDER BY total_cents DESC
+        """, (user_id, month)).fetchall()
+    finally:
+        conn.close()
+
+def ticket_text(ticket_id):
+    """Texto del OCR de un ticket (descomprimido), o None."""
+    conn = _read_conn()
+    try:
+        row = conn.execute("SELECT raw_zlib FROM ticket_texts WHERE ticket_id = ?", (ticket_id,)).fetchone()
+    finally:
+        conn.close()
+    return decompress_text(row[0]) if row else None
+
+# ===== Repetidos =====
+
+# Tope de candidatos por texto (los más recientes): aun con un historial enorme la
+# comparación fina cuesta lo mismo
+SIMHASH_MAX_CANDIDATES = int(os.getenv("SIMHASH_MAX_CANDIDATES", "64"))
+
+_BAND_CANDIDATES = " UNION ".join(
+    [f"SELECT ticket_id FROM ticket_simhash_bands WHERE user_id = ? AND band = ? "
+     f"AND value IN ({', '.join('?' * (SIMHASH_BAND_BITS + 1))})"] * SIMHASH_BANDS
+) + " ORDER BY ticket_id DESC LIMIT ?"
+
+def find_duplicate(user_id, store, date, total, raw_text):
+    """Ticket ya guardado del usuario que parece el mismo, o None.
+
+    Primero la llave exacta (tienda, fecha, total) y luego el texto: candidatos
+    con alguna banda del SimHash igual o a un bit (dedupe.probes, hasta
+    SIMHASH_MAX_CANDIDATES), de los que gana el más cercano si está a
+    SIMHASH_MAX_DISTANCE bits o menos. Ambas búsquedas van por índice.
+    Devuelve (id, date ISO, store, total_cents, "exact" | "similar").
+    """
+    key, h = dedupe_key(store, date, total), simhash(raw_text)
+    conn = _read_conn()
+    try:
+        if key is not None:
+            row = conn.execute("""
+                SELECT id, date, store, total_cents FROM tickets
+                WHERE user_id IS ? AND dedupe_key = ? ORDER BY id DESC LIMIT 1
+            """, (user_id, key)).fetchone()
+            if row:
+                return (*row, "exact")
+        if h is None:
+            return None
+        params = [p for band, values in enumerate(probes(h)) for p in (user_id or 0, band, *values)]
+        params.append(SIMHASH_MAX_CANDIDATES)
+        candidates = conn.execute(f"""
+            SELECT id, date, store, total_cents, simhash FROM tickets
+            WHERE id IN ({_BAND_CANDIDATES})
+        """, params).fetchall()
+    finally:
+        conn.close()
+    scored = [(hamming(h, other), row) for *row, other in candidates if other is not None]
+    scored = [s for s in scored if s[0] <= SIMHASH_MAX_DISTANCE]
+    if not scored:
+        return None
+    _, row = min(scored, key=lambda s: (s[0], -s[1][0]))
+    return (*row, "similar")
+
+# ===== Búsqueda de texto =====
+
+_RE_WORD = re.compile(r"\w+")
+
+def _match_query(query):
+    """Consulta FTS5: cada palabra normalizada (igual que al indexar) como prefijo, todas obligatorias."""
+    words = _RE_WORD.findall(_normalize(query))
+    return " ".join(f'"{w}"*' for w in words)
+
+def _snippet(text, words, width=80):
+    # Primera línea del ticket que contiene alguna de las palabras buscadas
+    for line in text.splitlines():
+        norm = _normalize(line)
+        if any(w in norm for w in words):
+            line = line.strip()
+            return line if len(line) <= width else line[:width - 1] + "…"
+    return ""
+
+def search_tickets(user_id, query, limit=10):
+    """Tickets del usuario cuyo texto coincide con `query`, del más al menos relevante (bm25).
+
+    Devuelve [(id, date ISO, store, total_cents, línea que coincidió)]. Solo se
+    descomprime el texto de los resultados, para armar la línea de contexto.
+    """
+    match = _match_query(query)
+    if not match:
+        return []
+    conn = _read_conn()
+    try:
+        rows = conn.execute("""
+            SELECT t.id, t.date, t.store, t.total_cents, x.raw_zlib
+            FROM tickets_fts f
+            JOIN tickets t ON t.id = f.rowid
+            LEFT JOIN ticket_texts x ON x.ticket_id = t.id
+            WHERE tickets_fts MATCH ? AND t.user_id = ?
+            ORDER BY f.rank
+            LIMIT ?
+        """, (match, user_id, limit)).fetchall()
+    finally:
+        conn.close()
+    words = _RE_WORD.findall(_normalize(query))
+    return [(tid, date, store, cents, _snippet(decompress_text(blob) or "", words))
+            for tid, date, store, cents, blob in rows]
+
+# ===== Exportación =====
+
+EXPORT_COLUMNS = ("id", "user_id", "date", "store", "total_cents", "currency", "category", "payment_method",
+                  "created_at")
+
+def iter_tickets(user_id=None, since=None, until=None, stores=None, chunk=1000, with_text=False):
+    """Tickets en orden de fecha (y id), en listas de hasta `chunk` filas (columnas EXPORT_COLUMNS).
+
+    Es un generador sobre un cursor abierto: SQLite produce las filas conforme
+    se piden con fetchmany, así que la memoria depende de `chunk` y no de
+    cuántos tickets haya. Los filtros van por índice ((user_id, date),
+    (store, date) o date) y el orden sale del mismo índice, sin ordenar aparte.
+    `since`/`until` son fechas ISO inclusivas y `stores` nombres exactos. Con
+    `with_text`, cada fila trae al final el texto del OCR.
+    """
+    where, params = [], []
+    if user_id is not None:
+        where.append("t.user_id = ?")
+        params.append(user_id)
+    if stores:
+        where.append(f"t.store IN ({', '.join('?' * len(stores))})")
+        params.extend(stores)
+    if since:
+        where.append("t.date >= ?")
+        params.append(since)
+    if until:
+        where.append("t.date <= ?")
+        params.append(until)
+    sql = (
+        f"SELECT {', '.join('t.' + col for col in EXPORT_COLUMNS)}"
+        + (", x.raw_zlib FROM tickets t LEFT JOIN ticket_texts x ON x.ticket_id = t.id" if with_text else " FROM tickets t")
+        + (" WHERE " + " AND ".join(where) if where else "")
+        + " ORDER BY t.date, t.id"
+    )
+    conn = _read_conn()
+    try:
+        cur = conn.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                return
+            if with_text:
+                rows = [(*row[:-1], decompress_text(row[-1])) for row in rows]
+            yield rows
+    finally:
+        conn.close()  # también si quien consume deja el generador a medias
+
+# ===== Caché de OCR =====
+
+def cache_get(file_unique_id=None, image_hash=None):
+    """Busca un OCR previo por file_unique_id de Telegram o por hash de píxeles.
+
+    Devuelve (store, date, total, raw_text, variant, image_hash) o None. Solo
+    lee: marcar la entrada como usada es una escritura y va por el escritor
+    (cache_touch, o cache_put cuando el resultado vuelve de un worker).
+    """
+    conn = _read_conn()
+    try:
+        c = conn.cursor()
+        if image_hash is None and file_unique_id is not None:
+            row = c.execute(
+                "SELECT image_hash FROM ocr_cache_files WHERE file_unique_id = ?",
+                (file_unique_id,),
+            ).fetchone()
+            image_hash = row[0] if row else None
+        if image_hash is None:
+            return None
+        return c.execute(
+            "SELECT store, date, total, raw_text, variant, image_hash FROM ocr_cache WHERE image_hash = ?",
+            (image_hash,),
+        ).fetchone()
+    finally:
+        conn.close()
+
+def cache_touch(image_hash) -> Future:
+    """Marca una entrada de la caché como usada ahora (para el LRU); devuelve el Future sin esperar."""
+    now = time.time()
+
+    def job(c):
+        c.execute("UPDATE ocr_cache SET last_used = ? WHERE image_hash = ?", (now, image_hash))
+    return get_writer().submit(job)
+
+# Filas de ocr_cache según el escritor de este proceso (None = aún no se cuentan). Solo lo
+# tocan los trabajos del hilo escritor; si otro proceso también escribe se desfasa, por eso
+# se vuelve a contar antes de desalojar.
+_cache_rows = None
+
+def cache_put(image_hash, store, date, total, raw_text, variant, file_unique_id=None) -> Future:
+    """Guarda (o refresca) un resultado de OCR y desaloja lo menos usado si se pasa del límite.
+
+    La escritura va por el escritor compartido; devuelve su Future sin esperar.
+    """
+    now = time.time()
+
+    def job(c):
+        global _cache_rows
+        if _cache_rows is None:
+            (_cache_rows,) = c.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()
+        c.execute("""
+            INSERT OR IGNORE INTO ocr_cache (image_hash, store, date, total, raw_text, variant, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (image_hash, store, date, total, raw_text, variant, now))
+        if c.rowcount:
+            _cache_rows += 1
+        else:
+            c.execute("UPDATE ocr_cache SET last_used = ? WHERE image_hash = ?", (now, image_hash))
+        if file_unique_id:
+            c.execute(
+                "INSERT OR REPLACE INTO ocr_cache_files (file_unique_id, image_hash) VALUES (?, ?)",
+                (file_unique_id, image_hash),
+            )
+        if _cache_rows > OCR_CACHE_MAX:
+            (_cache_rows,) = c.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()
+            evicted = c.execute(
+                "SELECT image_hash FROM ocr_cache ORDER BY last_used LIMIT ?",
+                (max(_cache_rows - OCR_CACHE_MAX, 0),),
+            ).fetchall()
+            c.executemany("DELETE FROM ocr_cache WHERE image_hash = ?", evicted)
+            c.executemany("DELETE FROM ocr_cache_files WHERE image_hash = ?", evicted)
+            _cache_rows -= len(evicted)
+    return get_writer().submit(job)
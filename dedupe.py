@@ -0,0 +1,92 @@
+"""Huellas para detectar tickets repetidos.
+
+Dos señales, ambas con búsqueda por índice (ver db_utils.find_duplicate):
+
+- Llave exacta: tienda normalizada + fecha ISO + total en centavos. Atrapa el
+  mismo ticket aunque el OCR haya leído distinto el resto del texto.
+- SimHash de 64 bits del texto del OCR (trigramas de caracteres del texto
+  normalizado, con los dígitos que el OCR confunde con letras ya plegados a
+  ellas: un error en una letra solo toca tres trigramas). Dos
+  fotos del mismo ticket dan huellas a pocos bits de distancia. Para no
+  comparar contra todos los tickets, la huella se parte en SIMHASH_BANDS bandas
+  de 16 bits que se indexan por separado. Si dos huellas difieren en menos de
+  2 × SIMHASH_BANDS bits, alguna banda difiere en a lo más un bit, así que
+  basta buscar cada banda y sus 16 vecinas a un bit (`probes`) y medir la
+  distancia solo en esos candidatos. Con bandas de 16 bits, una huella
+  cualquiera cae por azar en ~0.1 % de las búsquedas (ver test_dedupe.py).
+"""
+import hashlib
+import os
+import re
+from collections import Counter
+from typing import List, Optional
+
+from db_init import to_cents, to_iso_date
+from extractor import _normalize
+
+# Bandas del índice (fijo: cambiarlo obliga a reindexar ticket_simhash_bands, ver migración 6)
+SIMHASH_BANDS = 4
+SIMHASH_BAND_BITS = 64 // SIMHASH_BANDS
+# Bits de diferencia con los que dos textos se consideran el mismo ticket; hasta
+# 2 × SIMHASH_BANDS - 1 ningún repetido se escapa de las búsquedas de `probes`
+SIMHASH_MAX_DISTANCE = min(int(os.getenv("SIMHASH_MAX_DISTANCE", "7")), 2 * SIMHASH_BANDS - 1)
+# Textos con menos palabras no tienen huella (un ticket casi vacío se parece a cualquier otro)
+SIMHASH_MIN_WORDS = 8
+
+_RE_WORD = re.compile(r"\w+")
+_MASK64 = (1 << 64) - 1
+# 0/o, 1/l, 5/s, 8/b... son los cambios más comunes del OCR; plegados, dos lecturas del mismo ticket se parecen más
+_FOLD = str.maketrans("0158264", "olsbzga")
+
+# Suma por bit sin recorrer los 64 bits de cada hash: cada bit ocupa un carril de _LANE
+# bits en un entero grande, y _SPREAD reparte un byte en sus 8 carriles de una vez
+_LANE = 20  # hasta ~1 millón de trigramas por texto
+_LANE_MASK = (1 << _LANE) - 1
+_SPREAD = [sum((b >> i & 1) << (i * _LANE) for i in range(8)) for b in range(256)]
+
+
+def dedupe_key(store, date, total) -> Optional[str]:
+    """'oxxo|2024-05-12|10100'; None si falta la fecha o el total (no basta para decidir)."""
+    try:
+        iso, cents = to_iso_date(date), to_cents(total)
+    except ValueError:
+        return None
+    if iso is None or cents is None:
+        return None
+    return f"{_normalize(store or '')}|{iso}|{cents}"
+
+
+def simhash(text) -> Optional[int]:
+    """SimHash de 64 bits (con signo, para caber en un INTEGER de SQLite) o None si hay poco texto."""
+    words = _RE_WORD.findall(_normalize(text or "").translate(_FOLD))
+    if len(words) < SIMHASH_MIN_WORDS:
+        return None
+    s = " ".join(words)
+    grams = Counter(s[i:i + 3] for i in range(len(s) - 2))
+    acc = 0
+    for gram, weight in grams.items():
+        d = hashlib.blake2b(gram.encode(), digest_size=8).digest()
+        spread = 0
+        for k in range(8):
+            spread |= _SPREAD[d[k]] << (8 * k * _LANE)
+        acc += weight * spread
+    # Bit i = 1 si más de la mitad de los trigramas (con su peso) lo tienen en 1
+    n = sum(grams.values())
+    value = sum(1 << i for i in range(64) if 2 * (acc >> (i * _LANE) & _LANE_MASK) > n)
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin((a ^ b) & _MASK64).count("1")
+
+
+def bands(h: int) -> List[int]:
+    """La huella partida en SIMHASH_BANDS tramos de SIMHASH_BAND_BITS bits contiguos."""
+    h &= _MASK64
+    mask = (1 << SIMHASH_BAND_BITS) - 1
+    return [h >> (i * SIMHASH_BAND_BITS) & mask for i in range(SIMHASH_BANDS)]
+
+
+def probes(h: int) -> List[List[int]]:
+    """Por banda, los valores a buscar en el índice: el de `h` y los que difieren en un bit."""
+    return [[v] + [v ^ (1 << bit) for bit in range(SIMHASH_BAND_BITS)] for v in bands(h)]
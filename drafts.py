@@ -0,0 +1,299 @@
+"""Borradores de tickets fuera de la memoria del proceso.
+
+Cada usuario tiene a lo más un borrador (el ticket que está confirmando o
+editando) y a lo más un álbum pendiente (varios borradores con un registro común). Se guarda en un almacén clave-valor con caducidad, así que un
+reinicio no lo pierde y cualquier proceso del bot puede atender los botones
+o el texto de cualquier usuario.
+
+- El registro "caliente" (tienda, fecha, total, moneda, campo en edición) se
+  serializa con `struct` en unas decenas de bytes; es lo único que leen los
+  botones y las ediciones.
+- El texto del OCR (`raw_text`, varios KB) va en otra llave y solo se lee al
+  confirmar.
+
+Backends (DRAFT_BACKEND): `sqlite` (tabla kv_store de la BD, por defecto) y
+`memory` (un solo proceso, útil en pruebas). Otro backend (Redis, etc.) solo
+necesita implementar get/set/touch/delete.
+"""
+import asyncio
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from db_init import DB_PATH
+from db_utils import get_writer
+
+DRAFT_BACKEND = os.getenv("DRAFT_BACKEND", "sqlite")
+# Segundos que vive un borrador sin actividad
+DRAFT_TTL = float(os.getenv("DRAFT_TTL", str(24 * 3600)))
+
+EDIT_FIELDS = (None, "store", "date", "total")
+
+
+class TicketDraft:
+    __slots__ = ("store", "date", "total", "currency", "raw_text", "used_pre", "edit_field")
+
+    def __init__(self, store: Optional[str] = None, date: Optional[str] = None, total: Optional[str] = None,
+                 currency: str = "MXN", raw_text: Optional[str] = None, used_pre: bool = True,
+                 edit_field: Optional[str] = None):
+        self.store = store
+        self.date = date
+        self.total = total
+        self.currency = currency
+        self.raw_text = raw_text
+        self.used_pre = used_pre
+        self.edit_field = edit_field  # campo que espera texto del usuario (None = no está editando)
+
+    def __repr__(self):
+        return f"TicketDraft(store={self.store!r}, date={self.date!r}, total={self.total!r}, edit_field={self.edit_field!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, TicketDraft) and all(
+            getattr(self, s) == getattr(other, s) for s in self.__slots__
+        )
+
+
+# ===== Serialización =====
+# versión, flags, campo en edición, moneda (3 bytes ASCII), largo de tienda, largo de fecha, largo de total
+_HEADER = struct.Struct("<BBB3sHBB")
+_VERSION = 1
+_F_USED_PRE = 1
+_F_STORE = 2
+_F_DATE = 4
+_F_TOTAL = 8
+
+
+def pack(td: TicketDraft) -> bytes:
+    """Registro caliente (sin raw_text)."""
+    store = (td.store or "").encode()[:0xFFFF]
+    date = (td.date or "").encode()[:0xFF]
+    total = (td.total or "").encode()[:0xFF]
+    flags = ((_F_USED_PRE if td.used_pre else 0) | (_F_STORE if td.store is not None else 0)
+             | (_F_DATE if td.date is not None else 0) | (_F_TOTAL if td.total is not None else 0))
+    header = _HEADER.pack(_VERSION, flags, EDIT_FIELDS.index(td.edit_field),
+                          (td.currency or "MXN").encode("ascii", "replace")[:3].ljust(3),
+                          len(store), len(date), len(total))
+    return header + store + date + total
+
+
+def unpack(data: bytes) -> TicketDraft:
+    version, flags, edit, currency, n_store, n_date, n_total = _HEADER.unpack_from(data)
+    if version != _VERSION:
+        raise ValueError(f"Versión de borrador desconocida: {version}")
+    pos = _HEADER.size
+    store, date, total = (data[pos:pos + n_store], data[pos + n_store:pos + n_store + n_date],
+                          data[pos + n_store + n_date:pos + n_store + n_date + n_total])
+    return TicketDraft(
+        store=store.decode(errors="ignore") if flags & _F_STORE else None,
+        date=date.decode(errors="ignore") if flags & _F_DATE else None,
+        total=total.decode(errors="ignore") if flags & _F_TOTAL else None,
+        currency=currency.decode().strip(),
+        used_pre=bool(flags & _F_USED_PRE),
+        edit_field=EDIT_FIELDS[edit],
+    )
+
+
+# ===== Backends clave-valor =====
+
+class MemoryBackend:
+    """Diccionario con caducidad; solo sirve dentro de un proceso."""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if item[1] <= time.time():
+                del self._data[key]
+                return None
+            return item[0]
+
+    def set(self, key: str, value: bytes, ttl: float):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl)
+
+    def touch(self, key: str, ttl: float):
+        with self._lock:
+            if key in self._data:
+                self._data[key] = (self._data[key][0], time.time() + ttl)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+
+class SQLiteBackend:
+    """Tabla kv_store de la BD: escrituras por el escritor compartido, lecturas directas."""
+
+    PURGE_EVERY = 200  # cada cuántas escrituras se borran las llaves caducadas
+
+    def __init__(self):
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self):
+        # Una conexión de lectura por hilo (se reutiliza: abrirla cuesta más que la consulta)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            get_writer().start()  # crea/migra la BD (tabla kv_store) antes de la primera lectura
+            conn = self._local.conn = sqlite3.connect(DB_PATH, timeout=5)
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute(
+            "SELECT value FROM kv_store WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, sql: str, params):
+        self._writes += 1
+        purge = self._writes % self.PURGE_EVERY == 0
+        now = time.time()
+
+        def job(c):
+            c.execute(sql, params)
+            if purge:
+                c.execute("DELETE FROM kv_store WHERE expires_at <= ?", (now,))
+        get_writer().submit(job).result()
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self._write(
+            "INSERT OR REPLACE INTO kv_store (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl),
+        )
+
+    def touch(self, key: str, ttl: float):
+        self._write("UPDATE kv_store SET expires_at = ? WHERE key = ?", (time.time() + ttl, key))
+
+    def delete(self, *keys: str):
+        def job(c):
+            c.executemany("DELETE FROM kv_store WHERE key = ?", [(k,) for k in keys])
+        get_writer().submit(job).result()
+
+
+BACKENDS = {"sqlite": SQLiteBackend, "memory": MemoryBackend}
+
+
+# ===== Álbumes =====
+# Un álbum son varios borradores (slots 0..n-1) más este registro: cuáles se van a
+# guardar (máscara de bits) y cuál se está editando.
+
+MAX_ALBUM = 32  # la máscara de incluidos se guarda en 32 bits (ver _ALBUM)
+
+
+class AlbumState:
+    __slots__ = ("n", "included", "editing")
+
+    def __init__(self, n: int, included: int = None, editing: Optional[int] = None):
+        if not 0 < n <= MAX_ALBUM:
+            raise ValueError(f"Un álbum tiene de 1 a {MAX_ALBUM} tickets, no {n}")
+        self.n = n
+        self.included = (1 << n) - 1 if included is None else included
+        self.editing = editing
+
+    def is_included(self, slot: int) -> bool:
+        return bool(self.included >> slot & 1)
+
+    def toggle(self, slot: int):
+        self.included ^= 1 << slot
+
+    def slots(self):
+        return [i for i in range(self.n) if self.is_included(i)]
+
+
+_ALBUM = struct.Struct("<BBIB")  # versión, n, máscara de incluidos, slot en edición (0xFF = ninguno)
+
+
+def pack_album(album: AlbumState) -> bytes:
+    return _ALBUM.pack(_VERSION, album.n, album.included, 0xFF if album.editing is None else album.editing)
+
+
+def unpack_album(data: bytes) -> AlbumState:
+    version, n, included, editing = _ALBUM.unpack(data)
+    if version != _VERSION:
+        raise ValueError(f"Versión de álbum desconocida: {version}")
+    return AlbumState(n, included, None if editing == 0xFF else editing)
+
+
+# ===== Almacén de borradores =====
+
+class DraftStore:
+    """API async para el bot; el backend es síncrono y corre en un hilo.
+
+    `slot` distingue los tickets de un álbum; sin slot es el borrador de una foto suelta.
+    """
+
+    def __init__(self, backend=None, ttl: float = DRAFT_TTL):
+        self.backend = backend if backend is not None else BACKENDS[DRAFT_BACKEND]()
+        self.ttl = ttl
+
+    @staticmethod
+    def _keys(user_id: int, slot: int = None) -> Tuple[str, str]:
+        base = f"draft:{user_id}" if slot is None else f"draft:{user_id}:{slot}"
+        return base, f"{base}:text"
+
+    def get_sync(self, user_id: int, slot: int = None) -> Optional[TicketDraft]:
+        data = self.backend.get(self._keys(user_id, slot)[0])
+        return unpack(data) if data is not None else None
+
+    def put_sync(self, user_id: int, td: TicketDraft, slot: int = None):
+        """Guarda el registro; el texto solo se escribe si viene (si no, solo se renueva su TTL)."""
+        rec_key, text_key = self._keys(user_id, slot)
+        self.backend.set(rec_key, pack(td), self.ttl)
+        if td.raw_text is not None:
+            self.backend.set(text_key, td.raw_text.encode(), self.ttl)
+        else:
+            self.backend.touch(text_key, self.ttl)
+
+    def raw_text_sync(self, user_id: int, slot: int = None) -> Optional[str]:
+        data = self.backend.get(self._keys(user_id, slot)[1])
+        return data.decode() if data is not None else None
+
+    def delete_sync(self, user_id: int, slot: int = None):
+        self.backend.delete(*self._keys(user_id, slot))
+
+    def get_album_sync(self, user_id: int) -> Optional[AlbumState]:
+        data = self.backend.get(f"album:{user_id}")
+        return unpack_album(data) if data is not None else None
+
+    def put_album_sync(self, user_id: int, album: AlbumState, tds=None):
+        """Guarda el estado del álbum y, si se pasan, sus borradores (uno por slot)."""
+        for slot, td in enumerate(tds or ()):
+            self.put_sync(user_id, td, slot)
+        self.backend.set(f"album:{user_id}", pack_album(album), self.ttl)
+
+    def delete_album_sync(self, user_id: int):
+        album = self.get_album_sync(user_id)
+        keys = [f"album:{user_id}"]
+        for slot in range(album.n if album else 0):
+            keys += self._keys(user_id, slot)
+        self.backend.delete(*keys)
+
+    async def get(self, user_id: int, slot: int = None) -> Optional[TicketDraft]:
+        return await asyncio.to_thread(self.get_sync, user_id, slot)
+
+    async def put(self, user_id: int, td: TicketDraft, slot: int = None):
+        await asyncio.to_thread(self.put_sync, user_id, td, slot)
+
+    async def raw_text(self, user_id: int, slot: int = None) -> Optional[str]:
+        return await asyncio.to_thread(self.raw_text_sync, user_id, slot)
+
+    async def delete(self, user_id: int, slot: int = None):
+        await asyncio.to_thread(self.delete_sync, user_id, slot)
+
+    async def get_album(self, user_id: int) -> Optional[AlbumState]:
+        return await asyncio.to_thread(self.get_album_sync, user_id)
+
+    async def put_album(self, user_id: int, album: AlbumState, tds=None):
+        await asyncio.to_thread(self.put_album_sync, user_id, album, tds)
+
+    async def delete_album(self, user_id: int):
+        await asyncio.to_thread(self.delete_album_sync, user_id)
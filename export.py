@@ -0,0 +1,180 @@
+"""Exportación del historial de tickets a CSV o Parquet.
+
+Las filas salen de db_utils.iter_tickets en bloques de EXPORT_CHUNK, así que
+la memoria es la misma con 50 tickets que con 500 mil: el CSV se escribe
+bloque por bloque y el Parquet (columnar, comprimido con zstd) por grupos de
+hasta EXPORT_ROW_GROUP filas que se juntan ya en formato Arrow. Parquet
+necesita pyarrow (opcional: sin él solo hay CSV).
+
+Lo usan /exportar del bot y la línea de comandos:
+
+    python export.py --user-id 123 --since 01/01/2024 --until 30/06/2024 -o tickets.csv
+    python export.py --store Oxxo -o oxxo.parquet
+    python export.py > todos.csv
+"""
+import argparse
+import csv
+import datetime
+import importlib
+import importlib.util
+import os
+import sys
+import time
+from decimal import Decimal
+from typing import List, Optional
+
+from brands import get_matcher
+from db_init import from_cents, to_iso_date
+from db_utils import EXPORT_COLUMNS, close_writer, get_writer, iter_tickets
+
+# Filas que se piden a SQLite por vuelta
+EXPORT_CHUNK = int(os.getenv("EXPORT_CHUNK", "1000"))
+# Filas por grupo de Parquet (más grande = mejor compresión y lectura, más memoria al escribir)
+EXPORT_ROW_GROUP = int(os.getenv("EXPORT_ROW_GROUP", "50000"))
+
+FORMATS = ("csv", "parquet")
+# pyarrow es opcional (sin él solo hay CSV) y se importa al escribir el primer Parquet:
+# el bot importa este módulo al arrancar y casi nunca exporta
+HAS_PARQUET = importlib.util.find_spec("pyarrow") is not None
+pa = pq = None
+# Columnas del archivo: las de la BD, con el total en pesos en lugar de centavos
+HEADER = tuple("total" if col == "total_cents" else col for col in EXPORT_COLUMNS)
+_DATE, _TOTAL, _CREATED = (EXPORT_COLUMNS.index(col) for col in ("date", "total_cents", "created_at"))
+
+
+def store_names(name: str) -> List[str]:
+    """Nombres guardados que corresponden a lo que escribió el usuario: tal cual y su marca canónica."""
+    names = [name.strip()]
+    canonical = get_matcher().match(name)
+    if canonical and canonical not in names:
+        names.append(canonical)
+    return names
+
+
+def write_csv(chunks, out, with_text: bool = False) -> int:
+    """Escribe los bloques en `out` (archivo de texto); devuelve cuántos tickets escribió."""
+    writer = csv.writer(out)
+    writer.writerow(HEADER + (("raw_text",) if with_text else ()))
+    n = 0
+    for rows in chunks:
+        writer.writerows(
+            (*row[:_TOTAL], from_cents(row[_TOTAL]), *row[_TOTAL + 1:]) for row in rows
+        )
+        n += len(rows)
+    return n
+
+
+def _load_pyarrow():
+    global pa, pq
+    if pa is None:
+        if not HAS_PARQUET:
+            raise RuntimeError("Exportar a Parquet necesita pyarrow (pip install pyarrow)")
+        pa, pq = importlib.import_module("pyarrow"), importlib.import_module("pyarrow.parquet")
+
+
+def _parquet_schema(with_text: bool):
+    fields = [
+        ("id", pa.int64()), ("user_id", pa.int64()), ("date", pa.date32()), ("store", pa.string()),
+        ("total", pa.decimal128(18, 2)), ("currency", pa.string()), ("category", pa.string()),
+        ("payment_method", pa.string()), ("created_at", pa.timestamp("s")),
+    ]
+    if with_text:
+        fields.append(("raw_text", pa.string()))
+    return pa.schema(fields)
+
+
+def _parse(fn, value):
+    try:
+        return fn(value) if value else None
+    except ValueError:
+        return None
+
+
+def _batch(rows, schema):
+    """Un bloque de filas a columnas Arrow (mucho más compactas que las tuplas de Python)."""
+    cols = list(zip(*rows))
+    cols[_DATE] = [_parse(datetime.date.fromisoformat, d) for d in cols[_DATE]]
+    cols[_TOTAL] = [None if c is None else Decimal(c).scaleb(-2) for c in cols[_TOTAL]]
+    cols[_CREATED] = [_parse(datetime.datetime.fromisoformat, t) for t in cols[_CREATED]]
+    return pa.RecordBatch.from_arrays([pa.array(col, f.type) for col, f in zip(cols, schema)], schema=schema)
+
+
+def write_parquet(chunks, path: str, with_text: bool = False, row_group: int = EXPORT_ROW_GROUP) -> int:
+    """Escribe los bloques en un Parquet; devuelve cuántos tickets escribió."""
+    _load_pyarrow()
+    schema = _parquet_schema(with_text)
+    n = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        batches, pending = [], 0
+        for rows in chunks:
+            batches.append(_batch(rows, schema))
+            pending += len(rows)
+            if pending >= row_group:
+                writer.write_table(pa.Table.from_batches(batches, schema))
+                n, batches, pending = n + pending, [], 0
+        if batches:
+            writer.write_table(pa.Table.from_batches(batches, schema))
+            n += pending
+    return n
+
+
+def export_tickets(out, fmt: str = "csv", user_id: int = None, since: str = None, until: str = None,
+                   store: str = None, with_text: bool = False, chunk: int = EXPORT_CHUNK) -> int:
+    """Exporta los tickets que cumplen los filtros a `out` (ruta, o archivo de texto para CSV).
+
+    `since`/`until` aceptan DD/MM/AAAA o ISO; `store` se busca tal cual y por su
+    marca canónica. Devuelve cuántos tickets se exportaron.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato desconocido: {fmt!r} (usa {' o '.join(FORMATS)})")
+    chunks = iter_tickets(
+        user_id=user_id, since=to_iso_date(since), until=to_iso_date(until),
+        stores=store_names(store) if store else None, chunk=chunk, with_text=with_text,
+    )
+    if fmt == "parquet":
+        return write_parquet(chunks, out, with_text)
+    if isinstance(out, str):
+        with open(out, "w", newline="", encoding="utf-8") as fh:
+            return write_csv(chunks, fh, with_text)
+    return write_csv(chunks, out, with_text)
+
+
+def _format_for(path: Optional[str], fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "parquet" if path and path.lower().endswith(".parquet") else "csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta el historial de tickets a CSV o Parquet.")
+    parser.add_argument("-o", "--out", help="archivo de salida (sin él: CSV a la salida estándar)")
+    parser.add_argument("--format", choices=FORMATS, help="por defecto según la extensión de --out")
+    parser.add_argument("--user-id", type=int, default=None, help="solo los tickets de este usuario")
+    parser.add_argument("--since", help="desde esta fecha (DD/MM/AAAA o AAAA-MM-DD), inclusive")
+    parser.add_argument("--until", help="hasta esta fecha, inclusive")
+    parser.add_argument("--store", help="solo esta tienda (también por su nombre canónico)")
+    parser.add_argument("--text", action="store_true", help="incluir el texto del OCR de cada ticket")
+    parser.add_argument("--chunk", type=int, default=EXPORT_CHUNK, help="filas por lectura a SQLite")
+    args = parser.parse_args()
+
+    fmt = _format_for(args.out, args.format)
+    if fmt == "parquet" and not args.out:
+        parser.error("Parquet necesita --out")
+    for name in ("since", "until"):
+        if getattr(args, name) and not to_iso_date(getattr(args, name)):
+            parser.error(f"--{name}: fecha inválida {getattr(args, name)!r}")
+
+    get_writer().start()  # crea/migra la BD si hace falta antes de leer
+    t0 = time.perf_counter()
+    try:
+        n = export_tickets(
+            args.out or sys.stdout, fmt, user_id=args.user_id, since=args.since, until=args.until,
+            store=args.store, with_text=args.text, chunk=args.chunk,
+        )
+    finally:
+        close_writer()
+    print(f"✅ {n} tickets → {args.out or 'salida estándar'} ({fmt}, {time.perf_counter() - t0:.1f}s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Extracción de campos (tienda, fecha, total) a partir del texto del OCR.
+
+Todas las expresiones se compilan una vez al importar. El texto se normaliza
+línea por línea una sola vez; sobre el resultado una pasada busca las fechas
+y otra los montos (saltando los dígitos que ya son de una fecha). Las primeras
+líneas normalizadas se reutilizan para buscar la tienda.
+"""
+import re
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from brands import get_matcher, to_ascii
+
+# Meses abreviados en español -> número
+MONTHS = {
+    "ene": "01", "feb": "02", "mar": "03", "abr": "04", "may": "05", "jun": "06",
+    "jul": "07", "ago": "08", "sep": "09", "oct": "10", "nov": "11", "dic": "12"
+}
+_MON = "|".join(MONTHS)
+# Mes como palabra completa: abreviado o con su nombre entero (no “mar” de “margarina”)
+_MONTH_NAMES = ("enero", "febrero", "marzo", "abril", "mayo", "junio", "julio", "agosto",
+                "septiembre", "sept", "octubre", "noviembre", "diciembre")
+_MON_WORD = "|".join(sorted((*_MONTH_NAMES, *MONTHS), key=len, reverse=True))
+
+# Acepta 101, 101.00, 1,234.56 o 3,500
+_MONEY = (
+    r"(?:\d{1,3}(?:[.,]\d{3})+|\d{1,7})[.,]\d{2}(?!\d)"  # con centavos: 1,234.56 · 1234.56 · 45,50
+    r"|\d{1,3}(?:[.,]\d{3})+(?!\d)"                      # miles sin centavos: 3,500 (no “3” ni “3,50”)
+    r"|\d{1,7}"
+)
+
+_RE_JUNK = re.compile(r"[^\w\s\.\,\:\-/\$]")  # deja letras, digitos y separadores comunes
+_RE_SPACES = re.compile(r"\s+")
+_RE_PRETTY_JUNK = re.compile(r"[^\w\s\.\-&]")
+_RE_LETTERS = re.compile(r"[a-zA-Z]{3,}")
+
+# Fechas: primera pasada. Sus tramos se saltan al buscar montos.
+_RE_DATES = re.compile(rf"""
+    \b(?P<nd>[0-3]?\d)[/\-](?P<nm>[01]?\d)[/\-](?P<ny>\d{{2,4}})\b          # 12/05/2024, 12-05-24
+  | \b(?P<td>[0-3]?\d)\s*(?P<tm>{_MON_WORD})(?![a-z])\s*(?P<ty>\d{{2,4}})\b  # 12 nov 2025
+  | \b(?P<mm>{_MON_WORD})\s*(?P<fix>[il](?=\d))?(?P<md>[0-3]?\d)\s*(?P<my>\d{{2,4}})\b
+                                                                            # nov 12 25, novi2 25 (OCR: 1 -> i/l)
+""", re.VERBOSE)
+
+# Montos: segunda pasada. El valor de una palabra clave no puede ser el inicio de una
+# fecha (“pago 15-03-24”) ni quedarse con parte de un número más largo.
+_RE_MONEY = re.compile(rf"""
+    (?P<kw>total|importe|pagar|pagada|pago)[^\d]{{0,20}}(?P<kwv>{_MONEY})(?![\d/\-])   # TOTAL $ 101.00
+  | (?P<num>{_MONEY})                                                                # cualquier otro número
+""", re.VERBOSE)
+
+# Pistas para ubicar en qué línea está cada campo (OCR por regiones en ocr.py)
+# (tolera confusiones del OCR como T0TAL / IMP0RTE)
+_RE_TOTAL_HINT = re.compile(r"t[o0]ta[l1]|imp[o0]rte|pagar|pagada|pag[o0]")
+_RE_DATE_HINT = re.compile(rf"\d{{1,2}}\s*[/\-]\s*\d{{1,2}}|\b(?:{_MON})")
+
+# Prioridad entre formatos de fecha cuando aparecen varios
+_DATE_KINDS = ("num", "dm", "md")
+
+# Si no hay marca conocida, la tienda es la primera línea “prometedora” que no sea dirección
+STORE_LINES = 6
+STORE_BLACKLIST = ("calle", "av", "avenida", "col", "cp", "local", "manzana", "monterrey", "nuevo", "leon")
+
+
+def _normalize(s: str) -> str:
+    """Quita acentos, pasa a minúsculas, elimina símbolos raros y colapsa espacios."""
+    s = to_ascii(s)
+    s = s.lower()
+    s = _RE_JUNK.sub(" ", s)
+    s = _RE_SPACES.sub(" ", s).strip()
+    return s
+
+
+def _money(val: str) -> Optional[float]:
+    # normaliza separadores: 1.234,56 -> 1234.56 ; 1,234.56 -> 1234.56 ; 101 -> 101.00
+    v = val
+    if "," in v and "." in v:
+        # si hay ambos, el último separador es el decimal
+        if v.rfind(",") > v.rfind("."):
+            v = v.replace(".", "").replace(",", ".")
+        else:
+            v = v.replace(",", "")
+    elif "," in v:
+        # 1234,56 -> 1234.56  ó  1,234 -> 1234.00 si era miles sin decimales
+        if len(v.split(",")[-1]) == 2:
+            v = v.replace(",", ".")
+        else:
+            v = v.replace(",", "")
+    elif "." in v and len(v.split(".")[-1]) == 3:
+        v = v.replace(".", "")  # 3.500 -> 3500.00 (miles con punto, sin decimales)
+    try:
+        return float(v)
+    except ValueError:
+        return None
+
+
+def _year(y: str) -> str:
+    return "20" + y if len(y) == 2 else y
+
+
+def _scan_dates(text_norm: str):
+    """Devuelve (fecha, tramos de todas las fechas encontradas)."""
+    dates, spans = {}, []
+    for m in _RE_DATES.finditer(text_norm):
+        spans.append(m.span())
+        kind = m.lastgroup
+        if kind == "ny" and "num" not in dates:
+            d, mo, y = m.group("nd", "nm", "ny")
+            dates["num"] = f"{int(d):02d}/{int(mo):02d}/{_year(y)}"
+        elif kind == "ty" and "dm" not in dates:
+            d, mon, y = m.group("td", "tm", "ty")
+            dates["dm"] = f"{int(d):02d}/{MONTHS[mon[:3]]}/{_year(y)}"
+        elif kind == "my" and "md" not in dates:
+            mon, fix, d, y = m.group("mm", "fix", "md", "my")
+            if fix and len(d) == 1:
+                d = "1" + d  # “novi2” -> nov 12
+            dates["md"] = f"{int(d):02d}/{MONTHS[mon[:3]]}/{_year(y)}"
+    return next((dates[k] for k in _DATE_KINDS if k in dates), None), spans
+
+
+def _scan_total(text_norm: str, date_spans=()) -> Optional[str]:
+    """Total: el mayor monto tras una palabra clave o, si no hay, el mayor número fuera de las fechas."""
+    keyword_totals: List[float] = []
+    other_amounts: List[float] = []
+    for m in _RE_MONEY.finditer(text_norm):
+        if m.lastgroup == "kwv":
+            v = _money(m.group("kwv"))
+            if v is not None:
+                keyword_totals.append(v)
+        elif not keyword_totals:  # con un total por palabra clave ya no hace falta
+            start = m.start()
+            if any(a <= start < b for a, b in date_spans):
+                continue
+            v = _money(m.group("num"))
+            if v is not None:
+                other_amounts.append(v)
+    amounts = keyword_totals or other_amounts
+    return f"{max(amounts):.2f}" if amounts else None
+
+
+def _scan(text_norm: str):
+    """Las dos pasadas sobre el texto normalizado: devuelve (total, fecha)."""
+    date, spans = _scan_dates(text_norm)
+    return _scan_total(text_norm, spans), date
+
+
+def _canonical_brand(line_norm: str):
+    # Mapea marcas a un nombre fijo si aparecen en la línea normalizada (ver brands.py)
+    return get_matcher().match(line_norm)
+
+
+def _pretty_line(s: str) -> str:
+    # Quita símbolos raros y espacios duplicados; aplica Title Case suave
+    s = _RE_PRETTY_JUNK.sub(" ", s)
+    s = _RE_SPACES.sub(" ", s).strip()
+    return s.title()
+
+
+def _pick_store(lines: List[str], lines_norm: List[str]) -> Optional[str]:
+    head = list(zip(lines[:STORE_LINES], lines_norm[:STORE_LINES]))
+    for _, ln_norm in head:
+        brand = _canonical_brand(ln_norm)
+        if brand:
+            return brand  # ← nombre limpio
+    for ln, ln_norm in head:
+        if not any(w in ln_norm for w in STORE_BLACKLIST) and _RE_LETTERS.search(ln):
+            return _pretty_line(ln)[:60]
+    return None
+
+
+def _split_lines(text: str) -> Tuple[List[str], List[str]]:
+    """Líneas no vacías del texto crudo y su versión normalizada (se normaliza una sola vez)."""
+    lines, lines_norm = [], []
+    for ln in text.splitlines():
+        ln = ln.strip()
+        if ln:
+            lines.append(ln)
+            lines_norm.append(_normalize(ln))
+    return lines, lines_norm
+
+
+def _find_total(text_norm: str):
+    return _scan(text_norm)[0]
+
+
+def _find_date(text_norm: str):
+    return _scan_dates(text_norm)[0]
+
+
+def _find_store(text_raw: str):
+    return _pick_store(*_split_lines(text_raw))
+
+
+def field_lines(lines_norm: List[str]) -> Dict[str, List[int]]:
+    """Índices de las líneas (ya normalizadas) donde probablemente está cada campo."""
+    return {
+        "store": list(range(min(STORE_LINES, len(lines_norm)))),
+        "date": [i for i, ln in enumerate(lines_norm) if _RE_DATE_HINT.search(ln)],
+        "total": [i for i, ln in enumerate(lines_norm) if _RE_TOTAL_HINT.search(ln)],
+    }
+
+
+def extract_fields(text: str):
+    """Devuelve (store, date, total) del texto de un ticket."""
+    lines, lines_norm = _split_lines(text)
+    # Unir las líneas normalizadas equivale a normalizar el texto completo
+    total, date = _scan(" ".join(ln for ln in lines_norm if ln))
+    store = _pick_store(lines, lines_norm)
+    return store, date, total
+
+
+def variant_used_pre(variant: str) -> bool:
+    """Si la lectura pasó por el umbral ("pre" y "regions"); también para lo que sale de la caché."""
+    return variant != "raw"
+
+
+@dataclass
+class ExtractionResult:
+    """Campos de un ticket más cómo se obtuvieron (pasada, tiempos, caché).
+
+    Vive aquí y no en ocr.py porque viaja de los workers de OCR al bot: el bot
+    lo recibe sin importar cv2, numpy ni Tesseract.
+    """
+
+    store: Optional[str]
+    date: Optional[str]
+    total: Optional[str]
+    text: str
+    variant: str  # "pre", "raw" o "regions" (pre + relectura de regiones)
+    timings: Dict[str, float] = field(default_factory=dict)  # segundos por etapa de preprocesado y por pasada
+    image_hash: Optional[str] = None  # hash de los píxeles decodificados (clave de caché)
+    cached: bool = False  # True si vino de la caché y no se corrió OCR
+    confidence: Optional[float] = None  # confianza media de las palabras (solo estrategia layout)
+
+    @property
+    def used_pre(self) -> bool:
+        return variant_used_pre(self.variant)
+
+    @property
+    def score(self) -> int:
+        return _score((self.store, self.date, self.total))
+
+    def as_tuple(self):
+        return (self.store, self.date, self.total, self.text, self.used_pre)
+
+
+def _score(fields) -> int:
+    return sum(x is not None for x in fields)
+
+
+def extract_fields_batch(texts: Iterable[str], processes: int = None, chunksize: int = 64) -> Iterator[tuple]:
+    """Extrae campos de muchos textos (p. ej. para reprocesar el historial).
+
+    Devuelve un iterador en el mismo orden que `texts`. Con `processes` > 1
+    reparte el trabajo en un pool de procesos.
+    """
+    if not processes or processes <= 1:
+        for text in texts:
+            yield extract_fields(text or "")
+        return
+    with Pool(processes) as pool:
+        yield from pool.imap(extract_fields, (t or "" for t in texts), chunksize)
@@ -0,0 +1,324 @@
+"""Servidor falso de la Bot API de Telegram para probar el bot en local.
+
+Implementa lo que usa bot_main (getMe, setWebhook/deleteWebhook, getUpdates,
+sendMessage, editMessageText, sendDocument, answerCallbackQuery, getFile y la
+descarga de archivos) y permite inyectar fotos, textos y botones como si vinieran de
+usuarios. Si el bot registró un webhook las actualizaciones se le envían por
+POST; si no, se entregan por getUpdates.
+
+Para apuntar el bot aquí:
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook \\
+    WEBHOOK_URL=http://127.0.0.1:8443/telegram WEBHOOK_LISTEN=127.0.0.1 python bot_main.py
+
+y en otra terminal, para mandar fotos de 20 usuarios y medir la latencia hasta
+la respuesta del bot:
+
+    python fake_telegram.py --port 8081 --users 20 ticket.jpg
+"""
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+logger = logging.getLogger("bot-ocr-tickets.fake-telegram")
+
+BOT_ID = 1000
+
+
+class FakeTelegram:
+    """Estado del servidor falso: actualizaciones pendientes, archivos y lo que envió el bot."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081):
+        self.host, self.port = host, port
+        self.webhook_url: Optional[str] = None
+        self.secret_token: Optional[str] = None
+        self.files: Dict[str, bytes] = {}
+        self.sent: List[dict] = []  # (método, parámetros, hora) de cada llamada del bot
+        self._updates: List[dict] = []
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._server = None
+
+    # ----- servidor -----
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._handle(self)
+
+            def do_POST(self):
+                fake._handle(self)
+
+            def log_message(self, fmt, *args):
+                logger.debug(fmt, *args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="fake-telegram", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def _handle(self, req: BaseHTTPRequestHandler):
+        parts = req.path.split("?")[0].strip("/").split("/")
+        if len(parts) >= 3 and parts[0] == "file":
+            data = self.files.get("/".join(parts[2:]))
+            if data is None:
+                req.send_error(404)
+                return
+            req.send_response(200)
+            req.send_header("Content-Length", str(len(data)))
+            req.end_headers()
+            req.wfile.write(data)
+            return
+        if len(parts) != 2 or not parts[0].startswith("bot"):
+            req.send_error(404)
+            return
+        length = int(req.headers.get("Content-Length") or 0)
+        params = _parse_params(req.headers.get("Content-Type", ""), req.rfile.read(length))
+        try:
+            result = self.call(parts[1], params)
+            body = {"ok": True, "result": result}
+        except KeyError:
+            body = {"ok": False, "error_code": 404, "description": f"Not Found: method {parts[1]}"}
+        payload = json.dumps(body).encode()
+        req.send_response(200)
+        req.send_header("Content-Type", "application/json")
+        req.send_header("Content-Length", str(len(payload)))
+        req.end_headers()
+        req.wfile.write(payload)
+
+    # ----- Bot API -----
+
+    def call(self, method: str, params: dict):
+        with self._cond:
+            self.sent.append({"method": method, "params": params, "at": time.monotonic()})
+            self._cond.notify_all()
+        if method == "getMe":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "Tickets", "username": "tickets_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if method == "setWebhook":
+            self.webhook_url, self.secret_token = params.get("url") or None, params.get("secret_token")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False,
+                    "pending_update_count": len(self._updates)}
+        if method == "getUpdates":
+            return self._get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id") or 0)
+            return self._message(chat_id, params.get("text", ""), message_id=params.get("message_id"))
+        if method == "sendDocument":
+            # El archivo subido queda en params["document"] (bytes) para revisarlo en las pruebas
+            doc = params.get("document")
+            doc = self._file(doc, file_name=params.get("document_name", "file")) if isinstance(doc, bytes) else {}
+            return self._message(int(params.get("chat_id") or 0), document=doc, caption=params.get("caption", ""))
+        if method == "getFile":
+            file_id = params["file_id"]
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files.get(file_id, b"")),
+                    "file_path": file_id}
+        if method in ("answerCallbackQuery", "sendChatAction", "setMyCommands", "close", "logOut"):
+            return True
+        raise KeyError(method)
+
+    def _get_updates(self, offset: int, timeout: float):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._updates = [u for u in self._updates if u["update_id"] >= offset]
+                if self._updates or time.monotonic() >= deadline:
+                    return list(self._updates)
+                self._cond.wait(deadline - time.monotonic())
+
+    # ----- usuarios simulados -----
+
+    def _message(self, chat_id: int, text: str = None, message_id=None, **extra) -> dict:
+        msg = {
+            "message_id": int(message_id) if message_id else next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"},
+            **extra,
+        }
+        if text is not None:
+            msg["text"] = text
+        return msg
+
+    def push(self, update: dict) -> dict:
+        """Entrega una actualización: POST al webhook si hay uno, si no a la cola de getUpdates."""
+        update["update_id"] = next(self._ids)
+        if self.webhook_url:
+            req = urllib.request.Request(
+                self.webhook_url, data=json.dumps(update).encode(), method="POST",
+                headers={"Content-Type": "application/json",
+                         **({"X-Telegram-Bot-Api-Secret-Token": self.secret_token} if self.secret_token else {})},
+            )
+            urllib.request.urlopen(req, timeout=10).read()
+        else:
+            with self._cond:
+                self._updates.append(update)
+                self._cond.notify_all()
+        return update
+
+    def send_text(self, user_id: int, text: str) -> dict:
+        entities = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else None
+        msg = self._message(user_id, text, **({"entities": entities} if entities else {}))
+        return self.push({"message": msg})
+
+    def _file(self, data: bytes, **fields) -> dict:
+        file_id = f"file{next(self._ids)}"
+        self.files[file_id] = data
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(data), **fields}
+
+    def send_photo(self, user_id: int, data: bytes, width: int = 1280, height: int = 1280,
+                   media_group_id: str = None, smaller=()) -> dict:
+        """Con `media_group_id` la foto es parte de un álbum (Telegram manda una actualización por foto).
+
+        `smaller` son otras versiones (bytes, ancho, alto) de la misma foto, de menor a mayor,
+        como las que Telegram genera al recibirla.
+        """
+        sizes = [self._file(d, width=w, height=h) for d, w, h in smaller]
+        sizes.append(self._file(data, width=width, height=height))
+        extra = {"media_group_id": media_group_id} if media_group_id else {}
+        return self.push({"message": self._message(user_id, photo=sizes, **extra)})
+
+    def send_document(self, user_id: int, data: bytes, file_name: str = "ticket.jpg",
+                      mime_type: str = "image/jpeg") -> dict:
+        doc = self._file(data, file_name=file_name, mime_type=mime_type)
+        return self.push({"message": self._message(user_id, document=doc)})
+
+    def press(self, user_id: int, data: str, message_id: int = None) -> dict:
+        query = {"id": str(next(self._ids)), "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                 "chat_instance": str(user_id), "data": data,
+                 "message": self._message(user_id, "", message_id=message_id)}
+        return self.push({"callback_query": query})
+
+    def wait_for(self, pred, timeout: float = 30.0) -> Optional[dict]:
+        """Espera (o encuentra ya registrada) la primera llamada del bot que cumpla `pred`."""
+        deadline = time.monotonic() + timeout
+        seen = 0
+        with self._cond:
+            while True:
+                for call in self.sent[seen:]:
+                    if pred(call):
+                        return call
+                seen = len(self.sent)
+                if time.monotonic() >= deadline:
+                    return None
+                self._cond.wait(deadline - time.monotonic())
+
+
+def _parse_params(content_type: str, body: bytes) -> dict:
+    # PTB manda los parámetros como formulario con valores JSON (o como JSON directo)
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("multipart/"):
+        return _parse_multipart(content_type, body)
+    params = {}
+    for key, value in urllib.parse.parse_qsl(body.decode()):
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+def _parse_multipart(content_type: str, body: bytes) -> dict:
+    # Subidas de archivos (sendDocument): los campos van como texto y el archivo como bytes
+    msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    params = {}
+    for part in msg.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        data = part.get_payload(decode=True)
+        if part.get_filename():
+            params[name], params[f"{name}_name"] = data, part.get_filename()
+            continue
+        value = data.decode()
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot API falsa: inyecta fotos y mide la latencia del bot.")
+    parser.add_argument("photos", nargs="*", help="imágenes a enviar (se reparten entre los usuarios)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=1, help="usuarios simultáneos")
+    parser.add_argument("--wait", type=float, default=60.0, help="segundos a esperar a que el bot se conecte")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+
+    fake = FakeTelegram(args.host, args.port).start()
+    print(f"🤖 Bot API falsa en {fake.base_url} (usa TELEGRAM_API_URL={fake.base_url})")
+    if not args.photos:
+        print("Sin fotos que enviar; solo sirvo la API. Ctrl+C para salir.")
+        threading.Event().wait()
+    if fake.wait_for(lambda c: c["method"] in ("setWebhook", "getUpdates"), args.wait) is None:
+        raise SystemExit("El bot no se conectó.")
+    time.sleep(0.5)  # deja que termine de registrar el webhook
+
+    blobs = []
+    for p in args.photos:
+        with open(p, "rb") as fh:
+            blobs.append(fh.read())
+    pending = {}
+    t0 = time.monotonic()
+    for i in range(args.users):
+        user = 100 + i
+        pending[user] = time.monotonic()
+        threading.Thread(target=fake.send_photo, args=(user, blobs[i % len(blobs)]), daemon=True).start()
+
+    latencies = []
+    deadline = time.monotonic() + args.wait
+    while pending and time.monotonic() < deadline:
+        call = fake.wait_for(
+            lambda c: c["method"] == "sendMessage" and "Vista previa" in c["params"].get("text", "")
+            and int(c["params"].get("chat_id", 0)) in pending,
+            deadline - time.monotonic(),
+        )
+        if call is None:
+            break
+        user = int(call["params"]["chat_id"])
+        latencies.append(call["at"] - pending.pop(user))
+    wall = time.monotonic() - t0
+    if latencies:
+        print(f"✅ {len(latencies)}/{args.users} vistas previas en {wall:.1f}s "
+              f"({len(latencies) / wall:.2f}/s) | p50 {statistics.median(latencies) * 1000:.0f}ms "
+              f"| máx {max(latencies) * 1000:.0f}ms")
+    if pending:
+        print(f"⚠️ {len(pending)} usuarios sin respuesta")
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
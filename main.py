@@ -1,10 +1,12 @@
-import os, glob
+import argparse, os, glob, sys, time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from PIL import Image
-from ocr import preprocess_for_ocr, ocr_image, extract_fields  # o desde ocr_utils si lo renombraste
+from ocr import preprocess_for_ocr, extract_fields_report, share_cores  # o desde ocr_utils si lo renombraste
 import pillow_heif
-from ocr import _normalize
-from ocr import extract_fields_safely
-from db_utils import save_ticket
+from ocr_pool import mp_context
+from ocr_worker import decode, run_ocr_job
+from db_init import init_db
+from db_utils import save_ticket, record_ingest, ingested_files, cache_touch, close_writer
 
 
 pillow_heif.register_heif_opener()
@@ -12,6 +14,9 @@ pillow_heif.register_heif_opener()
 # 1) Cambia esto si quieres forzar un archivo concreto:
 IMAGE_NAME = None  # ej. "IMG_0964.jpg"  (None = buscar automáticamente)
 
+# Extensiones que acepta la importación masiva (HEIC/HEIF vía pillow_heif)
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".heic", ".heif")
+
 def pick_image():
     """Si no especificas IMAGE_NAME, busca el primer .jpg/.jpeg/.png en la carpeta."""
     if IMAGE_NAME:
@@ -21,8 +26,7 @@ def pick_image():
         candidates += glob.glob(ext)
     return candidates[0] if candidates else None
 
-def main():
-    print("hola mundo en el main")
+def single_image():
     print("📂 Carpeta actual:", os.getcwd())
     print("📄 Archivos:", os.listdir("."))
 
@@ -30,48 +34,153 @@ def main():
     if not img_path:
         print("❌ No encontré ninguna imagen (.jpg/.jpeg/.png) en esta carpeta.")
         print("👉 Pon tu foto junto a main.py o asigna IMAGE_NAME = 'tu_archivo.jpg'")
+        print("👉 Para importar una carpeta completa: python main.py RUTA")
         return
     print("🖼️ Usando imagen:", img_path)
 
-    # 2) Abrir imagen
+    # 2) Abrir imagen (una sola decodificación a gris; la usan la extracción y la vista previa)
     try:
-        img = Image.open(img_path).convert("RGB")
+        with open(img_path, "rb") as f:
+            img = decode(f.read())
     except Exception as e:
         print("❌ No pude abrir la imagen:", e)
         print("Si es .HEIC conviértela a .JPG/.PNG o instala 'pillow-heif'.")
         return
 
-    # Extraer campos de manera segura
-    store, date, total, text, preprocessed = extract_fields_safely(img)
+    # 3) Una sola extracción (OCR + campos); el texto que se imprime y guarda es el de esa pasada
+    result = extract_fields_report(img)
     print("\n— Resultados de la extracción —")
-    print(f"🏬 Tienda: {store or '—'}")
-    print(f"📅 Fecha:  {date or '—'}")
-    print(f"💵 Total:  {total or '—'}")
+    print(f"🏬 Tienda: {result.store or '—'}")
+    print(f"📅 Fecha:  {result.date or '—'}")
+    print(f"💵 Total:  {result.total or '—'}")
+    print(f"🔎 Pasada: {result.variant} | " + " ".join(f"{k}={v * 1000:.0f}ms" for k, v in result.timings.items()))
 
-    # 3) Preprocesar y guardar vista previa
-    img_bw = preprocess_for_ocr(img)
+    # 4) Vista previa del binarizado (solo preprocesa, no vuelve a correr OCR)
     try:
-        img_bw.save("preprocesada.png")
+        Image.fromarray(preprocess_for_ocr(img)).save("preprocesada.png")
         print("💾 Guardé 'preprocesada.png' para que veas cómo quedó el binarizado.")
     except Exception as e:
         print("⚠️ No pude guardar preprocesada.png:", e)
 
-    # 4) OCR
-    text = ocr_image(img_bw)
     print("\n✅ OCR (primeros 600 caracteres):\n")
-    print(text[:600])
+    print(result.text[:600])
+
+    # 5) Guardar en BD
+    save_ticket(result.store, result.date, result.total, "MXN", result.text)
+
+# ===== Importación masiva =====
+
+def iter_images(root):
+    """Recorre `root` en orden estable y va entregando (ruta absoluta, tamaño, mtime_ns)."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTS):
+                path = os.path.abspath(os.path.join(dirpath, name))
+                st = os.stat(path)
+                yield path, st.st_size, st.st_mtime_ns
+
+def _init_ingest_worker(processes):
+    pillow_heif.register_heif_opener()
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")  # los procesos ya reparten los núcleos
+    share_cores(processes)
+
+def _ingest_one(path, strategy):
+    """Corre en un worker: lee el archivo y hace exactamente una extracción (o usa la caché)."""
+    with open(path, "rb") as f:
+        data = f.read()
+    return run_ocr_job(data, strategy)
+
+def ingest(root, workers=None, batch=100, strategy="layout", user_id=None, resume=True):
+    """OCR de todas las imágenes bajo `root` en un pool de procesos.
+
+    Los resultados se guardan en lotes de `batch` (tickets + manifiesto en la misma
+    transacción); con `resume` se saltan los archivos ya importados que no han cambiado.
+    """
+    init_db()
+    done = ingested_files() if resume else {}
+    workers = workers or os.cpu_count() or 1
+    window = workers * 4  # trabajos en vuelo: el árbol se recorre sin cargarlo entero en memoria
+
+    pending, saves = [], []
+    n_ok = n_err = n_skip = 0
+    t0 = time.perf_counter()
 
-    # 5) Extraer campos
+    def flush():
+        if pending:
+            saves.append(record_ingest(list(pending)))
+            pending.clear()
+
+    def collect(futures):
+        nonlocal n_ok, n_err
+        for fut in futures:
+            path, size, mtime_ns = in_flight.pop(fut)
+            try:
+                r = fut.result()
+            except Exception as e:
+                n_err += 1
+                print(f"⚠️ {path}: {e}", file=sys.stderr)
+                pending.append((path, size, mtime_ns, None, f"{type(e).__name__}: {e}"))
+            else:
+                n_ok += 1
+                if r.cached:
+                    cache_touch(r.image_hash)  # el worker solo lee; el LRU se actualiza con el escritor
+                ticket = dict(store=r.store, date=r.date, total=r.total, currency="MXN",
+                              raw_text=r.text, user_id=user_id)
+                pending.append((path, size, mtime_ns, ticket, None))
+            if len(pending) >= batch:
+                flush()
+            n = n_ok + n_err
+            if n % 50 == 0:
+                rate = n / (time.perf_counter() - t0)
+                print(f"⏱️ {n} imágenes | {rate:.2f} img/s | {n_err} con error | {n_skip} ya importadas")
+
+    in_flight = {}
     try:
-        store, date, total = extract_fields(text)
-        print("\n— Campos detectados —")
-        print(f"🏬 Tienda: {store or '—'}")
-        print(f"📅 Fecha:  {date or '—'}")
-        print(f"💵 Total:  {total or '—'}")
-        # 6) Guardar en BD
-        save_ticket(store, date, total, "MXN", text)
-    except Exception as e:
-        print("\nℹ️ No se pudieron extraer campos básicos:", e)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context(),
+                                 initializer=_init_ingest_worker, initargs=(workers,)) as pool:
+            for path, size, mtime_ns in iter_images(root):
+                if done.get(path) == (size, mtime_ns):
+                    n_skip += 1
+                    continue
+                if len(in_flight) >= window:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                in_flight[pool.submit(_ingest_one, path, strategy)] = (path, size, mtime_ns)
+            collect(wait(in_flight)[0])
+    finally:
+        # También al interrumpir: lo que ya se leyó se guarda antes de salir
+        flush()
+        for fut in saves:
+            fut.result()  # propaga errores de escritura
+        close_writer()
+
+    elapsed = time.perf_counter() - t0
+    n = n_ok + n_err
+    print(f"\n✅ {n_ok} tickets guardados, {n_err} con error, {n_skip} ya importadas.")
+    print(f"⏱️ {n} imágenes en {elapsed:.1f}s ({n / elapsed if elapsed else 0:.2f} img/s, {workers} workers)")
+    return n_ok, n_err, n_skip
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR de tickets: una imagen o una carpeta completa.")
+    parser.add_argument("path", nargs="?", help="carpeta a importar (sin ella: primera imagen de la carpeta actual)")
+    parser.add_argument("--workers", type=int, default=None, help="procesos de OCR (por defecto uno por núcleo)")
+    parser.add_argument("--batch", type=int, default=100, help="tickets por transacción")
+    parser.add_argument("--strategy", default=os.getenv("OCR_STRATEGY", "layout"), help="estrategia de OCR (ver ocr.STRATEGIES)")
+    parser.add_argument("--user-id", type=int, default=None, help="usuario de Telegram al que se asignan los tickets")
+    parser.add_argument("--no-resume", action="store_true", help="reprocesar también lo ya importado")
+    args = parser.parse_args()
+
+    if not args.path:
+        single_image()
+        return
+    if not os.path.isdir(args.path):
+        parser.error(f"no es una carpeta: {args.path}")
+    try:
+        ingest(args.path, args.workers, args.batch, args.strategy, args.user_id, resume=not args.no_resume)
+    except KeyboardInterrupt:
+        # Lo ya confirmado queda en el manifiesto; la siguiente corrida sigue desde ahí
+        print("\n⏸️ Interrumpido. Vuelve a correr el mismo comando para continuar.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,214 @@
+"""Métricas del bot en formato de texto de Prometheus.
+
+Sin dependencias: contadores, gauges e histogramas con etiquetas, y un
+servidor HTTP pequeño (en un hilo) que los expone en /metrics.
+
+- METRICS_PORT: puerto del endpoint (0 o vacío = apagado).
+- METRICS_ADDR: interfaz donde escucha (por defecto 127.0.0.1, solo local).
+- OCR_TRACE=1: además escribe una línea de log por ticket con todas sus etapas.
+
+El OCR corre en otros procesos, así que los workers no tocan este registro:
+devuelven sus tiempos en ExtractionResult.timings y el bot los observa aquí.
+"""
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Tuple
+
+logger = logging.getLogger("bot-ocr-tickets.metrics")
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+METRICS_ADDR = os.getenv("METRICS_ADDR", "127.0.0.1")
+TRACE = os.getenv("OCR_TRACE", "0") not in ("", "0", "false", "no")
+
+# Segundos; cubre desde una consulta a SQLite hasta un OCR de ticket largo
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(v: float) -> str:
+    return "+Inf" if v == float("inf") else repr(float(v))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self):
+        for key, v in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_fmt(v)}"
+
+
+class Gauge:
+    """Valor instantáneo; con `fn` se calcula al momento de leer (p. ej. la fila del pool)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float] = None):
+        self.name, self.help, self.fn = name, help, fn
+        self._value = 0.0
+
+    def set(self, value: float):
+        self._value = value
+
+    def samples(self):
+        value = self._value
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                logger.exception("No pude calcular %s", self.name)
+                return
+        yield f"{self.name} {_fmt(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [cuentas por bucket..., suma, total]
+
+    def observe(self, value: float, *labels):
+        with _lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, le in enumerate(self.buckets):
+                if value <= le:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def samples(self):
+        for key, s in sorted(self._series.items()):
+            for i, le in enumerate(self.buckets):
+                le_label = 'le="%s"' % _fmt(le)
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le_label)} {s[i]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(s[-2])}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {s[-1]}"
+
+
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    out = []
+    with _lock:
+        for m in _registry:
+            out.append(f"# HELP {m.name} {m.help}")
+            out.append(f"# TYPE {m.name} {m.kind}")
+            out.extend(m.samples())
+    return "\n".join(out) + "\n"
+
+
+# ===== Métricas del bot =====
+
+STAGE_SECONDS = register(Histogram(
+    "ticket_stage_seconds",
+    "Duración de cada etapa de un ticket (download, decode, receipt, deskew, scale, pre, raw, regions, ocr_queue, save...)",
+    labels=("stage",),
+))
+OCR_VARIANT = register(Counter("ocr_variant_total", "Pasada de OCR que dio el resultado final", labels=("variant",)))
+CACHE_LOOKUPS = register(Counter(
+    "ocr_cache_lookups_total", "Búsquedas en la caché de OCR por nivel (file_id, pixels) y resultado",
+    labels=("level", "result"),
+))
+QUEUE_REJECTED = register(Counter("ocr_queue_rejected_total", "Fotos rechazadas porque la fila de OCR estaba llena"))
+RATE_LIMITED = register(Counter("ocr_rate_limited_total", "Fotos rechazadas por el límite de tickets por minuto del usuario"))
+OCR_CANCELLED = register(Counter("ocr_jobs_cancelled_total", "Trabajos de OCR cancelados por el usuario con /cancel"))
+TICKETS_SAVED = register(Counter("tickets_saved_total", "Tickets confirmados y guardados"))
+PHOTO_ESCALATIONS = register(Counter(
+    "photo_escalations_total", "Fotos que se volvieron a leer en el tamaño más grande, por resultado",
+    labels=("result",),
+))
+
+
+def _hit_ratio() -> float:
+    hits = sum(CACHE_LOOKUPS.get(level, "hit") for level in ("file_id", "pixels"))
+    # Cada foto cuenta una vez: o acierta por file_id, o se va al worker y acierta/falla por píxeles
+    photos = CACHE_LOOKUPS.get("file_id", "hit") + sum(CACHE_LOOKUPS.get("pixels", r) for r in ("hit", "miss"))
+    return hits / photos if photos else 0.0
+
+
+register(Gauge("ocr_cache_hit_ratio", "Fracción de fotos resueltas desde la caché de OCR", fn=_hit_ratio))
+
+
+def gauge(name: str, help: str, fn: Callable[[], float]) -> Gauge:
+    """Registra un gauge calculado al leer (lo usa el bot para la fila del pool)."""
+    return register(Gauge(name, help, fn=fn))
+
+
+def observe_stages(timings: Dict[str, float]):
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, stage)
+
+
+# ===== Servidor HTTP =====
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass  # Prometheus consulta cada pocos segundos; no llenamos el log
+
+
+_server = None
+
+
+def start_server(port: int = METRICS_PORT, addr: str = METRICS_ADDR):
+    """Arranca /metrics en un hilo aparte; no hace nada si `port` es 0."""
+    global _server
+    if not port or _server is not None:
+        return _server
+    _server = ThreadingHTTPServer((addr, port), _Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Métricas en http://%s:%d/metrics", addr, _server.server_address[1])
+    return _server
+
+
+def stop_server():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
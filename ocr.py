@@ -1,222 +1,317 @@
-import cv2
 import numpy as np
-from PIL import Image
-import pytesseract
-import re
-from unidecode import unidecode
-
-def preprocess_for_ocr(pil_img: Image.Image) -> Image.Image:
-    """Preprocesa imagen para mejorar OCR (gris + umbral adaptativo)."""
-    # PIL -> OpenCV
-    img = cv2.cvtColor(np.array(pil_img), cv2.COLOR_RGB2BGR)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    bw = cv2.adaptiveThreshold(
-        gray, 255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY, 31, 15
-    )
-    # OpenCV -> PIL
-    return Image.fromarray(bw)
-
-def ocr_image(pil_img: Image.Image) -> str:
-    """Ejecuta OCR con Tesseract (siempre en RGB/ndarray)."""
-    # Asegura tipo y modo
-    if not isinstance(pil_img, Image.Image):
-        pil_img = Image.fromarray(pil_img)
-    if pil_img.mode not in ("RGB", "L"):
-        pil_img = pil_img.convert("RGB")
-
-    arr = np.array(pil_img)  # pytesseract acepta ndarray
-    return pytesseract.image_to_string(
-        arr,
-        lang="spa+eng",
-        config="--oem 3 --psm 6"
-    )
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from ocr_engine import get_engine
+from preprocess import PreprocessConfig, as_gray, binarize, prepare_geometry
+# La extracción de campos vive en extractor.py; se re-exporta aquí por compatibilidad
+from extractor import ExtractionResult, extract_fields, extract_fields_batch, field_lines, _normalize, _score
+
+FIELDS = ("store", "date", "total")
+
+# Etapas de preprocesado (ver preprocess.py); se configuran con OCR_PREPROCESS / OCR_TARGET_CHAR_HEIGHT
+PREPROCESS = PreprocessConfig.from_env()
+
+# Las imágenes viajan por todo el pipeline como ndarray uint8 2-D en gris (ver preprocess.as_gray):
+# se decodifica una vez y ambas pasadas leen el mismo arreglo; los recortes son vistas.
+
+def preprocess_for_ocr(img, config: PreprocessConfig = None) -> np.ndarray:
+    """Preprocesa imagen para mejorar OCR (recorte, enderezado, escala, gris + umbral adaptativo)."""
+    config = config or PREPROCESS
+    arr, _ = prepare_geometry(img, config)
+    return binarize(arr, config)
+
+# Tickets largos: si alto/ancho >= OCR_TILE_ASPECT se leen en franjas horizontales en paralelo
+TILE_ASPECT = float(os.getenv("OCR_TILE_ASPECT", "3"))
+TILE_OVERLAP_LINES = 3  # líneas de texto que se repiten entre franjas vecinas
+# Hilos (y franjas como máximo) por ticket largo. Por defecto todos los núcleos; en un pool de
+# procesos cada worker toma solo su parte (share_cores), si no serían núcleos² hilos de Tesseract
+TILE_THREADS = int(os.getenv("OCR_TILE_THREADS", "0")) or os.cpu_count() or 1
+_tile_pool = None
+
+
+def share_cores(processes: int):
+    """Ajusta TILE_THREADS a la parte de los núcleos de este proceso (lo llama cada worker del pool)."""
+    global TILE_THREADS, _tile_pool
+    if not os.getenv("OCR_TILE_THREADS"):
+        TILE_THREADS = max(1, (os.cpu_count() or 1) // max(1, processes))
+    _tile_pool = None  # se vuelve a crear con el tamaño nuevo
+
+
+def _get_tile_pool() -> ThreadPoolExecutor:
+    # Tesseract suelta el GIL, así que las franjas sí corren en paralelo dentro del worker
+    global _tile_pool
+    if _tile_pool is None:
+        _tile_pool = ThreadPoolExecutor(max_workers=TILE_THREADS, thread_name_prefix="ocr-tile")
+    return _tile_pool
+
+
+def _snap_to_gap(ink: np.ndarray, y: int, radius: int) -> int:
+    """Mueve un corte a la fila con menos tinta cercana, para no partir renglones."""
+    lo, hi = max(1, y - radius), min(len(ink) - 1, y + radius)
+    if lo >= hi:
+        return y
+    return lo + int(np.argmin(ink[lo:hi]))
+
+
+def _tile_bounds(gray: np.ndarray) -> List[Tuple[int, int, int]]:
+    """Franjas (arriba, fin_propio, abajo) para un ticket largo; [] si no conviene cortar.
+
+    Cada franja "posee" las filas [arriba, fin_propio) y se extiende unas líneas más
+    abajo para que ningún renglón quede partido entre dos franjas.
+    """
+    h, w = gray.shape
+    if TILE_ASPECT <= 0 or TILE_THREADS < 2 or h < w * TILE_ASPECT:
+        return []
+    n = max(2, min(TILE_THREADS, math.ceil(h / w)))  # franjas de ~1 ancho, hasta una por hilo
+    ink = 255.0 - gray.mean(axis=1)
+    line_h = PREPROCESS.target_char_height * 2
+    cuts = [0] + [_snap_to_gap(ink, h * i // n, line_h) for i in range(1, n)] + [h]
+    bounds = []
+    for i in range(n):
+        own_end = cuts[i + 1]
+        bottom = h if i == n - 1 else _snap_to_gap(ink, own_end + TILE_OVERLAP_LINES * line_h, line_h)
+        bounds.append((cuts[i], own_end, max(bottom, own_end)))
+    return bounds
+
+
+def _seam_overlap(prev: List[str], nxt: List[str], max_k: int) -> Tuple[int, int]:
+    """(k, drop): las primeras k líneas de `nxt` repiten el final de `prev` sin sus últimas `drop`."""
+    # Comparación exacta (normalizada): los renglones de un ticket se parecen mucho entre sí
+    # ("ARTICULO 10" / "ARTICULO 11"), así que una comparación difusa uniría líneas distintas.
+    # Los cortes caen en espacios en blanco, así que el mismo renglón se lee igual en ambas franjas.
+    prev = [_normalize(ln) for ln in prev[-(max_k + 1):]]
+    nxt = [_normalize(ln) for ln in nxt[:max_k]]
+    best = (0, 0)
+    for drop in (0, 1):  # la última línea de la franja anterior puede venir cortada
+        tail = prev[:len(prev) - drop]
+        for k in range(1, min(max_k, len(tail), len(nxt)) + 1):
+            if tail[-k:] == nxt[:k] and k > best[0]:
+                best = (k, drop)
+    return best
+
+
+def _stitch(texts: List[str]) -> str:
+    """Une los textos de las franjas quitando las líneas repetidas en las costuras."""
+    out: List[str] = []
+    for text in texts:
+        lines = [ln for ln in text.splitlines() if ln.strip()]
+        k, drop = _seam_overlap(out, lines, TILE_OVERLAP_LINES + 2) if out else (0, 0)
+        if drop:
+            del out[-drop:]  # el renglón cortado: la franja siguiente lo trae completo
+        out.extend(lines[k:])
+    return "\n".join(out)
+
+
+def ocr_image(img, psm: int = None, tiled: bool = None) -> str:
+    """Ejecuta OCR con el motor persistente del proceso (siempre en gris).
+
+    Con `tiled=None` los tickets largos se cortan en franjas automáticamente.
+    """
+    arr = as_gray(img)
+    engine = get_engine()
+    bounds = _tile_bounds(arr) if tiled is not False else []
+    if not bounds:
+        return engine.image_to_string(arr, psm=psm)
+    crops = [arr[top:bottom] for top, _, bottom in bounds]  # franjas de filas: vistas contiguas
+    texts = list(_get_tile_pool().map(lambda im: engine.image_to_string(im, psm=psm), crops))
+    return _stitch(texts)
+
+
+@dataclass
+class OcrLine:
+    text: str
+    conf: float  # confianza media de sus palabras (0-100)
+    box: Tuple[int, int, int, int]  # x0, y0, x1, y1
+
+
+def _group_lines(words, dy: int = 0) -> List[OcrLine]:
+    grouped: Dict[int, list] = {}
+    for w in words:
+        grouped.setdefault(w.line, []).append(w)
+    lines = []
+    for ws in grouped.values():
+        ws.sort(key=lambda w: w.left)
+        lines.append(OcrLine(
+            text=" ".join(w.text for w in ws),
+            conf=sum(w.conf for w in ws) / len(ws),
+            box=(
+                min(w.left for w in ws), min(w.top for w in ws) + dy,
+                max(w.left + w.width for w in ws), max(w.top + w.height for w in ws) + dy,
+            ),
+        ))
+    return lines
+
 
-def extract_fields_safely(pil_img: Image.Image):
-    """Intenta con y sin preprocesado y devuelve la mejor extracción."""
-    base = pil_img
-    if not isinstance(base, Image.Image):
-        base = Image.fromarray(base)
-    if base.mode not in ("RGB", "L"):
-        base = base.convert("RGB")
-    base = base.copy()  # evita issues de archivo cerrado
-
-    # 1) Con preprocesado
-    img_bw = preprocess_for_ocr(base)
-    text1 = ocr_image(img_bw)
-    s1, d1, t1 = extract_fields(text1)
-
-    # 2) Sin preprocesado
-    text2 = ocr_image(base)
-    s2, d2, t2 = extract_fields(text2)
-
-    score1 = sum(x is not None for x in (s1, d1, t1))
-    score2 = sum(x is not None for x in (s2, d2, t2))
-
-    if score2 > score1:
-        return (s2, d2, t2, text2, False)
+def ocr_lines(img, psm: int = None, tiled: bool = None) -> List[OcrLine]:
+    """OCR con cajas: agrupa las palabras de image_to_data en líneas, de arriba hacia abajo.
+
+    En tickets largos cada franja se queda solo con las líneas cuyo centro cae en
+    su zona propia, así las líneas repetidas en la costura se descartan por posición.
+    """
+    arr = as_gray(img)
+    engine = get_engine()
+    bounds = _tile_bounds(arr) if tiled is not False else []
+    if not bounds:
+        lines = _group_lines(engine.image_to_data(arr, psm=psm))
     else:
-        return (s1, d1, t1, text1, True)
-
-# --- Extractor básico (puedes mejorar luego) ---
-RE_TOTAL = re.compile(r'(TOTAL|IMPORTE|A PAGAR|PAGO)[:\s\$]*([0-9]+[.,][0-9]{2})', re.IGNORECASE)
-RE_DATE  = re.compile(r'(\d{2}[/-]\d{2}[/-]\d{2,4})')
-RE_STORE = re.compile(r'^[A-ZÑÁÉÍÓÚ0-9 \-\.&]{4,}$', re.MULTILINE)
-
-# Meses abreviados en español -> número
-MONTHS = {
-    "ene": "01", "feb": "02", "mar": "03", "abr": "04", "may": "05", "jun": "06",
-    "jul": "07", "ago": "08", "sep": "09", "oct": "10", "nov": "11", "dic": "12"
-}
-
-def _normalize(s: str) -> str:
-    """Quita acentos, pasa a minúsculas, elimina símbolos raros y colapsa espacios."""
-    s = unidecode(s)
-    s = s.lower()
-    s = re.sub(r"[^\w\s\.\,\:\-/\$]", " ", s)  # deja letras, digitos y separadores comunes
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-def _find_total(text_norm: str):
-    # Acepta 101 o 101.00 o 1,234.56; tolera basura entre palabra clave y número
-    money_pat = r"(\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})|\d{1,7})"
-    pat = re.compile(rf"(total|importe|pagar|pagada|pago)[^\d]{{0,20}}{money_pat}", re.IGNORECASE)
-    cands = []
-    for m in pat.finditer(text_norm):
-        val = m.group(2)
-        # normaliza separadores: 1.234,56 -> 1234.56 ; 1,234.56 -> 1234.56 ; 101 -> 101.00
-        v = val.replace(" ", "")
-        if "," in v and "." in v:
-            # si hay ambos, asume formato europeo 1.234,56
-            if v.rfind(",") > v.rfind("."):
-                v = v.replace(".", "").replace(",", ".")
-            else:
-                v = v.replace(",", "")  # 1,234.56
-        elif "," in v and "." not in v:
-            # 1234,56 -> 1234.56  ó  1,234 -> 1234.00 si era miles sin decimales
-            if len(v.split(",")[-1]) == 2:
-                v = v.replace(",", ".")
-            else:
-                v = v.replace(",", "")
-        # si no tiene decimales, añádelos
-        if re.fullmatch(r"\d+", v):
-            v = v + ".00"
-        try:
-            cands.append(float(v))
-        except:
-            pass
-    if cands:
-        return f"{max(cands):.2f}"
-
-    # Fallback: busca cualquier número con o sin decimales y toma el mayor
-    any_money = re.findall(money_pat, text_norm)
-    values = []
-    for val in any_money:
-        v = val.replace(" ", "")
-        if "," in v and "." in v:
-            if v.rfind(",") > v.rfind("."):
-                v = v.replace(".", "").replace(",", ".")
-            else:
-                v = v.replace(",", "")
-        elif "," in v and "." not in v:
-            if len(v.split(",")[-1]) == 2:
-                v = v.replace(",", ".")
-            else:
-                v = v.replace(",", "")
-        if re.fullmatch(r"\d+", v):
-            v = v + ".00"
-        try:
-            values.append(float(v))
-        except:
-            pass
-    if values:
-        return f"{max(values):.2f}"
-    return None
-
-
-def _find_date(text_norm: str):
-    # Formato numérico: dd/mm/aaaa o dd-mm-aa
-    m = re.search(r"\b([0-3]?\d)[/\-]([01]?\d)[/\-](\d{2,4})\b", text_norm)
-    if m:
-        d, mo, y = m.groups()
-        if len(y) == 2: y = "20" + y
-        return f"{int(d):02d}/{int(mo):02d}/{y}"
-
-    # Variantes con mes textual: “12 nov 2025”, “nov 12 '25”, incluso OCR raros tipo “novi2'25”
-    # Normaliza casos donde el OCR confunde 1 con i/l/|
-    text_norm2 = re.sub(r"(ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic)\s*([iIl\|])", r"\1 1", text_norm)
-
-    # (1) “12 nov 2025” o “12 nov 25”
-    m = re.search(r"\b([0-3]?\d)\s*(ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic)\w*\s*(\d{2,4})\b", text_norm2)
-    if m:
-        d, mon, y = m.groups()
-        mon = MONTHS[mon[:3]]
-        if len(y) == 2: y = "20" + y
-        return f"{int(d):02d}/{mon}/{y}"
-
-    # (2) “nov 12 '25” o “nov 12 2025”
-    m = re.search(r"\b(ene|feb|mar|abr|may|jun|jul|ago|sep|oct|nov|dic)\w*\s*([0-3]?\d)\s*[' ]?\s*(\d{2,4})\b", text_norm2)
-    if m:
-        mon, d, y = m.groups()
-        mon = MONTHS[mon[:3]]
-        if len(y) == 2: y = "20" + y
-        return f"{int(d):02d}/{mon}/{y}"
-
-    return None
-
-def _canonical_brand(line_norm: str):
-    # Mapea marcas a un nombre fijo si aparecen en la línea normalizada
-    BRAND_MAP = {
-        "starbucks": "Starbucks",
-        "oxxo": "OXXO",
-        "walmart": "Walmart",
-        "soriana": "Soriana",
-        "heb": "HEB",
-        "7-eleven": "7-Eleven",
-        "seven": "7-Eleven",
-        "chedraui": "Chedraui",
-        "farmacia": "Farmacia",
-        "the home depot": "The Home Depot",
-        "costco": "Costco",
-        "sam s": "Sam's Club",
-        "sams": "Sam's Club",
-    }
-    for k, v in BRAND_MAP.items():
-        if k in line_norm:
-            return v
-    return None
-
-def _pretty_line(s: str) -> str:
-    # Quita símbolos raros y espacios duplicados; aplica Title Case suave
-    s = re.sub(r"[^\w\s\.\-&]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    # Evita "Corfree INE" etc. por ahora, mejor devolvemos marca canónica si aplica
-    return s.title()
-
-def _find_store(text_raw: str):
-    lines = [ln.strip() for ln in text_raw.splitlines() if ln.strip()]
-    for ln in lines[:6]:
-        ln_norm = _normalize(ln)
-        brand = _canonical_brand(ln_norm)
-        if brand:
-            return brand  # ← nombre limpio
-    # Si no hay marca conocida, toma primera línea “prometedora” que no sea dirección
-    blacklist = ["calle", "av", "avenida", "col", "cp", "local", "manzana", "monterrey", "nuevo", "leon"]
-    for ln in lines[:6]:
-        ln_norm = _normalize(ln)
-        if not any(w in ln_norm for w in blacklist) and re.search(r"[a-zA-Z]{3,}", ln):
-            return _pretty_line(ln)[:60]
-    return None
-
-
-def extract_fields(text: str):
-    text_norm = _normalize(text)
-    total = _find_total(text_norm)
-    date = _find_date(text_norm)
-    store = _find_store(text)
-    return store, date, total
+        def read(bound):
+            top, own_end, bottom = bound
+            tile_lines = _group_lines(engine.image_to_data(arr[top:bottom], psm=psm), dy=top)
+            return [ln for ln in tile_lines if top <= (ln.box[1] + ln.box[3]) // 2 < own_end]
+
+        lines = [ln for tile in _get_tile_pool().map(read, bounds) for ln in tile]
+    lines.sort(key=lambda ln: ln.box[1])
+    return lines
+
+
+# Estrategias para combinar las dos pasadas (con y sin preprocesado):
+#   sequential     -> corre ambas una tras otra y se queda con la mejor (comportamiento original)
+#   parallel       -> corre ambas al mismo tiempo y se queda con la mejor
+#   first_complete -> corre ambas al mismo tiempo; la primera con 3/3 campos gana y la otra se descarta
+#   skip_fallback  -> corre la preprocesada y solo intenta la cruda si faltan campos
+#   layout         -> una pasada preprocesada con cajas; si falta un campo o tiene baja
+#                     confianza, solo se vuelve a leer el recorte de sus líneas (sin segunda página completa)
+STRATEGIES = ("layout", "sequential", "parallel", "first_complete", "skip_fallback")
+VARIANTS = ("pre", "raw")  # pre = binarizada, raw = imagen original
+
+# Confianza media (0-100) por debajo de la cual un campo se vuelve a leer por región
+LOW_CONF = float(os.getenv("OCR_LOW_CONF", "60"))
+
+
+def _prepare_base(img, config: PreprocessConfig):
+    """Aplica una sola vez las etapas de geometría; ambas pasadas parten de aquí (sin copiar)."""
+    return prepare_geometry(img, config)
+
+
+def _run_variant(variant: str, base: np.ndarray):
+    """Ejecuta una pasada de OCR + extracción y mide cuánto tardó."""
+    t0 = time.perf_counter()
+    img = binarize(base, PREPROCESS) if variant == "pre" else base
+    text = ocr_image(img)
+    fields = extract_fields(text)
+    return variant, fields, text, time.perf_counter() - t0
+
+
+def _best(results) -> ExtractionResult:
+    # En empate gana la preprocesada, igual que antes
+    timings = {v: dt for v, _, _, dt in results}
+    ordered = sorted(results, key=lambda r: (_score(r[1]), r[0] == "pre"), reverse=True)
+    variant, (s, d, t), text, _ = ordered[0]
+    return ExtractionResult(s, d, t, text, variant, timings)
+
+
+def extract_fields_report(img, strategy: str = "layout") -> ExtractionResult:
+    """Como extract_fields_safely, pero indica qué pasada ganó y cuánto tardó cada una.
+
+    `img` es de preferencia el ndarray gris de `ocr_worker.decode`; una imagen PIL se convierte una vez.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Estrategia desconocida: {strategy!r} (usa una de {STRATEGIES})")
+    base, prep_timings = _prepare_base(img, PREPROCESS)
+    result = _extract(base, strategy)
+    result.timings = {**prep_timings, **result.timings}
+    return result
+
+
+def _crop_lines(base: np.ndarray, lines: List[OcrLine], idxs: List[int]) -> np.ndarray:
+    """Franja a todo lo ancho que cubre las líneas indicadas, con media línea de margen (una vista)."""
+    y0 = min(lines[i].box[1] for i in idxs)
+    y1 = max(lines[i].box[3] for i in idxs)
+    margin = max(4, (y1 - y0) // (2 * len(idxs)))
+    return base[max(0, y0 - margin):min(base.shape[0], y1 + margin)]
+
+
+def _run_layout(base: np.ndarray) -> ExtractionResult:
+    """Pasada preprocesada con cajas + relectura solo de las regiones dudosas."""
+    t0 = time.perf_counter()
+    lines = ocr_lines(binarize(base, PREPROCESS))
+    text = "\n".join(ln.text for ln in lines)
+    fields = dict(zip(FIELDS, extract_fields(text)))
+    timings = {"pre": time.perf_counter() - t0}
+    confidence = sum(ln.conf for ln in lines) / len(lines) if lines else None
+
+    if not lines:
+        # La binarizada no encontró ni una palabra: no hay regiones, último recurso la página cruda
+        variant, f, text, dt = _run_variant("raw", base)
+        return ExtractionResult(*f, text, variant, {**timings, "raw": dt})
+
+    t1 = time.perf_counter()
+    candidates = field_lines([_normalize(ln.text) for ln in lines])
+    extra_texts, crops_done, retried = [], {}, []
+    for name in FIELDS:
+        idxs = candidates[name]
+        if not idxs:
+            continue
+        conf = sum(lines[i].conf for i in idxs) / len(idxs)
+        if fields[name] is not None and conf >= LOW_CONF:
+            continue
+        key = (min(idxs), max(idxs))
+        if key not in crops_done:
+            # Otra variante para la relectura: recorte sin binarizar, como un bloque de texto
+            crop_lines = ocr_lines(_crop_lines(base, lines, idxs), psm=6, tiled=False)
+            crop_text = "\n".join(ln.text for ln in crop_lines)
+            crop_conf = sum(ln.conf for ln in crop_lines) / len(crop_lines) if crop_lines else 0.0
+            crops_done[key] = (crop_text, crop_conf)
+            extra_texts.append(crop_text)
+        crop_text, crop_conf = crops_done[key]
+        new = dict(zip(FIELDS, extract_fields(crop_text)))[name]
+        # La relectura solo reemplaza un campo vacío o uno leído con menos confianza que ella
+        if new is not None and (fields[name] is None or crop_conf > conf):
+            fields[name] = new
+            retried.append(name)
+    if crops_done:
+        timings["regions"] = time.perf_counter() - t1
+
+    return ExtractionResult(
+        fields["store"], fields["date"], fields["total"],
+        "\n".join([text] + extra_texts),
+        "regions" if retried else "pre",
+        timings,
+        confidence=confidence,
+    )
+
+
+def _extract(base: np.ndarray, strategy: str) -> ExtractionResult:
+    if strategy == "layout":
+        return _run_layout(base)
+
+    if strategy == "sequential":
+        return _best([_run_variant(v, base) for v in VARIANTS])
+
+    if strategy == "skip_fallback":
+        first = _run_variant("pre", base)
+        if _score(first[1]) == 3:
+            return _best([first])
+        return _best([first, _run_variant("raw", base)])
+
+    # parallel / first_complete: ambas pasadas en hilos (Tesseract corre fuera del GIL)
+    pool = ThreadPoolExecutor(max_workers=len(VARIANTS), thread_name_prefix="ocr-variant")
+    try:
+        futures = [pool.submit(_run_variant, v, base) for v in VARIANTS]
+        if strategy == "parallel":
+            return _best([f.result() for f in futures])
+        results = []
+        for fut in as_completed(futures):
+            res = fut.result()
+            results.append(res)
+            if _score(res[1]) == 3:
+                # Ya está completo: no esperamos a la otra pasada (si ya arrancó, termina sola)
+                best = _best([res])
+                best.timings.update({v: dt for v, _, _, dt in results})
+                return best
+        return _best(results)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
 
+def extract_fields_safely(img, strategy: str = "layout"):
+    """OCR + extracción según la estrategia (por defecto layout) y devuelve la mejor extracción."""
+    return extract_fields_report(img, strategy).as_tuple()
 
 if __name__ == "__main__":
     # Solo se ejecuta si corres: python ocr.py
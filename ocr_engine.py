@@ -0,0 +1,209 @@
+"""Motores de OCR intercambiables.
+
+- `TesserocrEngine`: usa la API en C de Tesseract vía `tesserocr`. Los modelos
+  (`spa+eng`) se cargan una sola vez por proceso y se reutilizan entre imágenes.
+- `PytesseractEngine`: el comportamiento de siempre (un subproceso `tesseract`
+  por llamada). Queda como respaldo si `tesserocr` no está instalado.
+
+El motor se elige con la variable de entorno OCR_BACKEND (auto|tesserocr|pytesseract).
+
+Ambos reciben la imagen como ndarray uint8 (gris 2-D o RGB); por compatibilidad
+también aceptan una imagen PIL.
+"""
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from typing import List, NamedTuple
+
+import numpy as np
+from PIL import Image
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # opcional: sin tesserocr seguimos con pytesseract
+    tesserocr = None
+
+logger = logging.getLogger("bot-ocr-tickets.ocr")
+
+DEFAULT_LANG = "spa+eng"
+DEFAULT_OEM = 3
+DEFAULT_PSM = 6
+
+
+def _as_array(img) -> np.ndarray:
+    if isinstance(img, Image.Image):
+        return np.asarray(img if img.mode in ("L", "RGB") else img.convert("RGB"))
+    return img
+
+
+class Word(NamedTuple):
+    """Palabra reconocida con su caja (en píxeles de la imagen) y confianza 0-100."""
+    text: str
+    conf: float
+    left: int
+    top: int
+    width: int
+    height: int
+    line: int  # índice de línea, único dentro de la página
+
+
+class PytesseractEngine:
+    """Un proceso `tesseract` por imagen (lento pero sin dependencias nativas extra)."""
+
+    name = "pytesseract"
+
+    def __init__(self, lang: str = DEFAULT_LANG, oem: int = DEFAULT_OEM, psm: int = DEFAULT_PSM):
+        self.lang = lang
+        self.oem = oem
+        self.psm = psm
+
+    def image_to_string(self, img, psm: int = None) -> str:
+        return pytesseract.image_to_string(
+            _as_array(img),  # pytesseract acepta ndarray
+            lang=self.lang,
+            config=f"--oem {self.oem} --psm {psm or self.psm}",
+        )
+
+    def image_to_data(self, img, psm: int = None) -> List[Word]:
+        data = pytesseract.image_to_data(
+            _as_array(img),
+            lang=self.lang,
+            config=f"--oem {self.oem} --psm {psm or self.psm}",
+            output_type=pytesseract.Output.DICT,
+        )
+        words, line_ids = [], {}
+        for i, text in enumerate(data["text"]):
+            conf = float(data["conf"][i])
+            if conf < 0 or not text.strip():
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            line = line_ids.setdefault(key, len(line_ids))
+            words.append(Word(text, conf, data["left"][i], data["top"][i],
+                              data["width"][i], data["height"][i], line))
+        return words
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """Tesseract en proceso: cada `PyTessBaseAPI` se crea una vez y se reutiliza.
+
+    Una instancia de la API no se puede usar desde dos hilos a la vez, así que
+    mantenemos un pequeño almacén de instancias: cada llamada toma una libre (o
+    crea una nueva la primera vez) y la devuelve al terminar.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, lang: str = DEFAULT_LANG, oem: int = DEFAULT_OEM, psm: int = DEFAULT_PSM):
+        if tesserocr is None:
+            raise RuntimeError("tesserocr no está instalado")
+        self.lang = lang
+        self.oem = oem
+        self.psm = psm
+        self._apis = queue.SimpleQueue()
+        self._all = []
+        # Carga los modelos ya, así un traineddata faltante falla aquí y no en el primer ticket
+        self._apis.put(self._new_api())
+
+    def _new_api(self):
+        api = tesserocr.PyTessBaseAPI(
+            lang=self.lang,
+            oem=self.oem,  # tesserocr.OEM/PSM solo agrupan constantes: sus miembros ya son int
+            psm=self.psm,
+        )
+        self._all.append(api)
+        return api
+
+    @contextmanager
+    def _api(self):
+        try:
+            api = self._apis.get_nowait()
+        except queue.Empty:
+            api = self._new_api()
+        try:
+            yield api
+        finally:
+            self._apis.put(api)
+
+    @staticmethod
+    def _set_image(api, img):
+        # Píxeles crudos: SetImage(PIL) codifica la imagen a un formato intermedio antes de pasarla
+        arr = _as_array(img)
+        h, w = arr.shape[:2]
+        bpp = 1 if arr.ndim == 2 else arr.shape[2]
+        api.SetImageBytes(arr.tobytes(), w, h, bpp, w * bpp)
+
+    def image_to_string(self, img, psm: int = None) -> str:
+        with self._api() as api:
+            api.SetPageSegMode(psm or self.psm)
+            self._set_image(api, img)
+            return api.GetUTF8Text()
+
+    def image_to_data(self, img, psm: int = None) -> List[Word]:
+        RIL = tesserocr.RIL
+        words = []
+        with self._api() as api:
+            api.SetPageSegMode(psm or self.psm)
+            self._set_image(api, img)
+            api.Recognize()
+            ri = api.GetIterator()
+            line = -1
+            if ri is None:
+                return words
+            while True:
+                if ri.IsAtBeginningOf(RIL.TEXTLINE):
+                    line += 1
+                text = ri.GetUTF8Text(RIL.WORD)
+                box = ri.BoundingBox(RIL.WORD)
+                if text and text.strip() and box:
+                    x0, y0, x1, y1 = box
+                    words.append(Word(text, ri.Confidence(RIL.WORD), x0, y0, x1 - x0, y1 - y0, max(line, 0)))
+                if not ri.Next(RIL.WORD):
+                    break
+        return words
+
+    def close(self):
+        for api in self._all:
+            api.End()
+        self._all.clear()
+
+
+BACKENDS = {
+    "tesserocr": TesserocrEngine,
+    "pytesseract": PytesseractEngine,
+}
+
+_engine = None
+_engine_lock = threading.Lock()  # las pasadas en paralelo de ocr.py piden el motor desde varios hilos
+
+
+def create_engine(backend: str = "auto", **kwargs):
+    """Crea el motor pedido; con `auto` prefiere tesserocr y cae a pytesseract."""
+    if backend != "auto":
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend de OCR desconocido: {backend!r} (usa auto, {', '.join(BACKENDS)})")
+        return BACKENDS[backend](**kwargs)
+    if tesserocr is not None:
+        try:
+            return TesserocrEngine(**kwargs)
+        except Exception as e:
+            logger.warning("No pude iniciar tesserocr (%s); uso pytesseract.", e)
+    else:
+        logger.warning("tesserocr no está instalado; uso pytesseract (un proceso tesseract por imagen).")
+    return PytesseractEngine(**kwargs)
+
+
+def get_engine():
+    """Motor del proceso actual (se crea la primera vez y se reutiliza)."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(os.getenv("OCR_BACKEND", "auto"))
+                logger.info("Motor de OCR: %s (pid %d)", _engine.name, os.getpid())
+    return _engine
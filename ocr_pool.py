@@ -0,0 +1,377 @@
+"""Pool de procesos de OCR con reparto justo entre usuarios.
+
+Este módulo es liviano a propósito: lo importa el bot y no carga numpy, PIL,
+cv2 ni Tesseract. El trabajo pesado vive en ocr_worker.py, que solo se importa
+dentro de los procesos del pool (ver `_in_worker`).
+"""
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Hashable, List, NamedTuple, Optional
+
+logger = logging.getLogger("bot-ocr-tickets.ocr")
+
+WORKER_MODULE = "ocr_worker"
+# Segundos que se espera el reporte de calentamiento de cada worker
+WARMUP_TIMEOUT = float(os.getenv("OCR_WARMUP_TIMEOUT", "120"))
+# Los workers no se crean con fork: para entonces el proceso ya tiene hilos (escritor de
+# SQLite, /metrics) y el hijo heredaría sus candados tal como estaban, quizá tomados
+START_METHOD = os.getenv("OCR_START_METHOD") or (
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def mp_context():
+    """Contexto de multiprocessing para los pools de OCR (ver START_METHOD)."""
+    return multiprocessing.get_context(START_METHOD)
+
+
+class OCRQueueFull(Exception):
+    """La fila de OCR está llena; `position` es el lugar que tendría el ticket."""
+
+    def __init__(self, position: int):
+        super().__init__(f"Fila de OCR llena (posición {position})")
+        self.position = position
+
+
+class OCRRateLimited(Exception):
+    """El usuario rebasó su límite de tickets por minuto; `retry_after` son los segundos a esperar."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Límite de OCR por usuario (reintentar en {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+class OCRCancelled(Exception):
+    """El usuario canceló sus trabajos de OCR (/cancel) antes de que terminaran."""
+
+
+class UnsupportedImage(Exception):
+    """Los workers no saben leer el formato de la imagen (p. ej. HEIC sin pillow-heif instalado)."""
+
+
+def _in_worker(fn_name: str, *args):
+    """Corre dentro del pool: ahí se importa ocr_worker (la primera vez en cada proceso) y se llama a `fn_name`."""
+    return getattr(importlib.import_module(WORKER_MODULE), fn_name)(*args)
+
+
+def _init_worker(processes: int, warm_strategy: Optional[str], report):
+    """Inicializador de cada proceso del pool; corre antes de importar Tesseract."""
+    # Un hilo de OpenMP por llamada a Tesseract: el paralelismo ya lo dan los procesos y las franjas
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+    _in_worker("init_worker", processes, warm_strategy, report)
+
+
+class OCRSnapshot(NamedTuple):
+    """Contadores del pool copiados en un momento dado (ver `OCRExecutor.snapshot`)."""
+    pending: int
+    waiting: int
+    users_waiting: int
+
+
+class _Job:
+    __slots__ = ("user", "fn", "args", "future", "pool_future")
+
+    def __init__(self, user, fn, args, future):
+        self.user, self.fn, self.args, self.future = user, fn, args, future
+        self.pool_future = None  # se asigna al entrar al pool
+
+
+class OCRExecutor:
+    """Pool de procesos para Tesseract con una fila por usuario (reparto justo).
+
+    El loop del bot nunca ejecuta OCR: solo envía bytes al pool y espera el
+    resultado. Al pool entran a lo más `workers` trabajos; el resto espera en
+    la fila de su usuario y, cada vez que se libera un worker, pasa el primero
+    del siguiente usuario en turno (round-robin). Así quien manda 50 fotos no
+    hace esperar a quien manda una: entre dos fotos suyas pasa una de cada
+    otro usuario en espera.
+
+    - `max_queue`: trabajos esperando entre todos; si se llena, `submit` falla
+      de inmediato con `OCRQueueFull` en lugar de acumular trabajo sin límite.
+    - `user_concurrency`: trabajos de un mismo usuario corriendo a la vez
+      mientras otros usuarios esperan (por defecto todos los workers menos
+      uno, que queda para los demás). Sin nadie más en la fila, un usuario
+      solo puede ocupar todos los workers (p. ej. un álbum).
+    - `user_rate` / `user_burst`: cubeta de fichas por usuario (tickets por
+      minuto y ráfaga máxima); al rebasarla, `OCRRateLimited`.
+    - `cancel(user)`: descarta sus trabajos en espera y deja de esperar los que
+      ya corren (el worker termina el suyo, pero el resultado se tira).
+    - `warm_strategy`: si se da, cada worker se calienta al iniciar con una
+      lectura de esa estrategia (ocr_worker.warm_up); ver `warm_up`.
+
+    Las filas solo se tocan desde el loop del bot. Otros hilos (las métricas)
+    leen `snapshot()`, una copia de los contadores que el loop publica tras
+    cada cambio.
+    """
+
+    def __init__(self, workers: int = None, max_queue: int = None, user_concurrency: int = None,
+                 user_rate: float = 0, user_burst: int = None, warm_strategy: str = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.warm_strategy = warm_strategy
+        self._warm_reports = None  # cola donde cada worker deja sus tiempos al calentarse
+        self.max_queue = max_queue if max_queue is not None else self.workers * 4
+        self.user_concurrency = user_concurrency or max(1, self.workers - 1)
+        self.user_rate = user_rate  # tickets por minuto por usuario (0 = sin límite)
+        self.user_burst = user_burst or 10  # un álbum de Telegram trae a lo más 10 fotos
+        self._pool = None
+        self._loop = None
+        self._queues: Dict[Hashable, deque] = {}  # usuario -> trabajos en espera
+        self._turns = deque()  # usuarios con trabajos en espera, en orden de turno
+        self._running: Dict[Hashable, set] = {}  # usuario -> trabajos dentro del pool
+        self._busy = 0
+        self._buckets: Dict[Hashable, List[float]] = {}  # usuario -> [fichas, última recarga]
+        self._snapshot = OCRSnapshot(0, 0, 0)
+        self._snapshot_lock = threading.Lock()
+
+    def start(self):
+        if self._pool is None:
+            ctx = mp_context()
+            if self.warm_strategy:
+                self._warm_reports = ctx.Queue()
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=ctx, initializer=_init_worker,
+                initargs=(self.workers, self.warm_strategy, self._warm_reports),
+            )
+
+    async def warm_up(self) -> List[dict]:
+        """Arranca todos los workers y devuelve los tiempos de calentamiento de cada uno.
+
+        El pool crea sus procesos hasta que se le envía trabajo: aquí se le
+        envían `workers` trabajos vacíos a la vez (directo al pool, fuera de las
+        filas por usuario), así que cada proceso importa ocr_worker y corre su
+        inicializador ahora y no con la primera foto. Cada inicializador deja
+        un reporte en la cola, así que hay uno por worker aunque los trabajos
+        vacíos los atienda uno solo.
+        """
+        if self._pool is None:
+            raise RuntimeError("OCRExecutor no iniciado; llama a start() primero")
+        if self._warm_reports is None:
+            return []
+        loop = asyncio.get_running_loop()
+        for _ in range(self.workers):
+            loop.run_in_executor(self._pool, os.getpid)
+        infos = []
+        for _ in range(self.workers):
+            try:
+                infos.append(await asyncio.to_thread(self._warm_reports.get, timeout=WARMUP_TIMEOUT))
+            except queue.Empty:
+                logger.warning("Un worker de OCR no reportó su calentamiento en %.0fs", WARMUP_TIMEOUT)
+                break
+        return infos
+
+    def shutdown(self):
+        for jobs in self._queues.values():
+            for job in jobs:
+                job.future.cancel()
+        self._queues.clear()
+        self._turns.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._publish()
+
+    # ----- estado -----
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def pending(self) -> int:
+        """Trabajos enviados que aún no terminan (corriendo + en espera)."""
+        return self._busy + self.waiting
+
+    @property
+    def users_waiting(self) -> int:
+        return len(self._turns)
+
+    def snapshot(self) -> OCRSnapshot:
+        """Contadores para leer desde otro hilo (p. ej. /metrics) sin recorrer las filas."""
+        with self._snapshot_lock:
+            return self._snapshot
+
+    def _publish(self):
+        # Solo desde el loop: recorre las filas y deja una copia para los demás hilos
+        snap = OCRSnapshot(self.pending, self.waiting, self.users_waiting)
+        with self._snapshot_lock:
+            self._snapshot = snap
+
+    def queue_position(self, user: Hashable = None) -> int:
+        """Lugar en la fila que tendría un trabajo nuevo de `user` (0 = entra directo a un worker).
+
+        Cuenta sus propios trabajos en espera y, por el round-robin, hasta uno
+        más que esos de cada otro usuario en espera.
+        """
+        own = len(self._queues.get(user, ()))
+        # Con un worker libre, los que esperan es porque ya tienen su máximo corriendo
+        if not own and self._busy < self.workers and not self._capped(user, others_waiting=bool(self._turns)):
+            return 0
+        ahead = own + sum(min(len(q), own + 1) for u, q in self._queues.items() if u != user)
+        return ahead + 1
+
+    def is_full(self) -> bool:
+        return self.pending >= self.workers + self.max_queue
+
+    def check(self, user: Hashable = None, n: int = 1):
+        """Falla como lo haría `submit` de `n` trabajos (sin gastar fichas); sirve para no descargar en vano.
+
+        Un lote (álbum) entra completo o no entra: basta que haya lugar para uno,
+        aunque el lote rebase `max_queue`.
+        """
+        if self._pool is None:
+            raise RuntimeError("OCRExecutor no iniciado; llama a start() primero")
+        if self.is_full():
+            raise OCRQueueFull(self.queue_position(user))
+        wait = self._refill(user, n)
+        if wait:
+            raise OCRRateLimited(wait)
+
+    def _refill(self, user: Hashable, n: int) -> float:
+        """Recarga la cubeta de `user`; devuelve 0 si alcanzan `n` fichas o los segundos que faltan."""
+        if not self.user_rate or n <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.setdefault(user, [float(self.user_burst), now])
+        bucket[0] = min(float(self.user_burst), bucket[0] + (now - bucket[1]) * self.user_rate / 60)
+        bucket[1] = now
+        if bucket[0] >= min(n, self.user_burst):
+            return 0.0
+        return (min(n, self.user_burst) - bucket[0]) * 60 / self.user_rate
+
+    def _admit(self, user: Hashable, n: int, cost: int):
+        self.check(user, n * cost)
+        if self.user_rate and cost:
+            bucket = self._buckets[user]
+            bucket[0] = max(0.0, bucket[0] - cost * n)
+            if len(self._buckets) > 10000:  # olvida cubetas llenas (usuarios inactivos)
+                self._buckets = {u: b for u, b in self._buckets.items() if b[0] < self.user_burst}
+
+    # ----- envío y reparto -----
+
+    async def submit(self, fn, *args, user: Hashable = None, cost: int = 1):
+        """Encola `fn(*args)` en la fila de `user`; `cost` son las fichas que gasta (0 = no cuenta)."""
+        self._admit(user, 1, cost)
+        return await self._enqueue(user, fn, args)
+
+    async def _enqueue(self, user: Hashable, fn, args):
+        self._loop = asyncio.get_running_loop()
+        job = _Job(user, fn, args, self._loop.create_future())
+        jobs = self._queues.get(user)
+        if jobs is None:
+            jobs = self._queues[user] = deque()
+            self._turns.append(user)
+        jobs.append(job)
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            self._forget(job)  # el que esperaba se canceló (p. ej. al apagar): que no ocupe la fila
+            raise
+
+    def _capped(self, user: Hashable, others_waiting: bool) -> bool:
+        # El tope por usuario solo aplica si alguien más espera: solo, un usuario usa todo el pool
+        return others_waiting and len(self._running.get(user, ())) >= self.user_concurrency
+
+    def _next_job(self) -> Optional[_Job]:
+        for _ in range(len(self._turns)):
+            user = self._turns[0]
+            self._turns.rotate(-1)  # pase o no, el turno sigue al siguiente usuario
+            if self._capped(user, others_waiting=len(self._turns) > 1):
+                continue
+            jobs = self._queues[user]
+            job = jobs.popleft()
+            if not jobs:
+                del self._queues[user]
+                self._turns.pop()  # el rotate lo dejó al final
+            return job
+        return None  # todos los que esperan ya tienen su máximo corriendo
+
+    def _dispatch(self):
+        while self._pool is not None and self._busy < self.workers:
+            job = self._next_job()
+            if job is None:
+                break
+            self._busy += 1
+            self._running.setdefault(job.user, set()).add(job)
+            job.pool_future = self._pool.submit(job.fn, *job.args)
+            job.pool_future.add_done_callback(self._on_pool_done(job))
+        self._publish()
+
+    def _on_pool_done(self, job: _Job):
+        loop = self._loop
+
+        def callback(pool_future):
+            try:
+                loop.call_soon_threadsafe(self._finished, job, pool_future)
+            except RuntimeError:
+                pass  # el loop ya cerró (apagando)
+        return callback
+
+    def _finished(self, job: _Job, pool_future):
+        # El worker quedó libre aunque el usuario haya cancelado: el slot se suelta aquí
+        self._busy -= 1
+        running = self._running.get(job.user)
+        if running is not None:
+            running.discard(job)
+            if not running:
+                del self._running[job.user]
+        if not job.future.done():
+            if pool_future.cancelled():
+                job.future.set_exception(OCRCancelled())
+            elif pool_future.exception() is not None:
+                job.future.set_exception(pool_future.exception())
+            else:
+                job.future.set_result(pool_future.result())
+        self._dispatch()
+
+    def _forget(self, job: _Job):
+        jobs = self._queues.get(job.user)
+        if jobs is not None and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del self._queues[job.user]
+                self._turns.remove(job.user)
+            self._publish()
+
+    def cancel(self, user: Hashable) -> int:
+        """Cancela los trabajos de `user` (en espera y corriendo); devuelve cuántos eran."""
+        jobs = list(self._queues.pop(user, ()))
+        if jobs:
+            self._turns.remove(user)
+        jobs += self._running.get(user, ())
+        for job in jobs:
+            if job.pool_future is not None:
+                job.pool_future.cancel()  # solo funciona si aún no llegó a un proceso
+            if not job.future.done():
+                job.future.set_exception(OCRCancelled())
+        self._publish()
+        return len(jobs)
+
+    # ----- atajos -----
+
+    async def extract(self, data: bytes, strategy: str = "layout", max_side: int = None,
+                      user: Hashable = None, cost: int = 1):
+        """Atajo: OCR + extracción de campos de una imagen en bytes (devuelve ExtractionResult)."""
+        return await self.submit(_in_worker, "run_ocr_job", data, strategy, True, max_side, user=user, cost=cost)
+
+    async def extract_many(self, datas, strategy: str = "layout", user: Hashable = None):
+        """OCR de varias imágenes en paralelo (álbumes).
+
+        El lote entra completo o no entra (ver `check`), y gasta una ficha por
+        foto. Las fotos van a la fila del usuario, así que se intercalan con las
+        de los demás. Devuelve, en orden, un ExtractionResult o la excepción de
+        cada imagen.
+        """
+        self._admit(user, len(datas), 1)
+        return await asyncio.gather(
+            *(self._enqueue(user, _in_worker, ("run_ocr_job", data, strategy)) for data in datas),
+            return_exceptions=True,
+        )
@@ -0,0 +1,149 @@
+"""Lo que corre dentro de los procesos del pool de OCR.
+
+Este módulo carga lo pesado (numpy, PIL, cv2 y Tesseract vía ocr.py) y solo
+lo importan los workers: el bot los llama por nombre (ver ocr_pool._in_worker)
+y nunca lo importa, así que arranca sin pagar esas importaciones.
+
+Al iniciar, cada worker toma su parte de los núcleos para las franjas de
+tickets largos y se calienta (`init_worker`, inicializador del pool): lee
+un ticket diminuto dibujado en memoria para que la primera foto real no pague
+la carga del modelo de Tesseract, y reporta sus tiempos al bot.
+"""
+import time
+
+_T0 = time.perf_counter()
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
+
+try:
+    import pillow_heif
+except ImportError:  # opcional: sin pillow-heif no se leen fotos HEIC/HEIF (iPhone, enviadas como archivo)
+    pillow_heif = None
+
+from db_utils import cache_get
+from ocr import ExtractionResult, extract_fields_report, share_cores
+from ocr_pool import UnsupportedImage
+
+IMPORT_SECONDS = time.perf_counter() - _T0  # lo que tarda un worker en cargar el pipeline de OCR
+
+logger = logging.getLogger("bot-ocr-tickets.ocr")
+
+
+def image_hash(arr: np.ndarray) -> str:
+    """Hash de los píxeles decodificados: la misma foto reenviada da el mismo hash."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"L:{arr.shape[1]}x{arr.shape[0]}:".encode())
+    h.update(np.ascontiguousarray(arr).data)  # sin copia: decode ya entrega un arreglo contiguo
+    return h.hexdigest()
+
+
+# Marcas del encabezado `ftyp` de un archivo HEIF (bytes 8-12)
+_HEIF_BRANDS = (b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1")
+
+
+def _is_heif(data: bytes) -> bool:
+    return data[4:8] == b"ftyp" and data[8:12] in _HEIF_BRANDS
+
+
+def decode(data: bytes, max_side: int = None) -> np.ndarray:
+    """Decodifica una sola vez a la representación del pipeline: ndarray uint8 2-D en gris.
+
+    En JPEG el decodificador entrega directamente la luminancia (modo draft "L",
+    sin pasar por RGB). Con `max_side` la imagen se reduce a ~ese lado mayor: en
+    JPEG también dentro del decodificador (1/2, 1/4 u 1/8), en otros formatos
+    por un factor entero después de decodificar.
+    """
+    try:
+        img = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        if _is_heif(data):
+            raise UnsupportedImage("Imagen HEIC/HEIF y este servidor no tiene pillow-heif") from None
+        raise
+    box = img.size
+    if max_side and max(img.size) > max_side:
+        ratio = max_side / max(img.size)
+        # Caja con la proporción de la imagen: draft elige la mayor reducción que aún la cubre
+        box = (int(img.width * ratio), int(img.height * ratio))
+    img.draft("L", box)  # no hace nada si el formato no lo soporta
+    if img.mode != "L":
+        img = img.convert("L")
+    if max_side:
+        factor = max(img.size) // max_side
+        if factor >= 2:
+            img = img.reduce(factor)
+    return np.asarray(img)
+
+
+def run_ocr_job(data: bytes, strategy: str = "layout", use_cache: bool = True, max_side: int = None):
+    """Se ejecuta dentro de un proceso del pool: decodifica la imagen y hace OCR.
+
+    Antes de correr Tesseract busca el hash de los píxeles en la caché de OCR.
+    Los workers solo leen la BD: si hubo acierto (`cached`), quien recibe el
+    resultado refresca la entrada con el escritor de su proceso (cache_put o
+    cache_touch).
+    En `timings` van también decode, hash y worker (todo el trabajo dentro del
+    proceso), para que el bot pueda separar el tiempo en fila del de cómputo.
+    `max_side` limita la resolución decodificada (imágenes enviadas como archivo).
+    """
+    t0 = time.perf_counter()
+    img = decode(data, max_side)
+    t1 = time.perf_counter()
+    digest = image_hash(img)
+    timings = {"decode": t1 - t0, "hash": time.perf_counter() - t1}
+    result = None
+    if use_cache:
+        try:
+            hit = cache_get(image_hash=digest)
+        except sqlite3.Error as e:
+            logger.warning("Caché de OCR no disponible: %s", e)
+            hit = None
+        if hit:
+            store, date, total, text, variant, _ = hit
+            result = ExtractionResult(store, date, total, text, variant, image_hash=digest, cached=True)
+    if result is None:
+        result = extract_fields_report(img, strategy)
+        result.image_hash = digest
+    result.timings = {**timings, **result.timings, "worker": time.perf_counter() - t0}
+    return result
+
+
+def _warmup_image() -> np.ndarray:
+    """Ticket mínimo dibujado en memoria (sin archivos): tienda, fecha y total."""
+    img = Image.new("L", (160, 48), 255)
+    ImageDraw.Draw(img).multiline_text((4, 2), "OXXO\n12/05/2024\nTOTAL 10.00", fill=0,
+                                       font=ImageFont.load_default())
+    return np.asarray(img.resize((480, 144)))  # letras de ~30 px, como en una foto real
+
+
+def init_worker(processes: int, strategy: str = None, report=None):
+    """Inicializador de cada worker de un pool de `processes` procesos (ver ocr_pool._init_worker)."""
+    if pillow_heif is not None:
+        pillow_heif.register_heif_opener()
+    share_cores(processes)
+    if strategy:
+        warm_up(strategy, report)
+
+
+def warm_up(strategy: str = "layout", report=None):
+    """Calienta el worker con una pasada completa de OCR sobre `_warmup_image`.
+
+    Los tiempos (importación y calentamiento) se ponen en la cola `report`, uno
+    por worker. Nunca falla: si no se puede calentar (p. ej. falta Tesseract)
+    solo se anota, porque un inicializador con error rompería todo el pool.
+    """
+    t0 = time.perf_counter()
+    try:
+        result = extract_fields_report(_warmup_image(), strategy)
+        score = result.score
+    except Exception as e:
+        logger.warning("No pude calentar el worker %d: %s", os.getpid(), e)
+        score = None
+    if report is not None:
+        report.put(dict(pid=os.getpid(), strategy=strategy, score=score,
+                        import_seconds=IMPORT_SECONDS, warmup_seconds=time.perf_counter() - t0))
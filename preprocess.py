@@ -0,0 +1,199 @@
+"""Preparación de la imagen antes del OCR.
+
+Etapas (cada una se puede apagar y se mide por separado):
+
+1. receipt:   localiza el contorno del ticket y recorta (con corrección de
+              perspectiva si el contorno es un cuadrilátero).
+2. deskew:    endereza el texto usando el rectángulo mínimo de los píxeles de tinta.
+3. scale:     reescala para que la letra mida `target_char_height` píxeles.
+4. threshold: gris + umbral adaptativo (solo para la pasada "pre").
+
+Las etapas 1-3 solo cambian la geometría, así que se aplican una vez y las
+comparten ambas pasadas del OCR.
+
+Todo trabaja sobre una sola representación: ndarray uint8 de 2 dimensiones en
+gris (ver `as_gray`). Los recortes son vistas del arreglo, no copias.
+"""
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+GEOMETRY_STEPS = ("receipt", "deskew", "scale")
+
+
+@dataclass
+class PreprocessConfig:
+    receipt: bool = True
+    deskew: bool = True
+    scale: bool = True
+    target_char_height: int = 32   # px de alto de letra con los que Tesseract lee mejor
+    detect_side: int = 800         # la detección del ticket corre sobre una miniatura de este lado
+    min_receipt_area: float = 0.05  # fracción mínima de la foto para aceptar un contorno
+    max_skew: float = 15.0         # grados; inclinaciones mayores suelen ser falsos positivos
+    block_size: int = 31           # umbral adaptativo
+    c: int = 15
+
+    @classmethod
+    def from_env(cls) -> "PreprocessConfig":
+        """OCR_PREPROCESS=receipt,deskew,scale (o "none") y OCR_TARGET_CHAR_HEIGHT."""
+        cfg = cls()
+        steps = os.getenv("OCR_PREPROCESS")
+        if steps is not None:
+            enabled = {s.strip() for s in steps.split(",") if s.strip()}
+            for step in GEOMETRY_STEPS:
+                setattr(cfg, step, step in enabled)
+        height = os.getenv("OCR_TARGET_CHAR_HEIGHT")
+        if height:
+            cfg.target_char_height = int(height)
+        return cfg
+
+
+def _to_gray(arr: np.ndarray) -> np.ndarray:
+    if arr.ndim == 2:
+        return arr
+    return cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY)
+
+
+def as_gray(img) -> np.ndarray:
+    """Imagen PIL o ndarray (gris o RGB) → ndarray uint8 2-D en gris; si ya lo es, sin copiar."""
+    if isinstance(img, Image.Image):
+        return np.asarray(img if img.mode == "L" else img.convert("L"))
+    return _to_gray(img)
+
+
+def _order_corners(pts: np.ndarray) -> np.ndarray:
+    # arriba-izq, arriba-der, abajo-der, abajo-izq
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]], dtype=np.float32)
+
+
+def find_receipt(arr: np.ndarray, cfg: PreprocessConfig) -> np.ndarray:
+    """Recorta el ticket (papel claro) del fondo; si no lo encuentra devuelve la imagen igual."""
+    gray = _to_gray(arr)
+    h, w = gray.shape
+    ratio = min(1.0, cfg.detect_side / max(h, w))
+    small = cv2.resize(gray, (max(1, int(w * ratio)), max(1, int(h * ratio))), interpolation=cv2.INTER_AREA)
+    small = cv2.GaussianBlur(small, (5, 5), 0)
+    _, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Cierra los huecos del texto para que el ticket quede como una sola mancha
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return arr
+    cnt = max(contours, key=cv2.contourArea)
+    area = cv2.contourArea(cnt)
+    if area < cfg.min_receipt_area * small.shape[0] * small.shape[1]:
+        return arr
+    if area > 0.95 * small.shape[0] * small.shape[1]:
+        return arr  # el ticket ya ocupa toda la foto
+
+    approx = cv2.approxPolyDP(cnt, 0.02 * cv2.arcLength(cnt, True), True)
+    if len(approx) == 4:
+        src = _order_corners(approx.reshape(4, 2).astype(np.float32) / ratio)
+        width = int(max(np.linalg.norm(src[0] - src[1]), np.linalg.norm(src[3] - src[2])))
+        height = int(max(np.linalg.norm(src[0] - src[3]), np.linalg.norm(src[1] - src[2])))
+        if width > 0 and height > 0:
+            dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+            M = cv2.getPerspectiveTransform(src, dst)
+            return cv2.warpPerspective(arr, M, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+    x, y, bw, bh = cv2.boundingRect(cnt)
+    x0, y0 = int(x / ratio), int(y / ratio)
+    x1, y1 = min(w, int((x + bw) / ratio)), min(h, int((y + bh) / ratio))
+    return arr[y0:y1, x0:x1]
+
+
+def _ink_mask(gray: np.ndarray) -> np.ndarray:
+    _, inv = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return inv
+
+
+def skew_angle(gray: np.ndarray):
+    """Inclinación del texto en grados, en [-45, 45] (None si casi no hay tinta)."""
+    coords = cv2.findNonZero(_ink_mask(gray))
+    if coords is None or len(coords) < 50:
+        return None
+    angle = cv2.minAreaRect(coords)[-1]
+    # OpenCV < 4.5 devuelve [-90, 0) y las versiones nuevas (0, 90]: cualquiera de los dos a [-45, 45]
+    if angle < -45:
+        angle += 90
+    elif angle > 45:
+        angle -= 90
+    return angle
+
+
+def deskew(arr: np.ndarray, cfg: PreprocessConfig) -> np.ndarray:
+    """Endereza el texto; solo rota si la inclinación es apreciable y razonable."""
+    # El ángulo se mide en una miniatura: es igual de preciso y mucho más barato
+    gray = _to_gray(arr)
+    ratio = min(1.0, cfg.detect_side / max(gray.shape))
+    if ratio < 1.0:
+        gray = cv2.resize(gray, (max(1, int(gray.shape[1] * ratio)), max(1, int(gray.shape[0] * ratio))),
+                          interpolation=cv2.INTER_AREA)
+    angle = skew_angle(gray)
+    if angle is None or abs(angle) < 0.5 or abs(angle) > cfg.max_skew:
+        return arr
+    h, w = arr.shape[:2]
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(arr, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+
+
+def estimate_char_height(gray: np.ndarray) -> float:
+    """Mediana del alto de los componentes conectados con forma de letra (0 si no hay)."""
+    n, _, stats, _ = cv2.connectedComponentsWithStats(_ink_mask(gray), connectivity=8)
+    if n <= 1:
+        return 0.0
+    hs = stats[1:, cv2.CC_STAT_HEIGHT]
+    ws = stats[1:, cv2.CC_STAT_WIDTH]
+    keep = (hs >= 6) & (hs <= gray.shape[0] // 4) & (ws <= hs * 3)
+    if keep.sum() < 10:
+        return 0.0
+    return float(np.median(hs[keep]))
+
+
+def normalize_scale(arr: np.ndarray, cfg: PreprocessConfig) -> np.ndarray:
+    """Reescala para que la letra mida `target_char_height` px (se omite si ya está cerca)."""
+    char_h = estimate_char_height(_to_gray(arr))
+    if not char_h:
+        return arr
+    factor = max(0.25, min(4.0, cfg.target_char_height / char_h))
+    if 0.9 <= factor <= 1.1:
+        return arr
+    h, w = arr.shape[:2]
+    interp = cv2.INTER_AREA if factor < 1 else cv2.INTER_CUBIC
+    return cv2.resize(arr, (max(1, int(w * factor)), max(1, int(h * factor))), interpolation=interp)
+
+
+def threshold(arr: np.ndarray, cfg: PreprocessConfig) -> np.ndarray:
+    return cv2.adaptiveThreshold(
+        _to_gray(arr), 255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, cfg.block_size, cfg.c
+    )
+
+
+_STEP_FUNCS = {"receipt": find_receipt, "deskew": deskew, "scale": normalize_scale}
+
+
+def prepare_geometry(img, cfg: PreprocessConfig = None) -> Tuple[np.ndarray, Dict[str, float]]:
+    """Recorte + enderezado + escala. Devuelve el ndarray en gris y segundos por etapa."""
+    cfg = cfg or PreprocessConfig()
+    timings = {}
+    arr = as_gray(img)
+    for step in GEOMETRY_STEPS:
+        if getattr(cfg, step):
+            t0 = time.perf_counter()
+            arr = _STEP_FUNCS[step](arr, cfg)
+            timings[step] = time.perf_counter() - t0
+    return arr, timings
+
+
+def binarize(img, cfg: PreprocessConfig = None) -> np.ndarray:
+    """Gris + umbral adaptativo."""
+    return threshold(as_gray(img), cfg or PreprocessConfig())
@@ -0,0 +1,82 @@
+"""Migraciones de db_init.py: datos viejos y arranques simultáneos."""
+import sqlite3
+import threading
+
+import db_init
+from dedupe import SIMHASH_BANDS
+from db_init import MIGRATIONS, SCHEMA, apply_pragmas, create_schema, init_db
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    apply_pragmas(conn)
+    return conn
+
+
+def _version(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_fresh_db_reaches_latest_version(tmp_path):
+    path = str(tmp_path / "tickets.db")
+    init_db(path)
+    init_db(path)  # la segunda vez no hay nada pendiente
+    assert _version(path) == len(MIGRATIONS)
+
+
+def test_legacy_rows_are_converted(tmp_path):
+    path = str(tmp_path / "tickets.db")
+    conn = _connect(path)
+    for stmt in SCHEMA:
+        conn.execute(stmt)
+    conn.executemany("INSERT INTO tickets (store, date, total, raw_text) VALUES (?, ?, ?, ?)", [
+        ("OXXO", "12/05/2024", 91.5, "OXXO TIENDA 1234\nLECHE LALA 1L 28.50\nPAN BIMBO 45.00\nTOTAL 91.50"),
+        ("HEB", "ayer", "abc", "HEB"),
+    ])
+    create_schema(conn)
+    rows = conn.execute("SELECT store, date, total_cents, simhash IS NOT NULL FROM tickets ORDER BY id").fetchall()
+    assert rows == [("OXXO", "2024-05-12", 9150, 1), ("HEB", None, None, 0)]
+    legacy = conn.execute("SELECT field, value FROM tickets_legacy_values ORDER BY field").fetchall()
+    assert legacy == [("date", "ayer"), ("total", "abc")]
+    bands = conn.execute("SELECT COUNT(*) FROM ticket_simhash_bands").fetchone()[0]
+    assert bands == SIMHASH_BANDS  # el texto corto no tiene huella
+    conn.close()
+
+
+def test_concurrent_startups_migrate_once(tmp_path, monkeypatch):
+    # El bot y main.py abren la misma base vacía al mismo tiempo
+    path = str(tmp_path / "tickets.db")
+    applied = []
+    wrapped = []
+    for migration in MIGRATIONS:
+        def run(conn, migration=migration):
+            applied.append(migration.__name__)
+            migration(conn)
+        run.__doc__ = migration.__doc__
+        wrapped.append(run)
+    monkeypatch.setattr(db_init, "MIGRATIONS", tuple(wrapped))
+
+    start = threading.Barrier(2)
+    errors = []
+
+    def startup():
+        try:
+            conn = _connect(path)
+            start.wait()
+            create_schema(conn)
+            conn.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=startup) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert applied == [m.__name__ for m in MIGRATIONS]
+    assert _version(path) == len(MIGRATIONS)
@@ -0,0 +1,112 @@
+"""db_utils: el escritor único (TicketWriter) y los guardados desde el bot."""
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import db_utils
+from db_utils import TicketWriter
+
+TEXT = "OXXO TIENDA 1234\nLECHE LALA 1L 28.50\nPAN BIMBO 45.00\nTOTAL 73.50\nFECHA 12/05/2024"
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    """Base temporal con su escritor, usada también por get_writer() y _read_conn()."""
+    path = str(tmp_path / "tickets.db")
+    writer = TicketWriter(path)
+    monkeypatch.setattr(db_utils, "DB_PATH", path)
+    monkeypatch.setattr(db_utils, "_writer", writer)
+    yield writer
+    writer.close()
+
+
+def _count(path, table="t"):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _insert(x):
+    def job(c):
+        c.execute("CREATE TABLE IF NOT EXISTS t (x INTEGER)")
+        c.execute("INSERT INTO t VALUES (?)", (x,))
+        return x
+    return job
+
+
+def test_writer_commits_a_batch_despite_a_failing_job(tmp_path):
+    path = str(tmp_path / "w.db")
+    writer = TicketWriter(path, max_delay=0.2)  # junta los tres trabajos en un lote
+    writer.start()
+
+    def broken(c):
+        _insert(99)(c)
+        raise RuntimeError("falla a la mitad")
+
+    futs = [writer.submit(_insert(1)), writer.submit(broken), writer.submit(_insert(2))]
+    assert futs[0].result() == 1 and futs[2].result() == 2
+    with pytest.raises(RuntimeError):
+        futs[1].result()
+    writer.close()
+    conn = sqlite3.connect(path)
+    assert sorted(x for x, in conn.execute("SELECT x FROM t")) == [1, 2]  # el 99 se deshizo con su SAVEPOINT
+    conn.close()
+
+
+def test_writer_result_is_visible_once_resolved(tmp_path):
+    path = str(tmp_path / "w.db")
+    writer = TicketWriter(path)
+    for i in range(20):
+        writer.submit(_insert(i)).result()
+        assert _count(path) == i + 1  # el Future se resuelve después del COMMIT
+    writer.close()
+
+
+def test_close_flushes_pending_writes(tmp_path):
+    path = str(tmp_path / "w.db")
+    writer = TicketWriter(path, max_batch=4)
+    futs = [writer.submit(_insert(i)) for i in range(50)]
+    writer.close()
+    assert all(f.done() for f in futs)
+    assert _count(path) == 50
+
+
+def _spy_simhash(monkeypatch):
+    threads = []
+    simhash = db_utils.simhash
+
+    def spy(text):
+        threads.append(threading.get_ident())
+        return simhash(text)
+    monkeypatch.setattr(db_utils, "simhash", spy)
+    return threads
+
+
+def test_save_ticket_async_prepares_off_the_loop(writer, monkeypatch):
+    threads = _spy_simhash(monkeypatch)
+
+    async def main():
+        loop_thread = threading.get_ident()
+        tid = await db_utils.save_ticket_async("OXXO", "12/05/2024", "73.50", "MXN", TEXT, user_id=1)
+        return loop_thread, tid
+
+    loop_thread, tid = asyncio.run(main())
+    assert threads and loop_thread not in threads
+    assert db_utils.find_duplicate(1, "OXXO", "12/05/2024", "73.50", "")[0] == tid
+
+
+def test_save_tickets_async_prepares_off_the_loop(writer, monkeypatch):
+    threads = _spy_simhash(monkeypatch)
+    tickets = [dict(store="OXXO", date="12/05/2024", total=t, currency="MXN", raw_text=TEXT, user_id=1)
+               for t in ("73.50", "10.00")]
+
+    async def main():
+        return threading.get_ident(), await db_utils.save_tickets_async(tickets)
+
+    loop_thread, ids = asyncio.run(main())
+    assert len(threads) == 2 and loop_thread not in threads
+    assert len(ids) == 2
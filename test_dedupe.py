@@ -0,0 +1,64 @@
+"""Huellas de repetidos (dedupe.py) y su búsqueda por bandas (db_utils.find_duplicate)."""
+import random
+
+import pytest
+
+import db_utils
+import dedupe
+from db_utils import TicketWriter, _insert_ticket, find_duplicate
+
+TEXT = (
+    "OXXO TIENDA 1234\nAV CONSTITUCION 100 MONTERREY\nLECHE LALA 1L 28.50\nPAN BIMBO 45.00\n"
+    "COCA COLA 600ML 18.00\nTOTAL 91.50\nFECHA 12/05/2024 10:22\nGRACIAS POR SU COMPRA"
+)
+
+
+def _flip(h, n, rng):
+    for bit in rng.sample(range(64), n):
+        h ^= 1 << bit
+    return h
+
+
+def test_random_candidate_rate_stays_low():
+    # Huellas al azar que caen en alguna búsqueda de `probes`: ~(4 × 17) / 2^16 ≈ 0.1 %
+    rng = random.Random(0)
+    query = dedupe.probes(rng.getrandbits(64))
+    probed = [set(values) for values in query]
+    n = 20000
+    hits = sum(
+        any(v in probed[band] for band, v in enumerate(dedupe.bands(rng.getrandbits(64))))
+        for _ in range(n)
+    )
+    assert hits / n < 0.003
+
+
+def test_every_near_duplicate_is_probed():
+    rng = random.Random(1)
+    for _ in range(2000):
+        h = rng.getrandbits(64)
+        other = _flip(h, rng.randint(0, dedupe.SIMHASH_MAX_DISTANCE), rng)
+        assert any(v in values for v, values in zip(dedupe.bands(other), dedupe.probes(h)))
+
+
+def test_ocr_variants_are_close():
+    reread = TEXT.replace("LALA", "LA1A").replace("COMPRA", "C0MPRA")
+    assert dedupe.hamming(dedupe.simhash(TEXT), dedupe.simhash(reread)) <= dedupe.SIMHASH_MAX_DISTANCE
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "tickets.db")
+    monkeypatch.setattr(db_utils, "DB_PATH", path)
+    writer = TicketWriter(path)
+    yield writer
+    writer.close()
+
+
+def test_find_duplicate_exact_and_similar(db):
+    tid = db.submit(_insert_ticket("OXXO", "12/05/2024", "91.50", "MXN", TEXT, user_id=7)).result()
+    assert find_duplicate(7, "OXXO", "12/05/2024", "91.50", "")[-1] == "exact"
+    # Otra lectura con el total mal leído: no hay llave exacta, pero el texto casi no cambia
+    reread = TEXT.replace("91.50", "81.50").replace("LALA", "LA1A")
+    dup = find_duplicate(7, "OXXO", "12/05/2024", "81.50", reread)
+    assert dup[0] == tid and dup[-1] == "similar"
+    assert find_duplicate(8, "OXXO", "12/05/2024", "81.50", reread) is None  # otro usuario
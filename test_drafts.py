@@ -0,0 +1,52 @@
+"""drafts.py: formato binario de borradores y álbumes."""
+import pytest
+
+from drafts import MAX_ALBUM, AlbumState, DraftStore, MemoryBackend, TicketDraft, pack, pack_album, unpack, unpack_album
+
+
+@pytest.mark.parametrize("td", [
+    TicketDraft(),
+    TicketDraft(store="OXXO", date="12/05/2024", total="101.00", used_pre=False, edit_field="total"),
+    TicketDraft(store="", date="", total="", currency="USD"),  # vacío no es lo mismo que None
+    TicketDraft(store="Café Ñandú ☕", total="1234.56", edit_field="store"),
+])
+def test_draft_round_trip(td):
+    assert unpack(pack(td)) == td  # raw_text no va en el registro y vuelve como None
+
+
+def test_raw_text_is_stored_apart():
+    store = DraftStore(MemoryBackend())
+    store.put_sync(1, TicketDraft(store="OXXO", raw_text="OXXO\nTOTAL 101.00"))
+    store.put_sync(1, TicketDraft(store="Oxxo"))  # sin texto: se conserva el que había
+    assert store.get_sync(1).store == "Oxxo"
+    assert store.raw_text_sync(1) == "OXXO\nTOTAL 101.00"
+
+
+def test_unknown_version_is_rejected():
+    data = bytearray(pack(TicketDraft(store="OXXO")))
+    data[0] = 99
+    with pytest.raises(ValueError):
+        unpack(bytes(data))
+
+
+def test_album_round_trip_at_the_limit():
+    album = AlbumState(MAX_ALBUM, editing=MAX_ALBUM - 1)
+    album.toggle(0)
+    back = unpack_album(pack_album(album))
+    assert (back.n, back.included, back.editing) == (MAX_ALBUM, album.included, MAX_ALBUM - 1)
+    assert back.slots() == list(range(1, MAX_ALBUM))
+
+
+@pytest.mark.parametrize("n", [0, MAX_ALBUM + 1])
+def test_album_size_is_enforced(n):
+    with pytest.raises(ValueError):
+        AlbumState(n)
+
+
+def test_album_drafts_are_deleted_together():
+    store = DraftStore(MemoryBackend())
+    store.put_album_sync(1, AlbumState(2), [TicketDraft(store="A", raw_text="a"), TicketDraft(store="B", raw_text="b")])
+    assert [store.get_sync(1, slot=i).store for i in range(2)] == ["A", "B"]
+    store.delete_album_sync(1)
+    assert store.get_album_sync(1) is None
+    assert store.get_sync(1, slot=1) is None and store.raw_text_sync(1, slot=1) is None
@@ -0,0 +1,31 @@
+"""Regresiones de extractor.extract_fields (fechas y totales)."""
+import pytest
+
+from extractor import extract_fields
+
+
+@pytest.mark.parametrize("text, date, total", [
+    # El valor de “pago” no puede tragarse los dígitos de la fecha que le sigue
+    ("OXXO\nPAGO CON TARJETA\n12/05/2024 10:22\nTOTAL 101.00", "12/05/2024", "101.00"),
+    ("FECHA DE PAGO: 12/05/2024", "12/05/2024", None),
+    ("BANORTE\nPAGO 15-03-24 TOTAL 250.00", "15/03/2024", "250.00"),
+    # “mar” dentro de un artículo no es un mes
+    ("MARGARINA 1 25.50", None, "25.50"),
+    ("SORIANA\n12 nov 2025\nTOTAL $ 1,234.56", "12/11/2025", "1234.56"),
+    ("WALMART\nnovi2 25\n99.90", "12/11/2025", "99.90"),
+    ("HEB\n3 marzo 2024\nIMPORTE 45,50", "03/03/2024", "45.50"),
+    # Miles sin centavos: no se corta en el separador
+    ("TOTAL 3,500", None, "3500.00"),
+    ("La Seven\nTOTAL 1,234", None, "1234.00"),
+    ("TOTAL 3.500", None, "3500.00"),
+    ("TIENDA\n3,500", None, "3500.00"),
+    ("TOTAL 1234.56", None, "1234.56"),
+    ("TOTAL 3,50", None, "3.50"),
+])
+def test_date_and_total(text, date, total):
+    _, got_date, got_total = extract_fields(text)
+    assert (got_date, got_total) == (date, total)
+
+
+def test_numbers_inside_a_date_are_not_amounts():
+    assert extract_fields("TIENDA\n12/05/2024\n35.00")[1:] == ("12/05/2024", "35.00")
@@ -0,0 +1,55 @@
+"""Tickets largos en ocr.py: corte en franjas y unión de sus textos."""
+import numpy as np
+import pytest
+
+import ocr
+from ocr import _stitch, _tile_bounds
+
+
+@pytest.fixture
+def tall_receipt():
+    """Ticket de 400×2600 px: renglones de 20 px de tinta cada 50 px."""
+    gray = np.full((2600, 400), 255, np.uint8)
+    for y in range(40, 2560, 50):
+        gray[y:y + 20, 30:370] = 0
+    return gray
+
+
+def test_tiles_cover_the_image_and_cut_between_lines(tall_receipt, monkeypatch):
+    monkeypatch.setattr(ocr, "TILE_THREADS", 4)
+    bounds = _tile_bounds(tall_receipt)
+    assert len(bounds) == 4
+    assert bounds[0][0] == 0 and bounds[-1][1] == bounds[-1][2] == tall_receipt.shape[0]
+    for (top, own_end, bottom), nxt in zip(bounds, bounds[1:] + [None]):
+        assert top < own_end <= bottom
+        if nxt is not None:
+            assert nxt[0] == own_end  # las filas propias no se repiten ni se saltan
+            assert bottom > own_end  # la franja se extiende sobre la siguiente
+    cuts = [own_end for _, own_end, _ in bounds[:-1]] + [bottom for _, _, bottom in bounds[:-1]]
+    assert all(tall_receipt[y].min() == 255 for y in cuts)  # ningún corte parte un renglón
+
+
+def test_short_or_single_threaded_images_are_not_tiled(tall_receipt, monkeypatch):
+    monkeypatch.setattr(ocr, "TILE_THREADS", 4)
+    assert _tile_bounds(tall_receipt[:800]) == []
+    monkeypatch.setattr(ocr, "TILE_THREADS", 1)
+    assert _tile_bounds(tall_receipt) == []
+
+
+def test_stitch_removes_the_repeated_seam():
+    top = "OXXO\nLECHE 28.50\nPAN 45.00\nHUEVO 60.00"
+    bottom = "PAN 45.00\nHUEVO 60.00\nTOTAL 133.50"
+    assert _stitch([top, bottom]) == "OXXO\nLECHE 28.50\nPAN 45.00\nHUEVO 60.00\nTOTAL 133.50"
+
+
+def test_stitch_replaces_a_line_cut_at_the_seam():
+    # La última línea de la franja de arriba salió cortada; la de abajo la trae entera
+    top = "OXXO\nLECHE 28.50\nPAN 45.00\nHUE"
+    bottom = "LECHE 28.50\nPAN 45.00\nHUEVO 60.00\nTOTAL 133.50"
+    assert _stitch([top, bottom]) == "OXXO\nLECHE 28.50\nPAN 45.00\nHUEVO 60.00\nTOTAL 133.50"
+
+
+def test_stitch_keeps_similar_but_different_lines():
+    top = "ARTICULO 10\nARTICULO 11"
+    bottom = "ARTICULO 12\nARTICULO 13"
+    assert _stitch([top, bottom]).splitlines() == ["ARTICULO 10", "ARTICULO 11", "ARTICULO 12", "ARTICULO 13"]
@@ -0,0 +1,87 @@
+"""OCRExecutor: contadores para otros hilos, reparto justo y cancelación."""
+import asyncio
+import time
+
+import pytest
+
+from ocr_pool import OCRCancelled, OCRExecutor, OCRSnapshot
+
+
+@pytest.fixture
+def executor():
+    ex = OCRExecutor(workers=1, max_queue=20)
+    ex.start()
+    yield ex
+    ex.shutdown()
+
+
+def test_snapshot_follows_the_queues(executor):
+    async def main():
+        assert executor.snapshot() == OCRSnapshot(0, 0, 0)
+        jobs = [asyncio.ensure_future(executor.submit(time.sleep, 0.2, user=u)) for u in ("a", "a", "b")]
+        await asyncio.sleep(0.05)
+        busy = executor.snapshot()
+        await asyncio.gather(*jobs)
+        return busy
+
+    assert asyncio.run(main()) == OCRSnapshot(pending=3, waiting=2, users_waiting=2)
+    assert executor.snapshot() == OCRSnapshot(0, 0, 0)
+
+
+async def _run_all(executor, jobs):
+    """Envía (usuario, etiqueta, segundos) en orden; devuelve las etiquetas en el orden en que terminan."""
+    done = []
+
+    async def one(user, tag, seconds):
+        await executor.submit(time.sleep, seconds, user=user)
+        done.append(tag)
+    tasks = []
+    for job in jobs:
+        tasks.append(asyncio.ensure_future(one(*job)))
+        await asyncio.sleep(0)  # que cada uno entre a la fila en este orden
+    await asyncio.gather(*tasks)
+    return done
+
+
+def test_round_robin_between_users(executor):
+    jobs = [("a", "a1", 0.1), ("a", "a2", 0.1), ("a", "a3", 0.1), ("a", "a4", 0.1), ("b", "b1", 0.1), ("c", "c1", 0.1)]
+    done = asyncio.run(_run_all(executor, jobs))
+    # a1 ya corría y a2 tenía el turno; después b y c no esperan al resto de a
+    assert done == ["a1", "a2", "b1", "c1", "a3", "a4"]
+
+
+def test_user_cap_only_applies_while_others_wait():
+    ex = OCRExecutor(workers=2, user_concurrency=1)
+    ex.start()
+    try:
+        async def main():
+            alone = [asyncio.ensure_future(ex.submit(time.sleep, 0.3, user="a")) for _ in range(2)]
+            await asyncio.sleep(0)
+            both_running = ex.snapshot()
+            await asyncio.gather(*alone)
+            # a1 suelta su worker primero; a2 lo tiene ocupado mucho más
+            jobs = [("a", "a1", 0.2), ("a", "a2", 1.0), ("a", "a3", 0.2), ("b", "b1", 0.2)]
+            return both_running, await _run_all(ex, jobs)
+
+        both_running, done = asyncio.run(main())
+        assert both_running == OCRSnapshot(pending=2, waiting=0, users_waiting=0)  # solo, usa todo el pool
+        # Con b esperando, a no toma el worker que suelta a1 (si lo tomara: a1, a3, b1, a2)
+        assert done == ["a1", "b1", "a3", "a2"]
+    finally:
+        ex.shutdown()
+
+
+def test_cancel_drops_waiting_and_running_jobs(executor):
+    async def main():
+        mine = [asyncio.ensure_future(executor.submit(time.sleep, 0.3, user="a")) for _ in range(3)]
+        other = asyncio.ensure_future(executor.submit(time.sleep, 0.1, user="b"))
+        await asyncio.sleep(0.05)
+        n = executor.cancel("a")
+        results = await asyncio.gather(*mine, return_exceptions=True)
+        await other
+        return n, results
+
+    n, results = asyncio.run(main())
+    assert n == 3
+    assert all(isinstance(r, OCRCancelled) for r in results)
+    assert executor.snapshot() == OCRSnapshot(0, 0, 0)
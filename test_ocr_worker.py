@@ -0,0 +1,44 @@
+"""ocr_worker.decode: formatos de entrada (HEIC con y sin pillow-heif)."""
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+from PIL import Image
+
+import ocr_worker
+
+pillow_heif = pytest.importorskip("pillow_heif")
+
+
+@pytest.fixture(scope="module")
+def heic():
+    pillow_heif.register_heif_opener()
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 48), "white").save(buf, format="HEIF")
+    return buf.getvalue()
+
+
+def test_heic_decodes_once_the_worker_is_initialized(heic):
+    ocr_worker.init_worker(1)
+    assert ocr_worker.decode(heic).shape == (48, 64)
+
+
+def test_heic_without_pillow_heif_is_reported(heic, tmp_path):
+    # Proceso aparte: en este el opener de HEIF ya quedó registrado en PIL
+    path = tmp_path / "ticket.heic"
+    path.write_bytes(heic)
+    code = (
+        "import sys; sys.modules['pillow_heif'] = None\n"
+        "import ocr_worker\n"
+        "from ocr_pool import UnsupportedImage\n"
+        "ocr_worker.init_worker(1)\n"
+        "try:\n"
+        f"    ocr_worker.decode(open({str(path)!r}, 'rb').read())\n"
+        "except UnsupportedImage as e:\n"
+        "    print('unsupported:', e)\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert out.stdout.startswith("unsupported:")
@@ -0,0 +1,43 @@
+"""Etapas geométricas de preprocess.py (enderezado)."""
+import cv2
+import numpy as np
+import pytest
+
+import preprocess
+from preprocess import PreprocessConfig, deskew, skew_angle
+
+
+def _receipt():
+    """Renglones de “letras” negras sobre blanco, más anchos que altos como un ticket."""
+    img = np.full((700, 700), 255, np.uint8)
+    for y in range(200, 500, 30):
+        for x in range(150, 550, 40):
+            cv2.rectangle(img, (x, y), (x + 28, y + 14), 0, -1)
+    return img
+
+
+def _rotate(img, angle):
+    h, w = img.shape
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(img, M, (w, h), borderValue=255)
+
+
+@pytest.mark.parametrize("angle", [3, -3, 8, -8])
+def test_deskew_round_trip(angle):
+    tilted = _rotate(_receipt(), angle)
+    assert skew_angle(tilted) == pytest.approx(-angle, abs=0.5)
+    assert abs(skew_angle(deskew(tilted, PreprocessConfig()))) < 0.5
+
+
+def test_straight_image_is_untouched():
+    img = _receipt()
+    assert deskew(img, PreprocessConfig()) is img
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (-87.0, 3.0), (-3.0, -3.0), (-90.0, 0.0),  # OpenCV < 4.5: [-90, 0)
+    (87.0, -3.0), (3.0, 3.0), (90.0, 0.0),     # OpenCV >= 4.5: (0, 90]
+])
+def test_skew_angle_accepts_both_opencv_conventions(monkeypatch, raw, expected):
+    monkeypatch.setattr(preprocess.cv2, "minAreaRect", lambda coords: ((0, 0), (10, 10), raw))
+    assert skew_angle(_receipt()) == pytest.approx(expected)